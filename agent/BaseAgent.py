@@ -1,24 +1,100 @@
+import os
+import time
+import hashlib
 import argparse
+import asyncio
+import contextvars
+import threading
+import termcolor
+from concurrent.futures import Future, ThreadPoolExecutor
 from abc import ABC, abstractmethod
-from typing import List
+from contextlib import aclosing, closing
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from PIL import Image
 
 # Import your existing modules
 from agent.conversation import Conversation, ImageTextConversation, Message
 from agent.llm_utils import (
     chatgpt_completion,
     chatgpt_completion_async,
+    chatgpt_completion_stream,
+    chatgpt_completion_stream_async,
     gpt4v_completion,
+    UsageRecord,
+)
+from agent.action_parser import (
+    Action,
+    StreamingActionParser,
+    batch_actions,
+    parse_actions,
 )
+from agent.app_runner import compact_log, get_supervisor
+from agent.patching import PatchConflict, apply_patch
+from agent.snapshots import SnapshotStore, revert
+from agent.readiness import ReadinessConfig
+from agent.sandbox_launcher import ResourceLimits
+from agent.resource_usage import ResourceUsage
+from agent.preflight import describe, preflight
+from agent.tracing import ACTION_STAGES, annotate, span
+from agent.context_policy import ContextPolicy
 
 from prompt import *
 
 
+@dataclass
+class ActionOutput:
+    """
+    This class is used to store the output of the action taken by the agent.
+    """
+
+    actionable: bool
+    observation: str = ""
+    action_type: str = None
+    file_name: str = None
+    image_observation: Image = None
+
+
 class BaseAgent(ABC):
+    # hops of a run unless `run`/`arun` are given max_hop
+    max_hop = 10
+    # printed above the instruction when a run starts
+    banner = ""
+    # the conversation a run starts, Conversation or ImageTextConversation
+    conversation_class = Conversation
+
     def __init__(self, args):
         self.model = args.model
+        self.stream = getattr(args, "stream", False)
+        self.readiness = ReadinessConfig.from_args(args)
+        # CPU, memory and wall time each launched app may use
+        self.app_limits = ResourceLimits.from_args(args)
+        # what the app of the current run used when it was last observed
+        self.app_usage: Optional[ResourceUsage] = None
+        self.context_policy = ContextPolicy.from_args(args)
+        # byte budget of the app output put into one observation
+        self.log_budget = getattr(args, "log_budget", 4000)
+        self.stable_prefix = getattr(args, "stable_prefix", False)
+        # check written files (syntax, imports, templates) before they are run
+        self.preflight = not getattr(args, "no_preflight", False)
+        # one UsageRecord per API call of the current run
+        self.usage: List[UsageRecord] = []
+        # model turns taken in the current run
+        self.hops = 0
+        # sampling seed; parallel trajectories use different ones to diverge
+        self.seed: Optional[int] = None
+        # set when the run is abandoned (e.g. a losing trajectory or a timed out
+        # task); the hops and actions not taken yet are then skipped
+        self.cancelled = threading.Event()
+        # the call of `arun` running in a worker thread, if any
+        self.in_flight: Optional[asyncio.Future] = None
+        # actions of the last response already taken while it streamed
+        self.streamed: Dict[Action, Future] = {}
 
-    @abstractmethod
-    def run(self, instruction: str) -> List:
+    def run(
+        self, instruction: str, max_hop: Optional[int] = None, VERBOSE: bool = True
+    ) -> List:
         """
         Runs the agent based on the given instruction.
 
@@ -28,4 +104,532 @@ class BaseAgent(ABC):
         Returns:
             List: The response from the agent.
         """
-        pass
+        conversation = self.start(instruction, VERBOSE=VERBOSE)
+        response_text = None
+
+        # Step 3: Task Loop
+        for i in range(max_hop or self.max_hop):
+            if self.cancelled.is_set():
+                break
+            with span("hop", hop=i + 1):
+                # Step 3-1 : get response from the model
+                response_text = self.complete(
+                    conversation, dispatch=True, VERBOSE=VERBOSE
+                )
+                if self.step(conversation, response_text, VERBOSE=VERBOSE):
+                    break
+
+        return [response_text]
+
+    async def arun(
+        self, instruction: str, max_hop: Optional[int] = None, VERBOSE: bool = True
+    ) -> List:
+        """Async counterpart of `run`, so many agents can share one event loop."""
+        conversation = await self.in_thread(self.start, instruction, VERBOSE=VERBOSE)
+        response_text = None
+
+        for i in range(max_hop or self.max_hop):
+            if self.cancelled.is_set():
+                break
+            with span("hop", hop=i + 1):
+                response_text = await self.acomplete(
+                    conversation, dispatch=True, VERBOSE=VERBOSE
+                )
+                # actions touch files, processes and browsers, keep them off the event loop
+                if await self.in_thread(
+                    self.step, conversation, response_text, VERBOSE=VERBOSE
+                ):
+                    break
+
+        return [response_text]
+
+    async def in_thread(self, function, *args, **kwargs):
+        """
+        Runs `function` in a worker thread. The call outlives a cancellation of
+        the caller; await `in_flight` before cleaning up after the agent.
+        """
+        self.in_flight = asyncio.ensure_future(
+            asyncio.to_thread(function, *args, **kwargs)
+        )
+        return await asyncio.shield(self.in_flight)
+
+    @property
+    @abstractmethod
+    def system_prompt(self) -> str:
+        """The system prompt of the agent."""
+
+    def start(self, instruction: str, VERBOSE: bool = True) -> Conversation:
+        """Makes the workspace of a run and returns its initial conversation."""
+        if VERBOSE:
+            print(
+                termcolor.colored(
+                    f"{self.banner}# Instruction: {instruction}\n",
+                    "blue",
+                    attrs=["bold"],
+                )
+            )
+
+        self.usage = []
+        self.app_usage = None
+        self.hops = 0
+
+        # Step 1: make code workspace
+        self.workspace: str = (
+            f"./workspace/{hashlib.md5(f'{time.time()}-{id(self)}'.encode()).hexdigest()}"
+        )
+        os.makedirs(self.workspace, exist_ok=True)
+        # every written file is kept, so REVERT needs no model call
+        self.snapshots = SnapshotStore(self.workspace)
+
+        # Step 2 : create initial conversation
+        # the app port is handed over in the PORT environment variable, not in the
+        # prompt, so identical instructions keep producing identical requests
+        self.port = get_supervisor().port_for(self.workspace)
+        test_messages = [
+            Message(role="system", text=self.system_prompt),
+            Message(role="user", text=instruction),
+        ]
+        return self.conversation_class(
+            messages=test_messages,
+            context_policy=self.context_policy,
+            stable_prefix=self.stable_prefix,
+        )
+
+    def step(self, conversation, response_text: str, VERBOSE: bool = True) -> bool:
+        """
+        Takes the action in the response and records the observation.
+        Returns True when the agent terminated.
+        """
+        print_flag = False
+        self.hops += 1
+        if VERBOSE:
+            self.report_prompt(conversation)
+        conversation.add_message(Message(role="assistant", text=response_text))
+
+        # Take action if possible
+        action_out = self.take_action(response_text, VERBOSE=VERBOSE)
+        self.snapshots.commit(f"hop {self.hops}")
+        conversation.add_message(self.observation_message(action_out))
+        if VERBOSE:
+            print(
+                termcolor.colored(
+                    f"# Observation: {action_out.observation}\n", "dark_grey"
+                )
+            )
+            if action_out.observation == "":
+                print_flag = True
+                print(termcolor.colored(f"Agent : {response_text}", "red"))
+
+        if not action_out.actionable and not print_flag:
+            if VERBOSE:
+                print(termcolor.colored(f"Agent : {response_text}", "yellow"))
+
+        return any(
+            action.kind == "TERMINATE" for action in parse_actions(response_text)
+        )
+
+    def observation_message(self, action_out: ActionOutput) -> Message:
+        """The message that hands the output of a hop's actions to the model."""
+        return Message(role="user", text=action_out.observation)
+
+    def take_action(self, response: str, VERBOSE: bool = True) -> ActionOutput:
+        """
+        Takes every action of the response in order and returns their combined
+        output. WRITE/PATCH/READ actions on distinct files run concurrently,
+        RUN/LOG/SEE wait for everything before them. Written files are checked
+        before anything after them runs. The actions taken while the response
+        streamed are not taken again.
+        """
+        streamed, self.streamed = self.streamed, {}
+        with span("parse"):
+            parsed = parse_actions(response)
+        actions = []
+        thought = False
+        for action in parsed:
+            if action.kind == "THINK":
+                thought = True
+                if VERBOSE:
+                    print(termcolor.colored(f"# Think : \n{action.body}\n", "magenta"))
+            elif action.kind != "TERMINATE":
+                actions.append(action)
+
+        outputs = []
+        for batch in batch_actions(actions):
+            todo = [action for action in batch if action not in streamed]
+            if len(todo) == 1:
+                taken = [self.execute_action(todo[0], VERBOSE=VERBOSE)]
+            elif todo:
+                # each action keeps the caller's context (e.g. its tracer)
+                contexts = [contextvars.copy_context() for _ in todo]
+                with ThreadPoolExecutor(max_workers=len(todo)) as pool:
+                    taken = list(
+                        pool.map(
+                            lambda context, action: context.run(
+                                self.execute_action, action, VERBOSE=VERBOSE
+                            ),
+                            contexts,
+                            todo,
+                        )
+                    )
+            else:
+                taken = []
+            outputs_of = dict(zip(todo, taken))
+            results = [
+                streamed[action].result() if action in streamed else outputs_of[action]
+                for action in batch
+            ]
+            # after the whole batch, so files written together see each other
+            self.check_written(batch, results)
+            outputs.extend(zip(batch, results))
+
+        if not outputs:
+            if thought:
+                return ActionOutput(
+                    actionable=True,
+                    action_type="Think",
+                    observation="Ok.",
+                )
+            return ActionOutput(actionable=False)
+        if len(outputs) == 1:
+            return outputs[0][1]
+        return ActionOutput(
+            actionable=any(output.actionable for _, output in outputs),
+            observation="\n\n".join(
+                f"{action.kind}({action.target}) : {output.observation}"
+                for action, output in outputs
+            ),
+            action_type=outputs[-1][1].action_type,
+            file_name=outputs[-1][1].file_name,
+            # the latest screenshot taken in this hop
+            image_observation=next(
+                (
+                    output.image_observation
+                    for _, output in reversed(outputs)
+                    if output.image_observation is not None
+                ),
+                None,
+            ),
+        )
+
+    def execute_action(self, action: Action, VERBOSE: bool = True) -> ActionOutput:
+        if self.cancelled.is_set():
+            return ActionOutput(
+                actionable=False,
+                observation=f"{action.kind}({action.target}) was not taken, the run was cancelled.",
+            )
+        if VERBOSE:
+            print(
+                termcolor.colored(
+                    f"# Action {action.kind}({action.target})",
+                    "green",
+                )
+            )
+        with span(
+            ACTION_STAGES.get(action.kind, "action"),
+            action=action.kind,
+            target=action.target or "",
+        ) as action_span:
+            action_output = self._execute_action(action, VERBOSE=VERBOSE)
+            if action_span is not None:
+                action_span.attributes["observation_bytes"] = len(
+                    (action_output.observation or "").encode("utf-8")
+                )
+            return action_output
+
+    def _execute_action(self, action: Action, VERBOSE: bool = True) -> ActionOutput:
+        """Takes one action; agents with more actions (e.g. SEE) extend it."""
+        action_type, file_name = action.kind, action.target
+
+        if action_type == "WRITE":
+            if action.body is not None:
+                if VERBOSE:
+                    print(termcolor.colored(f"\n{action.body}\n", "light_grey"))
+                self.write_file(file_name, action.body)
+                return ActionOutput(
+                    actionable=True,
+                    action_type=action_type,
+                    file_name=file_name,
+                    observation=f"You have written the code to {file_name}",
+                )
+            else:
+                return ActionOutput(
+                    actionable=False,
+                    observation="You choose to write the file but did not provide the code block",
+                )
+
+        elif action_type == "PATCH":
+            if action.body is not None:
+                if VERBOSE:
+                    print(termcolor.colored(f"\n{action.body}\n", "light_grey"))
+                return self.patch_file(file_name, action.body)
+            else:
+                return ActionOutput(
+                    actionable=False,
+                    observation="You choose to patch the file but did not provide the patch block",
+                )
+
+        elif action_type == "READ":
+            file_path = os.path.join(self.workspace, file_name)
+            if os.path.exists(file_path):
+                with open(file_path, "r") as file:
+                    content = file.read()
+                return ActionOutput(
+                    actionable=True,
+                    action_type=action_type,
+                    file_name=file_name,
+                    observation=f"Content of the file {file_name} : \n{content}",
+                )
+            else:
+                return ActionOutput(
+                    actionable=False,
+                    observation=f"File {file_name} does not exist.",
+                )
+
+        elif action_type == "RUN":
+            # Run the file
+            return self.run_app(file_name)
+
+        elif action_type == "LOG":
+            return self.read_app_log(file_name)
+
+        elif action_type == "REVERT":
+            observation = revert(self.snapshots, file_name)
+            if observation is None:
+                return ActionOutput(
+                    actionable=False,
+                    observation=f"Nothing was reverted, there is no snapshot or earlier version {file_name}.",
+                )
+            return ActionOutput(
+                actionable=True,
+                action_type="REVERT",
+                file_name=file_name,
+                observation=observation,
+            )
+
+        return ActionOutput(actionable=False)
+
+    def write_file(self, file_name: str, content: str):
+        file_path = os.path.join(self.workspace, file_name)
+        # make sure parent directory exists (e.g. templates/)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as file:
+            file.write(content)
+        self.snapshots.record(file_name, content)
+
+    def patch_file(self, file_name: str, patch: str) -> ActionOutput:
+        file_path = os.path.join(self.workspace, file_name)
+        if not os.path.exists(file_path):
+            return ActionOutput(
+                actionable=False,
+                observation=f"File {file_name} does not exist, use WRITE({file_name}) to create it.",
+            )
+        with open(file_path, "r") as file:
+            content = file.read()
+
+        try:
+            patched, hunks = apply_patch(content, patch)
+        except PatchConflict as conflict:
+            return ActionOutput(
+                actionable=False,
+                action_type="PATCH",
+                file_name=file_name,
+                observation=f"The patch was not applied, {file_name} is unchanged.\n{conflict}",
+            )
+
+        self.write_file(file_name, patched)
+        return ActionOutput(
+            actionable=True,
+            action_type="PATCH",
+            file_name=file_name,
+            observation=f"You have applied {hunks} change(s) to {file_name}",
+        )
+
+    def run_app(self, file_name: str) -> ActionOutput:
+        app, readiness = get_supervisor().launch(
+            self.workspace, file_name, self.readiness, self.app_limits
+        )
+        output = compact_log(app.read_new(), self.log_budget).strip()
+        if readiness.port:
+            # the port the app actually listens on (SEE paths resolve against it)
+            self.port = readiness.port
+
+        observation = (
+            output if output else f"Running python3 {file_name} got no output."
+        )
+        usage = self.observe_usage(app)
+        if readiness.status == "ready":
+            snapshot = self.snapshots.mark_good(f"hop {self.hops}, {file_name} up")
+            observation += f"\n[These files are snapshot {snapshot.id}]"
+
+        return ActionOutput(
+            actionable=True,
+            action_type="RUN",
+            file_name=file_name,
+            observation=f"{observation}\n{readiness.describe()} {usage}".rstrip(),
+        )
+
+    def read_app_log(self, file_name: str) -> ActionOutput:
+        app = get_supervisor().get(self.workspace)
+        if app is None:
+            return ActionOutput(
+                actionable=False,
+                observation=f"{file_name} is not running, use RUN({file_name}) first.",
+            )
+
+        app.read_new()  # everything is observed from here on
+        status = "running" if app.is_alive() else "exited"
+        header = f"Full output of {file_name} ({status})"
+        usage = self.observe_usage(app)
+        if usage:
+            header += f" {usage}"
+        return ActionOutput(
+            actionable=True,
+            action_type="LOG",
+            file_name=file_name,
+            observation=f"{header} : \n{app.read_output()}",
+        )
+
+    def observe_usage(self, app) -> str:
+        """
+        Records the peak RSS and CPU seconds of a launched app (in the current
+        span too) and returns them for the observation.
+        """
+        usage = app.usage()
+        if usage is None:
+            return ""
+        self.app_usage = usage
+        annotate(
+            peak_rss_mb=round(usage.peak_rss_mb, 1),
+            cpu_seconds=round(usage.cpu_seconds, 3),
+        )
+        return usage.describe()
+
+    def check_written(self, actions, outputs):
+        """
+        Appends the problems the pre-flight check finds in the files that WRITE
+        and PATCH actions wrote to their observations. The files are checked
+        concurrently (a JavaScript check starts a node process).
+        """
+        written = [
+            (action, output)
+            for action, output in zip(actions, outputs)
+            if self.preflight
+            and action.kind in ("WRITE", "PATCH")
+            and output.actionable
+        ]
+
+        def check(action, output):
+            with span("preflight", target=action.target):
+                problems = preflight(self.workspace, action.target)
+                annotate(problems=len(problems))
+            if problems:
+                output.observation += "\n" + describe(problems)
+
+        if len(written) == 1:
+            check(*written[0])
+        elif written:
+            # each check keeps the caller's context (e.g. its tracer)
+            contexts = [contextvars.copy_context() for _ in written]
+            with ThreadPoolExecutor(max_workers=len(written)) as pool:
+                list(
+                    pool.map(
+                        lambda context, pair: context.run(check, *pair),
+                        contexts,
+                        written,
+                    )
+                )
+
+    def complete(
+        self, conversation, dispatch: bool = False, VERBOSE: bool = True
+    ) -> str:
+        """
+        Gets the next response from the model. When streaming is enabled the
+        generation is cut as soon as the response reaches an action whose result
+        the model needs (e.g. RUN), so the actions can be dispatched without
+        waiting for the trailing text. With `dispatch`, the leading WRITE/PATCH
+        blocks are taken (in order, in a worker thread) as soon as each is
+        complete; `take_action` then uses their outputs.
+        """
+        self.streamed = {}
+        if not self.stream:
+            return chatgpt_completion(
+                conversation, self.model, usage_log=self.usage, seed=self.seed
+            )
+
+        parser = StreamingActionParser()
+        with ThreadPoolExecutor(max_workers=1) as pool, closing(
+            chatgpt_completion_stream(
+                conversation, self.model, usage_log=self.usage, seed=self.seed
+            )
+        ) as stream:
+            for delta in stream:
+                stopped = parser.feed(delta)
+                if dispatch:
+                    self.dispatch_ready(parser, pool, VERBOSE)
+                if stopped:
+                    break
+        return parser.response
+
+    async def acomplete(
+        self, conversation, dispatch: bool = False, VERBOSE: bool = True
+    ) -> str:
+        """Async counterpart of `complete`."""
+        self.streamed = {}
+        if not self.stream:
+            # same sampling as `complete`: leave everything to the API defaults
+            return await chatgpt_completion_async(
+                conversation,
+                self.model,
+                max_tokens=None,
+                top_p=None,
+                temperature=None,
+                usage_log=self.usage,
+                seed=self.seed,
+            )
+
+        parser = StreamingActionParser()
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            async with aclosing(
+                chatgpt_completion_stream_async(
+                    conversation, self.model, usage_log=self.usage, seed=self.seed
+                )
+            ) as stream:
+                async for delta in stream:
+                    stopped = parser.feed(delta)
+                    if dispatch:
+                        self.dispatch_ready(parser, pool, VERBOSE)
+                    if stopped:
+                        break
+        finally:
+            pool.shutdown(wait=False)
+        # the actions finish off the event loop
+        await asyncio.gather(
+            *(asyncio.wrap_future(future) for future in self.streamed.values()),
+            return_exceptions=True,
+        )
+        return parser.response
+
+    def dispatch_ready(self, parser: StreamingActionParser, pool, VERBOSE: bool):
+        """Submits the WRITE/PATCH blocks the stream completed since the last call."""
+        for action in parser.ready_actions():
+            self.streamed[action] = pool.submit(
+                contextvars.copy_context().run,
+                self.execute_action,
+                action,
+                VERBOSE=VERBOSE,
+            )
+
+    def report_prompt(self, conversation):
+        """Prints the size of the last prompt and the usage the API reported for it."""
+        if conversation.prompt_stats:
+            print(
+                termcolor.colored(
+                    f"# Prompt : {conversation.prompt_stats[-1].describe()}",
+                    "dark_grey",
+                )
+            )
+        if self.usage:
+            print(
+                termcolor.colored(f"# Usage : {self.usage[-1].describe()}", "dark_grey")
+            )
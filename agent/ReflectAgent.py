@@ -1,38 +1,15 @@
-import argparse
-from typing import List
-import time, os, hashlib
-import subprocess, shlex, signal
-import re
-from PIL import Image
-import io
-from dataclasses import dataclass
-import termcolor
+from dataclasses import replace
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
 
-from agent.conversation import Conversation, ImageTextConversation, Message
-from agent.llm_utils import (
-    chatgpt_completion,
-    chatgpt_completion_async,
-    gpt4v_completion,
-)
+from agent.conversation import ImageTextConversation, Message
+from agent.image_pipeline import ImagePipeline, ImagePipelineConfig
+from agent.browser_pool import BrowserOptions, get_shared_pool
 
 from prompt import REFLECT_AGENT_SYSTEM_PROMPT
-from agent.BaseAgent import BaseAgent
-
-
-@dataclass
-class ActionOutput:
-    """
-    This class is used to store the output of the action taken by the agent.
-    """
-
-    actionable: bool
-    observation: str = ""
-    action_type: str = None
-    file_name: str = None
-    image_observation: Image = None
+from agent.BaseAgent import ActionOutput, BaseAgent
+from agent.app_runner import compact_log, get_supervisor
+from agent.action_parser import Action
 
 
 class ReflectAgent(BaseAgent):
@@ -40,242 +17,88 @@ class ReflectAgent(BaseAgent):
     ReAct + [WebSite SEE] Action
     """
 
-    def run(self, instruction: str, max_hop: int = 15, VERBOSE: bool = True) -> List:
-        if VERBOSE:
-            print(
-                termcolor.colored(
-                    f"<REFLECT AGENT>\n# Instruction: {instruction}\n",
-                    "blue",
-                    attrs=["bold"],
-                )
-            )
-
-        # Step 1: make code workspace
-        self.workspace: str = (
-            f"./workspace/{hashlib.md5(str(time.time()).encode()).hexdigest()}"
+    max_hop = 15
+    banner = "<REFLECT AGENT>\n"
+    conversation_class = ImageTextConversation
+    system_prompt = REFLECT_AGENT_SYSTEM_PROMPT
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.image_config = ImagePipelineConfig.from_args(args)
+        # older screenshots are left out of the prompt, not deleted from the history
+        self.context_policy = replace(
+            self.context_policy, keep_last_images=self.image_config.keep_last_images
+        )
+        self.browser_pool_size = getattr(args, "browser_pool_size", 2)
+        self.browser_options = BrowserOptions(
+            full_page=getattr(args, "full_page", False)
         )
-        os.makedirs(self.workspace, exist_ok=True)
-
-        # Step 2 : create initial conversation
-        test_messages = [
-            Message(role="system", text=REFLECT_AGENT_SYSTEM_PROMPT),
-            Message(role="user", text=instruction),
-        ]
-        conversation = ImageTextConversation(messages=test_messages)
 
-        # Step 3: Task Loop
-        for i in range(max_hop):
-            print_flag = False
-            # Step 3-1 : get response from the model
-            response_text = chatgpt_completion(conversation, self.model)
-            conversation.add_message(Message(role="assistant", text=response_text))
+    def start(self, instruction: str, VERBOSE: bool = True) -> ImageTextConversation:
+        conversation = super().start(instruction, VERBOSE=VERBOSE)
+        # screenshots are compared against the previous one of this run only
+        self.image_pipeline = ImagePipeline(self.image_config)
+        return conversation
+
+    def observation_message(self, action_out: ActionOutput) -> Message:
+        return Message(
+            role="user",
+            text=f"# Observation : {action_out.observation}",
+            image_path=action_out.image_observation,
+            image_format=self.image_config.format,
+            image_quality=self.image_config.quality,
+        )
 
-            # Take action if possible
-            action_out = self.take_action(response_text, VERBOSE=VERBOSE)
-            if action_out.action_type == "SEE":
-                conversation.add_message(
-                    Message(
-                        role="user",
-                        text=f"# Observation : {action_out.observation}",
-                        image_path=action_out.image_observation,
-                    )
+    def _execute_action(self, action: Action, VERBOSE: bool = True) -> ActionOutput:
+        if action.kind != "SEE":
+            return super()._execute_action(action, VERBOSE=VERBOSE)
+
+        url = action.target
+        if url.startswith("/"):
+            # a path of the running app, e.g. right after RUN in the same hop
+            url = f"http://127.0.0.1:{self.port}{url}"
+
+        # take screenshot of the url
+        try:
+            screenshot = self.capture_screenshot(url)
+        except WebDriverException as error:  # e.g. a page load timeout
+            screenshot = None
+            reason = (error.msg or type(error).__name__).strip().split("\n", 1)[0]
+            observation = f"No screenshot of {url} could be taken : {reason}"
+        if screenshot is None:
+            image = None
+        else:
+            image = self.image_pipeline.process(screenshot, url)
+            if image is None:
+                observation = (
+                    f"The page at {url} looks the same as in your last screenshot."
                 )
             else:
-                conversation.add_message(
-                    Message(
-                        role="user", text=f"# Observation : {action_out.observation}"
-                    )
-                )
-            if VERBOSE:
-                print(
-                    termcolor.colored(
-                        f"# Observation: {action_out.observation}\n", "dark_grey"
-                    )
-                )
-                if action_out.observation == "":
-                    print_flag = True
-                    print(termcolor.colored(f"Agent : {response_text}", "red"))
-
-            if not action_out.actionable and not print_flag:
-                if VERBOSE:
-                    print(termcolor.colored(f"Agent : {response_text}", "yellow"))
-
-            if "# Termin" in response_text[:33].strip():
-                break
-
-        return [response_text]
-
-    def take_action(self, response: str, VERBOSE: bool = True):
-        """
-        This function takes the response from the agent and checks if it is actionable.
-        """
-        action_match = re.search(r"# Action\((WRITE|READ|RUN)\(([^)]+)\)\)", response)
-        think_match = re.search(r"# Think", response)
-        see_match = re.search(r"# See\(([^)]+)\)", response)
-
-        if think_match:
-            think_content = re.search(r"# Think\n([\s\S]*)", response).group(1)
-            if VERBOSE:
-                print(termcolor.colored(f"# Think : \n{think_content}\n", "magenta"))
-            return ActionOutput(
-                actionable=True,
-                action_type="Think",
-                observation="Ok.",
-            )
-
-        elif action_match:
-            action_type = action_match.group(1)
-            file_name = action_match.group(2)
-
-            if VERBOSE:
-                print(
-                    termcolor.colored(
-                        f"# Action {action_type}({file_name})",
-                        "green",
-                    )
-                )
-
-            if action_type == "WRITE":
-                if action_type == "WRITE":
-                    code_block_match = re.search(
-                        r"```(?:html|css|js|javascript|python)\n([\s\S]*?)\n```",
-                        response,
-                    )
-                    if code_block_match:
-                        code_content = code_block_match.group(1)
-                        if VERBOSE:
-                            print(
-                                termcolor.colored(
-                                    f"\n{code_content}\n",
-                                    "light_grey",
-                                )
-                            )
-                        self.write_file(file_name, code_content)
-                        return ActionOutput(
-                            actionable=True,
-                            action_type=action_type,
-                            file_name=file_name,
-                            observation=f"You have written the code to {file_name}",
-                        )
-                    else:
-                        return ActionOutput(
-                            actionable=False,
-                            observation="You choose to write the file but did not provide the code block",
-                        )
-
-                # write the file on
-
-            elif action_type == "READ":
-                file_path = os.path.join(self.workspace, file_name)
-                if os.path.exists(file_path):
-                    with open(file_path, "r") as file:
-                        content = file.read()
-                    return ActionOutput(
-                        actionable=True,
-                        action_type=action_type,
-                        file_name=file_name,
-                        observation=f"Content of the file {file_name} : \n{content}",
-                    )
-                else:
-                    return ActionOutput(
-                        actionable=False,
-                        observation=f"File {file_name} does not exist.",
-                    )
-
-            elif action_type == "RUN":
-                # Run the file
-                action_out = self.run_flask_app_with_tmux(file_name)
-                return action_out
+                observation = f"Here is the screenshot of the URL: {url}"
 
-            return ActionOutput(
-                actionable=True,
-                action_type=action_type,
-                file_name=file_name,
-                observation="",
-            )
+        # what the app logged while serving the page (e.g. a 500 traceback)
+        app = get_supervisor().get(self.workspace)
+        if app is not None:
+            new_output = compact_log(app.read_new(), self.log_budget)
+            if new_output:
+                observation += f"\nNew app output :\n{new_output}"
 
-        elif see_match:
-            url = see_match.group(1)
-
-            if VERBOSE:
-                print(
-                    termcolor.colored(
-                        f"# See {url}",
-                        "green",
-                    )
-                )
-
-            # take screenshot of the url
-            image = self.capture_screenshot(url)
-
-            return ActionOutput(
-                actionable=True,
-                action_type="SEE",
-                observation=f"Here is the screenshot of the URL: {url}",
-                image_observation=image,
-            )
-
-        else:
-            return ActionOutput(actionable=False)
-
-    def write_file(self, file_name: str, content: str):
-        file_path = os.path.join(self.workspace, file_name)
-        # make sure parent directory exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w") as file:
-            file.write(content)
-        # print(f"File written: {file_path}")
-
-    def capture_screenshot(self, url):
-        # Set up Chrome options
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")  # Ensure GUI is off
-        chrome_options.add_argument("--window-size=1920x1080")  # Set the window size
-
-        # Set path to Chromedriver as needed or ensure it's in your PATH
-        driver = webdriver.Chrome(options=chrome_options)
-
-        # Fetch the URL
-        driver.get(url)
-
-        # Get screenshot as a binary data
-        screenshot = driver.get_screenshot_as_png()
-
-        # Convert binary data to PIL Image
-        image = Image.open(io.BytesIO(screenshot))
-
-        # Close the browser
-        driver.quit()
-
-        return image
-
-    def run_flask_app_with_tmux(self, file_name: str) -> ActionOutput:
-        file_path = os.path.join(self.workspace, file_name)
-        session_name = "flask_app"
-
-        # kill session if exists
-        if os.system(f"tmux has-session -t {session_name}") == 0:
-            os.system(f"tmux kill-session -t {session_name}")
-
-        # Start the Flask app in a new detached tmux session
-        start_command = f"tmux new -d -s {session_name} 'python3 {file_path}'"
-        start_result = subprocess.run(start_command, shell=True)
-
-        time.sleep(5)  # wait for the server to start
-        capture_command = f"tmux capture-pane -p -S - -E - -t {session_name}"
-        result = subprocess.run(
-            capture_command, shell=True, text=True, capture_output=True
+        return ActionOutput(
+            actionable=screenshot is not None,
+            action_type="SEE",
+            observation=observation,
+            image_observation=image,
         )
 
-        observation = (
-            result.stdout.strip()
-            if result.stdout.strip()
-            else f"Running python3 {file_name} got no output."
+    def capture_screenshot(self, url):
+        # browsers are kept warm in a pool shared by every agent of the process
+        pool = get_shared_pool(
+            size=self.browser_pool_size, options=self.browser_options
         )
+        return pool.screenshot(url)
 
-        return ActionOutput(
-            actionable=True,
-            action_type="RUN",
-            file_name=file_name,
-            observation=observation,
-        )
+    def run_app(self, file_name: str) -> ActionOutput:
+        output = super().run_app(file_name)
+        # the next SEE shows the page of this launch even if it looks the same
+        self.image_pipeline.reset()
+        return output
@@ -17,15 +17,27 @@ from typing import List
 
 
 class SimpleCodeAgent(BaseAgent):
+    system_prompt = SIMPLE_AGENT_SYSTEM_PROMPT
 
     def run(self, instruction: str, max_hop: int = 10) -> List:
         test_messages = [
-            Message(role="system", text=SIMPLE_AGENT_SYSTEM_PROMPT),
+            Message(role="system", text=self.system_prompt),
             Message(role="user", text=instruction),
         ]
         # Create a Conversation instance with test messages
         conversation = Conversation(messages=test_messages)
 
-        response_text = chatgpt_completion(conversation, self.model)
+        response_text = self.complete(conversation)
+
+        return [response_text]
+
+    async def arun(self, instruction: str, max_hop: int = 10) -> List:
+        test_messages = [
+            Message(role="system", text=self.system_prompt),
+            Message(role="user", text=instruction),
+        ]
+        conversation = Conversation(messages=test_messages)
+
+        response_text = await self.acomplete(conversation)
 
         return [response_text]
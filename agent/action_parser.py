@@ -0,0 +1,211 @@
+import os
+import re
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# Every header and code fence of a response, found in one pass over its lines.
+TOKEN_PATTERN = re.compile(
+    r"^[ \t]*(?:"
+    r"# Action\((?P<action>WRITE|PATCH|READ|RUN|LOG|REVERT)\((?P<target>[^)\n]+)\)\)"
+    r"|# See\((?P<url>[^)\n]+)\)"
+    r"|# (?P<think>Think)"
+    r"|# (?P<terminate>Termin)"
+    r"|(?P<fence>```)(?P<lang>[\w+-]*)[ \t]*$"
+    r")",
+    re.MULTILINE,
+)
+# actions followed by a fenced code block
+BLOCK_KINDS = ("WRITE", "PATCH")
+# actions whose result the model needs before it can go on
+STOP_KINDS = ("READ", "RUN", "LOG", "SEE", "TERMINATE")
+# actions that may directly follow a stopping action in the same hop
+STOP_FOLLOWERS = {"READ": ("READ",), "RUN": ("SEE",), "SEE": ("SEE",)}
+# actions on distinct files that can run at the same time
+CONCURRENT_KINDS = ("WRITE", "PATCH", "READ")
+
+
+@dataclass(frozen=True)
+class Action:
+    """
+    One action of a response. `kind` is WRITE, PATCH, READ, RUN, LOG, REVERT, SEE,
+    THINK or TERMINATE; `target` the file name or URL; `body` the code block of
+    WRITE/PATCH (None if it is missing) or the text of THINK. `start`,
+    `header_end` and `end` are offsets into the response.
+    """
+
+    kind: str
+    target: Optional[str] = None
+    body: Optional[str] = None
+    start: int = 0
+    header_end: int = 0
+    end: int = 0
+
+
+def _header_of(match: re.Match) -> Optional[Tuple[str, Optional[str]]]:
+    if match.group("action"):
+        return match.group("action"), match.group("target").strip()
+    if match.group("url"):
+        return "SEE", match.group("url").strip()
+    if match.group("think"):
+        return "THINK", None
+    if match.group("terminate"):
+        return "TERMINATE", None
+    return None
+
+
+@lru_cache(maxsize=1024)  # the context policy parses the whole history every hop
+def parse_actions(response: str) -> Tuple[Action, ...]:
+    """
+    The actions of a response, in order. Headers inside code blocks are code,
+    not actions, and a `# Think` does not hide the actions that follow it.
+    """
+    actions: List[Action] = []
+    fence: Optional[re.Match] = None  # the opening fence of the current code block
+
+    def close_think(until: int):
+        if actions and actions[-1].kind == "THINK" and actions[-1].body is None:
+            think = actions[-1]
+            actions[-1] = replace(
+                think, body=response[think.header_end : until].strip(), end=until
+            )
+
+    for match in TOKEN_PATTERN.finditer(response):
+        if match.group("fence"):
+            if fence is None:
+                fence = match
+            elif not match.group("lang"):
+                last = actions[-1] if actions else None
+                if last and last.kind in BLOCK_KINDS and last.body is None:
+                    body = response[fence.end() + 1 : max(match.start() - 1, 0)]
+                    actions[-1] = replace(last, body=body, end=match.end())
+                fence = None
+            continue
+        if fence is not None:
+            continue
+
+        kind, target = _header_of(match)
+        close_think(match.start())
+        header_end = match.end()
+        if kind == "TERMINATE":
+            line_end = response.find("\n", header_end)
+            header_end = len(response) if line_end == -1 else line_end
+        actions.append(
+            Action(kind, target, None, match.start(), header_end, header_end)
+        )
+
+    close_think(len(response))
+    return tuple(actions)
+
+
+def batch_actions(actions: List[Action]) -> List[List[Action]]:
+    """
+    Splits actions into batches that run one after the other. Consecutive
+    WRITE/PATCH/READ actions on distinct files share a batch and may run
+    concurrently; any other action (RUN, LOG, REVERT, SEE) is a batch of its own.
+    """
+    batches: List[List[Action]] = []
+    for action in actions:
+        last = batches[-1] if batches else None
+        if (
+            last is not None
+            and action.kind in CONCURRENT_KINDS
+            and last[0].kind in CONCURRENT_KINDS
+            and os.path.normpath(action.target)
+            not in {os.path.normpath(other.target) for other in last}
+        ):
+            last.append(action)
+        else:
+            batches.append([action])
+    return batches
+
+
+class StreamingActionParser:
+    """
+    Consumes a response token by token and reports as soon as it reaches an
+    action whose result the model needs before going on (READ, RUN, LOG, SEE
+    or a terminate), so the caller can stop generation and dispatch. WRITE and
+    PATCH blocks do not stop the stream: more actions may follow in the same hop.
+    Neither do the STOP_FOLLOWERS of a stopping action written right after it
+    (more READs, or a SEE after RUN); the stream stops at the first other line.
+    The WRITE/PATCH blocks completed so far are in `ready_actions`.
+    """
+
+    def __init__(self):
+        self.text: str = ""
+        self.end: Optional[int] = None
+        self.action_type: Optional[str] = None  # kind of the action that stopped it
+        self._scanned: int = 0  # tokens are searched on complete lines only
+        self._in_fence: bool = False
+        # (kind, end) of a stopping action that may still get followers
+        self._pending: Optional[Tuple[str, int]] = None
+        self._block_closed: bool = False  # a code block ended since `ready_actions`
+        self._ready: int = 0  # actions `ready_actions` returned so far
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    @property
+    def response(self) -> str:
+        """The response up to the end of the stopping action (or all of it)."""
+        return self.text if self.end is None else self.text[: self.end]
+
+    def feed(self, delta: str) -> bool:
+        """Appends a streamed chunk. Returns True once a stopping action is complete."""
+        self.text += delta
+        if self.complete:
+            return True
+
+        line_end = self.text.rfind("\n")
+        if line_end < self._scanned:
+            return False
+        for line in self.text[self._scanned : line_end].split("\n"):
+            line_start = self._scanned
+            self._scanned += len(line) + 1
+            match = TOKEN_PATTERN.match(self.text, line_start, self._scanned - 1)
+            is_fence = match is not None and bool(match.group("fence"))
+            if self._in_fence:
+                if is_fence and not match.group("lang"):
+                    self._in_fence = False
+                    self._block_closed = True
+                continue
+
+            kind = None if match is None or is_fence else _header_of(match)[0]
+            if self._pending is not None and line.strip():
+                pending_kind, pending_end = self._pending
+                if kind not in STOP_FOLLOWERS[pending_kind]:
+                    self._finish(pending_kind, pending_end)
+                    break
+
+            if is_fence:
+                self._in_fence = True
+            elif kind in STOP_FOLLOWERS:
+                self._pending = (kind, match.end())
+            elif kind in STOP_KINDS:
+                self._finish(kind, self._scanned - 1)
+                break
+        return self.complete
+
+    def ready_actions(self) -> List[Action]:
+        """
+        The WRITE/PATCH actions whose code block is complete and that only other
+        WRITE/PATCH actions come before, each returned once: they can be taken
+        while the rest of the response streams.
+        """
+        if not self._block_closed:
+            return []
+        self._block_closed = False
+        ready = []
+        for action in parse_actions(self.text[: self._scanned]):
+            if action.kind == "THINK":
+                continue
+            if action.kind not in BLOCK_KINDS or action.body is None:
+                break
+            ready.append(action)
+        new, self._ready = ready[self._ready :], max(self._ready, len(ready))
+        return new
+
+    def _finish(self, action_type: str, end: int):
+        self.action_type = action_type
+        self.end = end
@@ -0,0 +1,353 @@
+import os
+import re
+import signal
+import socket
+import atexit
+import time
+import threading
+from collections import deque
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+
+from agent.readiness import ReadinessConfig, ReadinessResult, wait_until_ready
+from agent.resource_usage import (
+    AppCgroup,
+    ResourceUsage,
+    process_usage,
+    rusage_usage,
+)
+from agent.sandbox_launcher import (
+    InterpreterPool,
+    ResourceLimits,
+    WarmInterpreter,
+)
+
+# terminal colors are noise in an observation
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# werkzeug request log: 127.0.0.1 - - [18/Oct/2026 08:26:34] "GET / HTTP/1.1" 200 -
+REQUEST_LOG_PATTERN = re.compile(r'^(?P<client>\S+ - - )\[[^\]]*\] (?P<request>".*)$')
+# files a running Flask app reads on every request, so changing them needs no restart
+HOT_DIRECTORIES = ("templates", "static")
+
+
+def find_free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def file_states(workspace: str) -> Dict[str, Tuple[int, int]]:
+    """Relative path -> (mtime_ns, size) of every file of the workspace."""
+    states = {}
+    for root, directories, files in os.walk(workspace):
+        directories[:] = [
+            name
+            for name in directories
+            if not name.startswith(".") and name != "__pycache__"
+        ]
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # removed while walking
+                continue
+            states[os.path.relpath(path, workspace)] = (stat.st_mtime_ns, stat.st_size)
+    return states
+
+
+def changed_files(
+    before: Dict[str, Tuple[int, int]], after: Dict[str, Tuple[int, int]]
+) -> List[str]:
+    return sorted(
+        path for path in set(before) | set(after) if before.get(path) != after.get(path)
+    )
+
+
+def is_hot(path: str) -> bool:
+    """Whether the running app picks up a change of `path` by itself."""
+    parts = path.split(os.sep)
+    return len(parts) > 1 and parts[0] in HOT_DIRECTORIES and not path.endswith(".py")
+
+
+def compact_log(lines: List[str], max_bytes: Optional[int] = 4000) -> str:
+    """
+    Makes log lines fit an observation: repeated request-log lines are collapsed
+    into one (timestamps ignored) and the result is cut to `max_bytes`, keeping
+    its head (startup banner) and, mostly, its tail (latest errors).
+    """
+    collapsed: List[List] = []  # [line, count]
+    seen: Dict[str, List] = {}
+    for line in lines:
+        match = REQUEST_LOG_PATTERN.match(line)
+        if match is None:
+            collapsed.append([line, 1])
+            continue
+        key = match.group("client") + match.group("request")
+        if key in seen:
+            seen[key][1] += 1
+        else:
+            seen[key] = [key, 1]
+            collapsed.append(seen[key])
+    compacted = [
+        line if count == 1 else f"{line} (x{count})" for line, count in collapsed
+    ]
+
+    text = "\n".join(compacted)
+    if max_bytes is None or len(text.encode("utf-8")) <= max_bytes:
+        return text
+
+    head_budget, tail_budget = max_bytes // 4, max_bytes - max_bytes // 4
+    head, tail = [], []
+    for line in compacted:
+        head_budget -= len(line.encode("utf-8")) + 1
+        if head_budget < 0:
+            break
+        head.append(line)
+    for line in reversed(compacted[len(head) :]):
+        tail_budget -= len(line.encode("utf-8")) + 1
+        if tail_budget < 0:
+            break
+        tail.append(line)
+    omitted = len(compacted) - len(head) - len(tail)
+    return "\n".join(
+        head + [f"[... {omitted} lines omitted ...]"] + list(reversed(tail))
+    )
+
+
+class OutputBuffer:
+    """
+    Keeps the last `max_lines` lines of a process' output. Lines are numbered,
+    so readers can keep a cursor and fetch only what is new.
+    """
+
+    def __init__(self, max_lines: int = 2000):
+        self._lines = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self.total = 0  # lines appended so far, i.e. the cursor after the last line
+
+    def append(self, line: str):
+        with self._lock:
+            self._lines.append(line)
+            self.total += 1
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            return list(self._lines)
+
+    def read_since(self, cursor: int) -> Tuple[List[str], int]:
+        """Returns the lines after `cursor` still in the buffer, and the new cursor."""
+        with self._lock:
+            new = min(self.total - cursor, len(self._lines))
+            lines = list(self._lines)[len(self._lines) - new :] if new > 0 else []
+            return lines, self.total
+
+    def text(self) -> str:
+        return "\n".join(self.lines())
+
+
+class AppProcess:
+    """
+    A launched app. It runs in its own process group (so the whole tree can be
+    stopped at once) and its stdout/stderr are collected into an OutputBuffer.
+    The launcher interpreter runs it with TEMPLATES_AUTO_RELOAD, so Flask
+    re-reads changed templates.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        cwd: str,
+        port: int,
+        interpreter: WarmInterpreter,
+        max_lines: int = 2000,
+        limits: ResourceLimits = ResourceLimits(),
+    ):
+        self.file_path = file_path
+        self.port = port
+        self.limits = limits
+        self.output = OutputBuffer(max_lines)
+        self.cursor = 0  # output up to here was already observed
+        # the workspace files as they were when the app started
+        self.files = file_states(cwd)
+        env = {**os.environ, "PORT": str(port), "PYTHONUNBUFFERED": "1"}
+        # usage is accounted (and memory/processes limited) for the whole app
+        # by a cgroup where one can be created, else from /proc and rusage
+        self.cgroup = AppCgroup.create(limits.memory_mb, limits.processes)
+        cgroup_path = self.cgroup.path if self.cgroup is not None else None
+        self._final_usage: Optional[ResourceUsage] = None
+        self._reap_lock = threading.Lock()
+        self.process = interpreter.run(file_path, cwd, env, limits, cgroup_path)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        self._deadline = None
+        if limits.wall_seconds:
+            self._deadline = threading.Timer(limits.wall_seconds, self._expire)
+            self._deadline.daemon = True
+            self._deadline.start()
+
+    def _expire(self):
+        if self.is_alive():
+            self.output.append(
+                f"[Stopped: the app ran for its wall time limit of {self.limits.wall_seconds:g}s]"
+            )
+            self.stop()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.output.append(ANSI_ESCAPE_PATTERN.sub("", line.rstrip("\n")))
+
+    def is_alive(self) -> bool:
+        # reaped with wait4 rather than Popen.poll to keep the rusage of the app
+        with self._reap_lock:
+            if self.process.returncode is not None:
+                return False
+            try:
+                pid, status, rusage = os.wait4(self.process.pid, os.WNOHANG)
+            except ChildProcessError:
+                return self.process.poll() is None
+            if pid == 0:
+                return True
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+            if self._final_usage is None:
+                self._final_usage = rusage_usage(rusage)
+            return False
+
+    def usage(self) -> Optional[ResourceUsage]:
+        """Peak RSS and CPU seconds of the app so far (or in total, once it exited)."""
+        if self.cgroup is not None:
+            usage = self.cgroup.usage()
+            if usage is not None:
+                return usage
+        if self.is_alive():
+            return process_usage(self.process.pid) or self._final_usage
+        return self._final_usage
+
+    def read_output(self) -> str:
+        if not self.is_alive():
+            # let the reader drain what the process wrote before exiting
+            self._reader.join(timeout=1)
+        return self.output.text()
+
+    def read_new(self) -> List[str]:
+        """The output lines not observed yet; advances the cursor."""
+        if not self.is_alive():
+            self._reader.join(timeout=1)
+        lines, self.cursor = self.output.read_since(self.cursor)
+        return lines
+
+    def stop(self, timeout: float = 5.0):
+        if self._deadline is not None:
+            self._deadline.cancel()
+        if self.is_alive():
+            self._signal(signal.SIGTERM)
+            if not self._wait(timeout):
+                self._signal(signal.SIGKILL)
+                self._wait(None)
+        self._reader.join(timeout=1)
+        if self.cgroup is not None:
+            self._final_usage = self.cgroup.usage() or self._final_usage
+            self.cgroup.remove()
+            self.cgroup = None
+
+    def _wait(self, timeout: Optional[float]) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.is_alive():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def _signal(self, signum: int):
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+class AppSupervisor:
+    """
+    Runs at most one app per workspace. Every workspace keeps the free port it
+    was assigned, so concurrent agents never collide.
+
+    A launch of the running app is skipped when only its templates or static
+    files changed since it started; otherwise the app restarts in one of the
+    pool's launcher interpreters, started (with Flask imported) ahead of time.
+    A pool size of 0 starts a launcher for every app when it is launched.
+    """
+
+    def __init__(self, pool_size: int = 2):
+        self._lock = threading.Lock()
+        self._apps: Dict[str, AppProcess] = {}
+        self._ports: Dict[str, int] = {}
+        self.pool = InterpreterPool(pool_size)
+
+    def port_for(self, workspace: str) -> int:
+        workspace = os.path.abspath(workspace)
+        with self._lock:
+            if workspace not in self._ports:
+                self._ports[workspace] = find_free_port()
+            return self._ports[workspace]
+
+    def launch(
+        self,
+        workspace: str,
+        file_name: str,
+        readiness: Optional[ReadinessConfig] = None,
+        limits: ResourceLimits = ResourceLimits(),
+    ) -> Tuple[AppProcess, ReadinessResult]:
+        """(Re)starts `file_name` of `workspace` and waits until it is up or has exited."""
+        workspace = os.path.abspath(workspace)
+        port = self.port_for(workspace)
+        file_path = os.path.join(workspace, file_name)
+
+        running = self.get(workspace)
+        if (
+            running is not None
+            and running.is_alive()
+            and running.file_path == file_path
+            and running.limits == limits
+        ):
+            files = file_states(workspace)
+            if all(is_hot(path) for path in changed_files(running.files, files)):
+                running.files = files
+                return running, ReadinessResult(
+                    "ready", 0.0, port=running.port, restarted=False
+                )
+
+        self.stop(workspace)
+        # without a pool the launcher is started now, for the same environment
+        interpreter = self.pool.take() if self.pool.size > 0 else WarmInterpreter()
+        app = AppProcess(
+            file_path, workspace, port, interpreter=interpreter, limits=limits
+        )
+        with self._lock:
+            self._apps[workspace] = app
+
+        readiness = replace(readiness or ReadinessConfig(), port=port)
+        return app, wait_until_ready(app.read_output, app.is_alive, readiness)
+
+    def get(self, workspace: str) -> Optional[AppProcess]:
+        with self._lock:
+            return self._apps.get(os.path.abspath(workspace))
+
+    def stop(self, workspace: str):
+        with self._lock:
+            app = self._apps.pop(os.path.abspath(workspace), None)
+        if app is not None:
+            app.stop()
+
+    def stop_all(self):
+        with self._lock:
+            apps, self._apps = list(self._apps.values()), {}
+        for app in apps:
+            app.stop()
+        self.pool.close()
+
+
+_supervisor = AppSupervisor()
+atexit.register(_supervisor.stop_all)
+
+
+def get_supervisor() -> AppSupervisor:
+    """The supervisor shared by every agent of the process."""
+    return _supervisor
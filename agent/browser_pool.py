@@ -0,0 +1,183 @@
+import io
+import base64
+import atexit
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+from PIL import Image
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+
+# resolves once the page stopped requesting resources for `idle` seconds
+NETWORK_IDLE_SCRIPT = """
+const [idle, timeout, done] = arguments;
+const start = performance.now();
+let count = -1, stableSince = start;
+(function poll() {
+    const now = performance.now();
+    const current = performance.getEntriesByType("resource").length;
+    if (current !== count) { count = current; stableSince = now; }
+    if (document.readyState === "complete" && now - stableSince >= idle) return done(true);
+    if (now - start >= timeout) return done(false);
+    setTimeout(poll, 50);
+})();
+"""
+
+
+@dataclass
+class BrowserOptions:
+    width: int = 1920
+    height: int = 1080
+    full_page: bool = False
+    # a browser is restarted after this many screenshots
+    max_uses: int = 50
+    page_load_timeout: float = 15.0
+    network_idle: float = 0.5
+
+
+@dataclass
+class _Browser:
+    driver: webdriver.Chrome
+    uses: int = 0
+
+
+class BrowserPool:
+    """
+    Keeps headless Chrome instances alive between screenshots.
+
+    At most `size` browsers are used at once. A browser is health-checked before
+    every use and recycled after `max_uses` screenshots or on any error.
+    """
+
+    def __init__(self, size: int = 2, options: Optional[BrowserOptions] = None):
+        self.options = options or BrowserOptions()
+        self._slots = threading.Semaphore(size)
+        self._lock = threading.Lock()
+        self._idle: List[_Browser] = []
+        self._closed = False
+
+    def _launch(self) -> _Browser:
+        chrome_options = Options()
+        chrome_options.add_argument("--headless")  # Ensure GUI is off
+        chrome_options.add_argument(
+            f"--window-size={self.options.width},{self.options.height}"
+        )
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+
+        driver = webdriver.Chrome(options=chrome_options)
+        driver.set_page_load_timeout(self.options.page_load_timeout)
+        driver.set_script_timeout(self.options.page_load_timeout + 5)
+        return _Browser(driver=driver)
+
+    @staticmethod
+    def _healthy(browser: _Browser) -> bool:
+        try:
+            return browser.driver.execute_script("return 1") == 1
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def _quit(browser: _Browser):
+        try:
+            browser.driver.quit()
+        except WebDriverException:
+            pass
+
+    @contextmanager
+    def acquire(self):
+        with self._slots:
+            with self._lock:
+                browser = self._idle.pop() if self._idle else None
+            if browser is not None and not self._healthy(browser):
+                self._quit(browser)
+                browser = None
+            if browser is None:
+                browser = self._launch()
+
+            broken = True
+            try:
+                yield browser.driver
+                broken = False
+            finally:
+                browser.uses += 1
+                recycle = broken or browser.uses >= self.options.max_uses
+                if not recycle:
+                    try:
+                        # do not leak cookies between apps on the same host
+                        browser.driver.delete_all_cookies()
+                        browser.driver.get("about:blank")
+                    except WebDriverException:
+                        recycle = True
+                with self._lock:
+                    if not recycle and not self._closed:
+                        self._idle.append(browser)
+                        browser = None
+                if browser is not None:
+                    self._quit(browser)
+
+    def screenshot(self, url: str, full_page: Optional[bool] = None) -> Image.Image:
+        if full_page is None:
+            full_page = self.options.full_page
+
+        with self.acquire() as driver:
+            driver.get(url)
+            driver.execute_async_script(
+                NETWORK_IDLE_SCRIPT,
+                self.options.network_idle * 1000,
+                self.options.page_load_timeout * 1000,
+            )
+
+            if full_page:
+                width, height = driver.execute_script(
+                    "return [document.documentElement.scrollWidth,"
+                    " document.documentElement.scrollHeight]"
+                )
+                result = driver.execute_cdp_cmd(
+                    "Page.captureScreenshot",
+                    {
+                        "format": "png",
+                        "captureBeyondViewport": True,
+                        "clip": {
+                            "x": 0,
+                            "y": 0,
+                            "width": max(width, self.options.width),
+                            "height": max(height, self.options.height),
+                            "scale": 1,
+                        },
+                    },
+                )
+                screenshot = base64.b64decode(result["data"])
+            else:
+                screenshot = driver.get_screenshot_as_png()
+
+        image = Image.open(io.BytesIO(screenshot))
+        image.load()
+        return image
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for browser in idle:
+            self._quit(browser)
+
+
+_shared_pool: Optional[BrowserPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool(
+    size: int = 2, options: Optional[BrowserOptions] = None
+) -> BrowserPool:
+    """The process-wide pool shared by every agent (created on first use)."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = BrowserPool(size=size, options=options)
+            atexit.register(_shared_pool.close)
+        return _shared_pool
@@ -0,0 +1,289 @@
+import re
+from functools import lru_cache
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from agent.action_parser import parse_actions
+from agent.image_pipeline import count_tiles
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:  # fall back to the ~4 characters per token rule of thumb
+    _encoding = None
+
+# only an observation that is nothing but one READ result is replaced as a whole
+READ_OBSERVATION_PATTERN = re.compile(
+    r"(?:# Observation : )?Content of the file (.+?) : \n"
+)
+
+
+@lru_cache(maxsize=4096)  # the same history is counted again on every hop
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def count_image_tokens(image) -> int:
+    """Vision cost of one image: 85 base tokens plus 170 per 512px tile."""
+    if isinstance(image, Image.Image):
+        return 85 + 170 * count_tiles(*image.size)
+    return 765  # unknown size, cost of a 1024x1024 image
+
+
+@dataclass
+class PromptStats:
+    messages: int
+    tokens: int
+    images: int
+    summarized: int = 0
+    stale_files: int = 0
+
+    def describe(self) -> str:
+        return (
+            f"{self.messages} messages, ~{self.tokens} tokens, {self.images} images"
+            f" ({self.stale_files} stale file contents, {self.summarized} messages summarized)"
+        )
+
+
+def message_tokens(message) -> int:
+    return (
+        4
+        + count_tokens(message.text)
+        + sum(count_image_tokens(image) for image in message.images)
+    )
+
+
+def measure(messages: List) -> PromptStats:
+    return PromptStats(
+        messages=len(messages),
+        tokens=sum(message_tokens(message) for message in messages),
+        images=sum(len(message.images) for message in messages),
+    )
+
+
+def with_text(message, text: str):
+    """A copy of `message` with new text; the encoded images are shared, not redone."""
+    copy = replace(message, text=text)
+    copy._image_urls = message._image_urls
+    copy._image_digests = message._image_digests
+    return copy
+
+
+@dataclass
+class ContextPolicy:
+    """
+    Decides what part of the history is sent to the model.
+
+    The first `keep_first` messages (system prompt and instruction) and the last
+    `keep_last` messages are always sent verbatim. Older file contents (WRITE code
+    blocks, READ observations) that a later version of the same file supersedes
+    are replaced by a reference (unless a REVERT after that later version may
+    have brought an older one back), and only the images of the last
+    `keep_last_images` image messages are kept. If the prompt is still above
+    `max_tokens`, the middle of the history is folded into one extractive
+    summary message.
+    """
+
+    keep_first: int = 2
+    keep_last: int = 8
+    max_tokens: Optional[int] = 24000
+    replace_stale_files: bool = True
+    keep_last_images: Optional[int] = None
+
+    @classmethod
+    def from_args(cls, args) -> "ContextPolicy":
+        defaults = cls()
+        max_tokens = getattr(args, "context_budget", defaults.max_tokens)
+        return cls(
+            keep_last=getattr(args, "keep_turns", defaults.keep_last),
+            max_tokens=max_tokens if max_tokens and max_tokens > 0 else None,
+            replace_stale_files=not getattr(args, "keep_stale_files", False),
+        )
+
+    def apply(self, messages: List) -> Tuple[List, PromptStats]:
+        messages = list(messages)
+        stale_files = 0
+        if self.replace_stale_files:
+            messages, stale_files = self._replace_stale_files(messages)
+        if self.keep_last_images is not None:
+            messages = self._drop_old_images(messages)
+
+        summarized = 0
+        tokens = sum(message_tokens(message) for message in messages)
+        middle = messages[self.keep_first : max(len(messages) - self.keep_last, 0)]
+        if self.max_tokens is not None and tokens > self.max_tokens and len(middle) > 1:
+            summary = self._summarize(middle)
+            messages = (
+                messages[: self.keep_first]
+                + [summary]
+                + messages[self.keep_first + len(middle) :]
+            )
+            summarized = len(middle)
+            tokens = sum(message_tokens(message) for message in messages)
+
+        stats = PromptStats(
+            messages=len(messages),
+            tokens=tokens,
+            images=sum(len(message.images) for message in messages),
+            summarized=summarized,
+            stale_files=stale_files,
+        )
+        return messages, stats
+
+    def _replace_stale_files(self, messages: List):
+        # file name -> positions (message index, action order, block index) of
+        # its contents, and the position of the last REVERT that touched it
+        holders: Dict[str, List[Tuple[int, int, int]]] = {}
+        reverted: Dict[str, Tuple[int, int]] = {}
+        for index, message in enumerate(messages):
+            for order, (kind, file_name, block) in enumerate(
+                self._file_events_of(message)
+            ):
+                if kind == "content":
+                    holders.setdefault(file_name, []).append((index, order, block))
+                else:  # None: REVERT to a snapshot, any file may change
+                    reverted[file_name] = (index, order)
+
+        stale_blocks = {}  # message index -> blocks superseded by a later message
+        for file_name, positions in holders.items():
+            newest = positions[-1]
+            last_revert = max(
+                reverted.get(file_name, (-1, -1)), reverted.get(None, (-1, -1))
+            )
+            # after a REVERT the file may hold any earlier content again, until
+            # a later WRITE or READ shows it
+            if newest[:2] < last_revert:
+                continue
+            for index, _, block in positions[:-1]:
+                if self.keep_first <= index < len(messages) - self.keep_last:
+                    stale_blocks.setdefault(index, set()).add(block)
+
+        for index, blocks in stale_blocks.items():
+            message = messages[index]
+            if message.role == "assistant":
+                text = message.text
+                writes = [
+                    action
+                    for action in parse_actions(text)
+                    if action.kind == "WRITE" and action.body is not None
+                ]
+                # replace from the back so the earlier offsets stay valid
+                for block in sorted(blocks, reverse=True):
+                    action = writes[block]
+                    text = (
+                        f"{text[: action.header_end]}\n[code omitted, a later message"
+                        f" holds the newest version of {action.target}]{text[action.end :]}"
+                    )
+            else:
+                file_name = self._file_events_of(message)[0][1]
+                text = f"[content of {file_name} omitted, a later message holds its newest version]"
+            messages[index] = with_text(message, text)
+        return messages, sum(len(blocks) for blocks in stale_blocks.values())
+
+    def _drop_old_images(
+        self, messages: List, placeholder: str = "[older screenshot omitted]"
+    ) -> List:
+        image_indexes = [i for i, message in enumerate(messages) if message.images]
+        stale = image_indexes[: max(len(image_indexes) - self.keep_last_images, 0)]
+        for index in stale:
+            message = messages[index]
+            text = f"{message.text}\n{placeholder}" if message.text else placeholder
+            messages[index] = replace(message, text=text, image_path=None)
+        return messages
+
+    @staticmethod
+    def _file_events_of(message) -> List[Tuple[str, Optional[str], int]]:
+        """
+        ("content", file, block) for every full content of a file the message
+        holds and ("revert", file or None for a snapshot, -1) for every REVERT,
+        in order. `block` counts the WRITE blocks of the message.
+        """
+        if not message.text:
+            return []
+        if message.role != "assistant":
+            match = READ_OBSERVATION_PATTERN.match(message.text)
+            return [("content", match.group(1), 0)] if match else []
+        events = []
+        block = 0
+        for action in parse_actions(message.text):
+            if action.kind == "WRITE" and action.body is not None:
+                events.append(("content", action.target, block))
+                block += 1
+            elif action.kind == "REVERT" and action.target:
+                target = action.target
+                snapshot = target.lower() == "good" or target.isdigit()
+                events.append(("revert", None if snapshot else target, -1))
+        return events
+
+    @staticmethod
+    def _summarize(messages: List):
+        lines = ["[Summary of earlier steps, details omitted]"]
+        for message in messages:
+            first_line = (message.text or "").strip().split("\n", 1)[0][:160]
+            speaker = "you" if message.role == "assistant" else "observation"
+            lines.append(f"- {speaker}: {first_line}")
+        return type(messages[0])(role="user", text="\n".join(lines))
+
+
+class StablePrefix:
+    """
+    Builds prompts for a growing history so that each prompt starts with the
+    exact bytes of the previous one, which lets the provider's prefix cache hit.
+
+    New messages are only appended. The context policy runs only when the
+    prompt outgrows its `max_tokens`, and then compacts it to half of that
+    (keeping fewer of the last messages verbatim if need be), so the new prefix
+    lasts for several hops before the next compaction.
+    """
+
+    def __init__(self):
+        self.sent: List[Dict] = []
+        self.covered = 0  # messages of the history already in `sent`
+        self.tokens = 0
+        self.images = 0
+
+    def build(
+        self,
+        messages: List,
+        serialize: Callable,
+        policy: Optional[ContextPolicy] = None,
+    ) -> Tuple[List[Dict], PromptStats]:
+        new = messages[self.covered :]
+        new_stats = measure(new)
+        over_budget = (
+            policy is not None
+            and policy.max_tokens is not None
+            and self.tokens + new_stats.tokens > policy.max_tokens
+        )
+
+        if over_budget:
+            compacted, stats = self._compact(messages, policy)
+            self.sent = [serialize(message) for message in compacted]
+            self.tokens, self.images = stats.tokens, stats.images
+        else:
+            self.sent = self.sent + [serialize(message) for message in new]
+            self.tokens += new_stats.tokens
+            self.images += new_stats.images
+            stats = PromptStats(len(self.sent), self.tokens, self.images)
+
+        self.covered = len(messages)
+        return list(self.sent), stats
+
+    @staticmethod
+    def _compact(messages: List, policy: ContextPolicy) -> Tuple[List, PromptStats]:
+        low_water = policy.max_tokens // 2
+        # the last hop (response and observation) is always kept verbatim
+        for keep_last in range(policy.keep_last, min(policy.keep_last, 2) - 1, -1):
+            compacted, stats = replace(
+                policy, max_tokens=low_water, keep_last=keep_last
+            ).apply(messages)
+            if stats.tokens <= low_water:
+                break
+        return compacted, stats
@@ -2,7 +2,11 @@ import os
 import io, base64
 from dataclasses import dataclass, field
 from PIL import Image
-from typing import List, Dict, Optional, Union
+from typing import Any, Callable, List, Dict, Optional, Tuple, Union
+
+from agent.context_policy import ContextPolicy, PromptStats, StablePrefix, measure
+from agent.image_pipeline import image_digest
+from agent.tracing import span
 
 
 @dataclass
@@ -10,36 +14,69 @@ class Message:
     role: str
     text: Optional[str] = None
     image_path: Optional[str] = None
+    # how in-memory (PIL) images are encoded, e.g. JPEG or WEBP
+    image_format: str = "JPEG"
+    image_quality: Optional[int] = None
+    # (image_path it was computed from, value); recomputed if image_path is replaced
+    _image_urls: Optional[Tuple[Any, List[str]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _image_digests: Optional[Tuple[Any, List[str]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
-    def to_dict(self) -> Dict[str, Union[str, Dict[str, str]]]:
-        """Converts the message to a dictionary format expected by OpenAI API."""
-        content = []
-        if self.text:
-            content.append({"type": "text", "text": self.text})
-        if self.image_path:
-            if isinstance(self.image_path, list):
-                encoded_images = [self.encode_image(imgp) for imgp in self.image_path]
-                for encoded_image in encoded_images:
-                    content.append(
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{encoded_image}"
-                            },
-                        }
+    @property
+    def images(self) -> List:
+        if not self.image_path:
+            return []
+        if isinstance(self.image_path, list):
+            return self.image_path
+        return [self.image_path]
+
+    def image_urls(self) -> List[str]:
+        """
+        The base64 data URLs of the images. They are encoded once per message and
+        the same strings are shared by every later serialization.
+        """
+        if self._image_urls is None or self._image_urls[0] is not self.image_path:
+            urls = []
+            for image in self.images:
+                mime = "jpeg"
+                if not isinstance(image, str):
+                    mime = self.image_format.lower()
+                with span("image_encode") as encode_span:
+                    encoded_image = self.encode_image(
+                        image, self.image_format, self.image_quality
                     )
-            else:
-                encoded_image = self.encode_image(self.image_path)
-                content.append(
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"},
-                    }
-                )
+                    if encode_span is not None:
+                        encode_span.attributes["bytes"] = len(encoded_image)
+                urls.append(f"data:image/{mime};base64,{encoded_image}")
+            self._image_urls = (self.image_path, urls)
+        return self._image_urls[1]
+
+    def image_digests(self) -> List[str]:
+        """Content hashes of the images, computed once per message."""
+        if self._image_digests is None or self._image_digests[0] is not self.image_path:
+            digests = [image_digest(image) for image in self.images]
+            self._image_digests = (self.image_path, digests)
+        return self._image_digests[1]
+
+    def to_dict(self, stable: bool = False) -> Dict[str, Union[str, Dict[str, str]]]:
+        """
+        Converts the message to a dictionary format expected by OpenAI API.
+        With `stable`, the text part is always present (even empty) and first.
+        """
+        content = []
+        if self.text or stable:
+            content.append({"type": "text", "text": self.text or ""})
+        for url in self.image_urls():
+            content.append({"type": "image_url", "image_url": {"url": url}})
         return {"role": self.role, "content": content}
 
     @staticmethod
-    def encode_image(image_path: str) -> str:
+    def encode_image(
+        image_path: str, image_format: str = "JPEG", quality: Optional[int] = None
+    ) -> str:
         """Encodes the image at the given path to base64. Compresses the image if it's larger than 20 MB."""
 
         if not isinstance(image_path, str):
@@ -47,7 +84,10 @@ class Message:
             img = image_path
             img = img.convert("RGB")
             buffer = io.BytesIO()
-            img.save(buffer, format="JPEG")
+            if quality is None:
+                img.save(buffer, format=image_format)
+            else:
+                img.save(buffer, format=image_format, quality=quality)
             return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
         initial_size = os.path.getsize(image_path)
@@ -71,9 +111,38 @@ class Message:
                 return base64.b64encode(image_file.read()).decode("utf-8")
 
 
+def build_prompt(conversation, serialize: Callable[[Message], Dict]) -> List[Dict]:
+    """
+    Serializes the messages the context policy keeps (append-only when the
+    conversation asks for a stable prefix) and records the prompt size.
+    """
+    with span("prompt_build", messages=len(conversation.messages)):
+        if conversation.stable_prefix:
+            formatted_messages, stats = conversation._stable_prefix.build(
+                conversation.messages, serialize, conversation.context_policy
+            )
+        else:
+            messages, stats = conversation.messages, None
+            if conversation.context_policy is not None:
+                messages, stats = conversation.context_policy.apply(messages)
+            formatted_messages = [serialize(message) for message in messages]
+            stats = stats or measure(messages)
+    conversation.prompt_stats.append(stats)
+    return formatted_messages
+
+
 @dataclass
 class Conversation:
     messages: List[Message]
+    # decides which part of the history is sent; None sends everything
+    context_policy: Optional[ContextPolicy] = None
+    # keep every prompt a byte-identical extension of the previous one
+    stable_prefix: bool = False
+    # size of every prompt built by to_openai_format
+    prompt_stats: List[PromptStats] = field(default_factory=list)
+    _stable_prefix: StablePrefix = field(
+        default_factory=StablePrefix, init=False, repr=False, compare=False
+    )
 
     def get_llama_style_prompt_string(self):
         prompt = ""
@@ -85,10 +154,9 @@ class Conversation:
         return prompt
 
     def to_openai_format(self) -> List[Dict[str, str]]:
-        formatted_messages = []
-        for message in self.messages:
-            formatted_messages.append({"role": message.role, "content": message.text})
-        return formatted_messages
+        return build_prompt(
+            self, lambda message: {"role": message.role, "content": message.text}
+        )
 
     def add_message(self, message: Message):
         self.messages.append(message)
@@ -97,12 +165,20 @@ class Conversation:
 @dataclass
 class ImageTextConversation:
     messages: List[Message] = field(default_factory=list)
+    context_policy: Optional[ContextPolicy] = None
+    stable_prefix: bool = False
+    prompt_stats: List[PromptStats] = field(default_factory=list)
+    _stable_prefix: StablePrefix = field(
+        default_factory=StablePrefix, init=False, repr=False, compare=False
+    )
 
     def to_openai_format(
         self,
     ) -> List[Dict[str, Union[str, List[Dict[str, Union[str, Dict[str, str]]]]]]]:
         """Converts the conversation to a format suitable for OpenAI API."""
-        return [message.to_dict() for message in self.messages]
+        return build_prompt(
+            self, lambda message: message.to_dict(stable=self.stable_prefix)
+        )
 
     def add_message(self, message: Message):
         self.messages.append(message)
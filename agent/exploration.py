@@ -0,0 +1,245 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import termcolor
+from PIL import Image, ImageStat
+
+from agent.action_parser import parse_actions
+from agent.app_runner import get_supervisor
+from agent.browser_pool import BrowserOptions, get_shared_pool
+from agent.conversation import ImageTextConversation, Message
+from agent.image_pipeline import downscale, image_digest
+from agent.llm_utils import gpt4v_completion_async
+from agent.readiness import port_is_listening
+from agent.tracing import span
+
+JUDGE_PROMPT = """You check the work of a web developer agent.
+You get the instruction the agent was given and a screenshot of the web page it built.
+Answer "yes" if the page fulfils the instruction, otherwise answer "no". Answer with one word."""
+
+# each check implies the ones before it
+SCORE_LABELS = ["nothing served", "server up", "page rendered", "vision check passed"]
+SCORE_UP, SCORE_RENDERED, SCORE_APPROVED = 1, 2, 3
+
+# actions after which the served page may have changed
+CHECKED_KINDS = {"RUN", "SEE", "TERMINATE"}
+
+
+def is_blank(image: Image.Image, min_stddev: float = 2.0) -> bool:
+    """True for a page of (almost) a single colour, e.g. an empty body."""
+    return ImageStat.Stat(image.convert("L")).stddev[0] < min_stddev
+
+
+@dataclass
+class ExplorationConfig:
+    """
+    Best-of-N exploration: `trajectories` agents work on the same instruction at
+    once. After `prune_after` hops, a trajectory scoring below the leader is
+    cancelled (None never prunes). The first one passing the vision check of
+    `judge_model` (the agent's model by default) wins and the rest are cancelled.
+    Each trajectory takes at most `max_hop` hops (the agent's by default).
+    """
+
+    trajectories: int = 3
+    max_hop: Optional[int] = None
+    prune_after: Optional[int] = 8
+    judge_model: Optional[str] = None
+
+    @classmethod
+    def from_args(cls, args) -> "ExplorationConfig":
+        defaults = cls()
+        return cls(
+            trajectories=getattr(args, "best_of", defaults.trajectories),
+            prune_after=getattr(args, "prune_after", defaults.prune_after),
+            judge_model=getattr(args, "judge_model", defaults.judge_model),
+        )
+
+
+@dataclass
+class Trajectory:
+    index: int
+    agent: object
+    hops: int = 0
+    score: int = 0
+    status: str = "running"  # running, approved, finished, pruned, cancelled or failed
+    response: Optional[str] = None
+    # (pixel digest, score) of the last page sent to the vision check
+    judged: Optional[tuple] = field(default=None, repr=False)
+
+    def describe(self) -> str:
+        return (
+            f"trajectory {self.index} ({self.status}, {self.hops} hops,"
+            f" {SCORE_LABELS[self.score]}) in {self.agent.workspace}"
+        )
+
+
+class Explorer:
+    """Runs several trajectories of an agent and picks the best one."""
+
+    def __init__(
+        self,
+        make_agent: Callable[[], object],
+        config: Optional[ExplorationConfig] = None,
+    ):
+        self.make_agent = make_agent
+        self.config = config or ExplorationConfig()
+        self.trajectories: List[Trajectory] = []
+
+    async def run(self, instruction: str, VERBOSE: bool = True) -> Trajectory:
+        """Returns the first approved trajectory, else the best scoring one."""
+        self.trajectories = []
+        for index in range(self.config.trajectories):
+            agent = self.make_agent()
+            agent.seed = index  # same prompt, different samples
+            self.trajectories.append(Trajectory(index, agent))
+
+        tasks = {
+            asyncio.create_task(
+                self._explore(trajectory, instruction, VERBOSE)
+            ): trajectory
+            for trajectory in self.trajectories
+        }
+        pending = set(tasks)
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task].status == "approved":
+                            winner = tasks[task]
+                        continue
+                    tasks[task].status = "failed"
+                    if VERBOSE:
+                        print(
+                            termcolor.colored(
+                                f"# Trajectory {tasks[task].index} failed: {task.exception()!r}",
+                                "red",
+                            )
+                        )
+        finally:
+            for task in pending:
+                tasks[task].status = "cancelled"
+                tasks[task].agent.cancelled.set()
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            # a cancelled task stops waiting for its agent, not the agent's thread:
+            # wait for it, so no loser launches an app after the cleanup below
+            await asyncio.gather(
+                *(
+                    trajectory.agent.in_flight
+                    for trajectory in self.trajectories
+                    if trajectory.agent.in_flight is not None
+                ),
+                return_exceptions=True,
+            )
+
+        best = winner or max(
+            self.trajectories,
+            key=lambda trajectory: (trajectory.score, -trajectory.hops),
+        )
+        # only the chosen app is left running
+        supervisor = get_supervisor()
+        for trajectory in self.trajectories:
+            workspace = getattr(trajectory.agent, "workspace", None)
+            if trajectory is not best and workspace is not None:
+                await asyncio.to_thread(supervisor.stop, workspace)
+        if VERBOSE:
+            print(
+                termcolor.colored(f"# Best : {best.describe()}", "blue", attrs=["bold"])
+            )
+        return best
+
+    async def _explore(self, trajectory: Trajectory, instruction: str, VERBOSE: bool):
+        agent = trajectory.agent
+        conversation = await agent.in_thread(agent.start, instruction, VERBOSE=False)
+
+        for hop in range(self.config.max_hop or agent.max_hop):
+            with span("hop", hop=hop + 1, trajectory=trajectory.index):
+                response_text = await agent.acomplete(
+                    conversation, dispatch=True, VERBOSE=False
+                )
+                trajectory.hops, trajectory.response = hop + 1, response_text
+                terminated = await agent.in_thread(
+                    agent.step, conversation, response_text, VERBOSE=False
+                )
+
+            if CHECKED_KINDS & {action.kind for action in parse_actions(response_text)}:
+                trajectory.score = await self._check(trajectory, instruction)
+            if VERBOSE:
+                print(
+                    termcolor.colored(
+                        f"# Trajectory {trajectory.index} hop {trajectory.hops} : {SCORE_LABELS[trajectory.score]}",
+                        "cyan",
+                    )
+                )
+
+            if trajectory.score == SCORE_APPROVED:
+                trajectory.status = "approved"
+                return
+            if terminated:
+                break
+            if self._behind(trajectory):
+                trajectory.status = "pruned"
+                return
+        trajectory.status = "finished"
+
+    def _behind(self, trajectory: Trajectory) -> bool:
+        prune_after = self.config.prune_after
+        if prune_after is None or trajectory.hops < prune_after:
+            return False
+        leader = max(other.score for other in self.trajectories)
+        return trajectory.score < leader
+
+    async def _check(self, trajectory: Trajectory, instruction: str) -> int:
+        agent = trajectory.agent
+        app = get_supervisor().get(agent.workspace)
+        if app is None or not app.is_alive():
+            return 0
+        if not await asyncio.to_thread(port_is_listening, agent.port):
+            return 0
+
+        pool = get_shared_pool(
+            size=getattr(agent, "browser_pool_size", 2),
+            options=getattr(agent, "browser_options", BrowserOptions()),
+        )
+        try:
+            image = await asyncio.to_thread(
+                pool.screenshot, f"http://127.0.0.1:{agent.port}/"
+            )
+        except Exception:
+            return SCORE_UP
+        if is_blank(image):
+            return SCORE_UP
+
+        # the vision check runs once per distinct page
+        page_digest = image_digest(image)
+        if trajectory.judged is not None and trajectory.judged[0] == page_digest:
+            return trajectory.judged[1]
+
+        conversation = ImageTextConversation(
+            messages=[
+                Message(role="system", text=JUDGE_PROMPT),
+                Message(
+                    role="user",
+                    text=f"Instruction : {instruction}",
+                    image_path=downscale(image, 1280, 720),
+                ),
+            ]
+        )
+        answer = await gpt4v_completion_async(
+            conversation,
+            model=self.config.judge_model or agent.model,
+            max_tokens=3,
+            usage_log=agent.usage,
+        )
+        score = (
+            SCORE_APPROVED
+            if answer.strip().lower().startswith("yes")
+            else SCORE_RENDERED
+        )
+        trajectory.judged = (page_digest, score)
+        return score
@@ -0,0 +1,107 @@
+import math
+import hashlib
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+
+@dataclass
+class ImagePipelineConfig:
+    """
+    How screenshots are prepared before they enter the conversation.
+
+    max_tiles follows the vision pricing model (512px tiles); when set, the image
+    is shrunk further until it fits the budget.
+    dedup drops a screenshot whose downscaled pixels equal those of the previous
+    screenshot of the same URL.
+    keep_last_images keeps only the newest K images in the conversation (None keeps all).
+    """
+
+    max_width: int = 1280
+    max_height: int = 720
+    max_tiles: Optional[int] = None
+    format: str = "JPEG"
+    quality: int = 80
+    dedup: bool = True
+    keep_last_images: Optional[int] = 3
+
+    @classmethod
+    def from_args(cls, args) -> "ImagePipelineConfig":
+        defaults = cls()
+        return cls(
+            max_width=getattr(args, "image_max_width", defaults.max_width),
+            max_height=getattr(args, "image_max_height", defaults.max_height),
+            max_tiles=getattr(args, "image_max_tiles", defaults.max_tiles),
+            format=getattr(args, "image_format", defaults.format),
+            quality=getattr(args, "image_quality", defaults.quality),
+            dedup=getattr(args, "image_dedup", defaults.dedup),
+            keep_last_images=getattr(args, "keep_images", defaults.keep_last_images),
+        )
+
+
+def count_tiles(width: int, height: int, tile_size: int = 512) -> int:
+    return math.ceil(width / tile_size) * math.ceil(height / tile_size)
+
+
+def downscale(
+    image: Image.Image,
+    max_width: int,
+    max_height: int,
+    max_tiles: Optional[int] = None,
+) -> Image.Image:
+    scale = min(1.0, max_width / image.width, max_height / image.height)
+    width, height = int(image.width * scale), int(image.height * scale)
+    if max_tiles is not None:
+        while count_tiles(width, height) > max_tiles and min(width, height) > 64:
+            width, height = int(width * 0.9), int(height * 0.9)
+
+    if (width, height) == image.size:
+        return image
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def image_digest(image) -> str:
+    """
+    Hashes an image by its content (pixels or file bytes), never by its base64.
+    Any visible change of a screenshot (e.g. one line of text) changes it.
+    """
+    digest = hashlib.sha256()
+    if isinstance(image, Image.Image):
+        digest.update(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+    else:
+        with open(image, "rb") as image_file:
+            for chunk in iter(lambda: image_file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImagePipeline:
+    """
+    Downscales screenshots and drops the ones that did not change since the
+    last one of the same URL. `reset` forgets the last screenshot, e.g. after
+    the app restarted.
+    """
+
+    def __init__(self, config: Optional[ImagePipelineConfig] = None):
+        self.config = config or ImagePipelineConfig()
+        self.last: Optional[Tuple[Optional[str], str]] = None  # (url, digest)
+
+    def reset(self):
+        self.last = None
+
+    def process(
+        self, image: Image.Image, url: Optional[str] = None
+    ) -> Optional[Image.Image]:
+        """Returns the downscaled image, or None if it is the same as the previous one."""
+        image = downscale(
+            image,
+            self.config.max_width,
+            self.config.max_height,
+            self.config.max_tiles,
+        )
+        last, self.last = self.last, (url, image_digest(image))
+        if self.config.dedup and last == self.last:
+            return None
+        return image
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from agent.conversation import Message
+
+
+def normalize_messages(messages: List[Message]) -> List[Dict]:
+    normalized = []
+    for message in messages:
+        normalized.append(
+            {
+                "role": message.role,
+                "text": message.text or "",
+                "images": message.image_digests(),
+            }
+        )
+    return normalized
+
+
+class LLMCache:
+    """
+    Content-addressed on-disk store of completion responses, keyed by the model,
+    the sampling parameters and the normalized conversation.
+
+    Entries expire after `ttl` seconds (if set) and the least recently used ones
+    are evicted beyond `max_entries` or `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: str = "./.llm_cache.sqlite",
+        max_entries: Optional[int] = 10000,
+        max_bytes: Optional[int] = 512 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """)
+        self._db.commit()
+
+    @staticmethod
+    def key(conversation, model: str, **params) -> str:
+        payload = {
+            "conversation": type(conversation).__name__,
+            "model": model,
+            "params": params,
+            "messages": normalize_messages(conversation.messages),
+            # the same history is sent differently under another context policy
+            "context_policy": repr(getattr(conversation, "context_policy", None)),
+            "stable_prefix": getattr(conversation, "stable_prefix", False),
+        }
+        encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+            )
+
+        count, total_bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed ASC")
+        stale = []
+        for key, size in rows:
+            over_entries = self.max_entries is not None and count > self.max_entries
+            over_bytes = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not (over_entries or over_bytes):
+                break
+            stale.append((key,))
+            count -= 1
+            total_bytes -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
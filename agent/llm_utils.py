@@ -1,45 +1,480 @@
 import os
+import time
+import atexit
+import asyncio
+import threading
+import weakref
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
 import openai
 from openai import AsyncOpenAI
+from openai.types import CompletionUsage
 
 # change with your path
 from agent.conversation import Conversation, ImageTextConversation, Message
+from agent.llm_cache import LLMCache
+from agent.rate_limit import get_governor, prompt_tokens
+from agent.context_policy import count_tokens
+from agent.tracing import annotate, current_tracer, span
+
+
+@dataclass(frozen=True)
+class ClientSettings:
+    """
+    Connection pool and timeout settings shared by the sync and async clients.
+    """
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    timeout: float = 600.0
+    connect_timeout: float = 10.0
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeouts(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+
+_client_settings = ClientSettings()
+_client_lock = threading.Lock()
+_clients: Dict[Optional[str], openai.OpenAI] = {}
+# async clients hold connections bound to the loop that opened them, so they are
+# kept per event loop: {loop: {api_key: AsyncOpenAI}}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def configure_clients(**kwargs) -> ClientSettings:
+    """
+    Updates the pool settings (see `ClientSettings`) and drops the clients built
+    with the previous settings, so the next call picks up the new ones.
+    """
+    global _client_settings
+    with _client_lock:
+        _client_settings = replace(_client_settings, **kwargs)
+        stale = list(_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+    for client in stale:
+        client.close()
+    return _client_settings
+
+
+def get_client(api_key: Optional[str] = None) -> openai.OpenAI:
+    """Returns the process-wide keep-alive client for `api_key`."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    with _client_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = openai.OpenAI(
+                api_key=api_key,
+                max_retries=0,  # retried by the governor, see agent/rate_limit.py
+                timeout=_client_settings.timeouts(),
+                http_client=openai.DefaultHttpxClient(
+                    limits=_client_settings.limits(),
+                    timeout=_client_settings.timeouts(),
+                ),
+            )
+            _clients[api_key] = client
+        return client
+
+
+def get_async_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """Returns the keep-alive async client for `api_key` on the running event loop."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(api_key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                max_retries=0,  # retried by the governor, see agent/rate_limit.py
+                timeout=_client_settings.timeouts(),
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=_client_settings.limits(),
+                    timeout=_client_settings.timeouts(),
+                ),
+            )
+            clients[api_key] = client
+        return client
+
+
+@atexit.register
+def close_clients():
+    with _client_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+_cache: Optional[LLMCache] = None
+
+
+def set_cache(cache: Optional[LLMCache]):
+    """Enables (or with None, disables) the response cache for every completion call."""
+    global _cache
+    _cache = cache
+
+
+def get_cache() -> Optional[LLMCache]:
+    return _cache
+
+
+def cache_lookup(
+    conversation, model: str, **params
+) -> Tuple[Optional[str], Optional[str]]:
+    """Returns (key, cached response); both are None when caching is disabled."""
+    if _cache is None:
+        return None, None
+    key = _cache.key(conversation, model, **sampling_params(**params))
+    return key, _cache.get(key)
+
+
+def cache_store(key: Optional[str], response: Optional[str]):
+    if _cache is not None and key is not None and response is not None:
+        _cache.put(key, response)
+
+
+def sampling_params(**params) -> Dict:
+    """Drops unset (None) sampling parameters so the API default applies."""
+    return {key: value for key, value in params.items() if value is not None}
+
+
+@dataclass
+class UsageRecord:
+    """Token usage of one API call, as reported in its `usage` field."""
+
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    # prompt tokens served from the provider's prefix cache
+    cached_tokens: int = 0
+    latency: float = 0.0
+    # counted locally, the API did not report the usage (a stream cut early)
+    estimated: bool = False
+
+    def describe(self) -> str:
+        approximately = "~" if self.estimated else ""
+        return (
+            f"{approximately}prompt {self.prompt_tokens} (cached {self.cached_tokens}),"
+            f" completion {self.completion_tokens}, {self.latency:.1f}s"
+        )
+
+
+def record_usage(
+    usage_log: Optional[List[UsageRecord]],
+    model: str,
+    usage,
+    started: float,
+    estimated: bool = False,
+):
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached_tokens = details.get("cached_tokens")
+    else:
+        cached_tokens = getattr(details, "cached_tokens", None)
+    annotate(
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        cached_tokens=cached_tokens or 0,
+    )
+    if estimated:
+        annotate(usage_estimated=True)
+    if usage_log is None:
+        return
+    usage_log.append(
+        UsageRecord(
+            model=model,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=cached_tokens or 0,
+            latency=time.monotonic() - started,
+            estimated=estimated,
+        )
+    )
+
+
+def estimated_usage(messages: List[Dict], deltas: List[str]) -> CompletionUsage:
+    """The usage of a stream closed before its usage chunk: the prompt estimate and the received text."""
+    prompt = prompt_tokens(messages)
+    completion = count_tokens("".join(deltas))
+    return CompletionUsage(
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        total_tokens=prompt + completion,
+    )
+
+
+def request_size(messages: List[Dict]) -> Dict[str, int]:
+    """Bytes of text and of (base64) images sent with API-format messages."""
+    if current_tracer() is None:  # only measured for a trace
+        return {}
+    request_bytes, image_bytes = 0, 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            request_bytes += len(content.encode("utf-8"))
+            continue
+        for part in content:
+            if part["type"] == "text":
+                request_bytes += len(part["text"].encode("utf-8"))
+            else:
+                image_bytes += len(part["image_url"]["url"])
+    return {"request_bytes": request_bytes + image_bytes, "image_bytes": image_bytes}
+
+
+_backend = None
+
+
+def set_backend(backend):
+    """
+    Routes every completion to `backend` instead of the OpenAI API, e.g. a
+    scripted or recorded model for offline benchmarks (see agent/mock_llm.py).
+    A backend has `complete(model, messages, **params) -> (text, usage)`.
+    None restores the API.
+    """
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
 
 
-def chatgpt_completion(conversation: Conversation, model: str = "gpt-3.5-turbo"):
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+def backend_chunks(text: str, size: int = 16) -> Iterator[str]:
+    """Splits a backend response into stream deltas."""
+    for start in range(0, len(text), size):
+        yield text[start : start + size]
+
+
+def create_completion(
+    model: str, messages, usage_log: Optional[List[UsageRecord]] = None, **params
+) -> str:
+    """
+    The single place the sync API is called for a whole (non-streamed) response,
+    within the governor's rate limits and retries.
+    """
+    started = time.monotonic()
+    with span("llm", model=model, **request_size(messages)):
+        if _backend is not None:
+
+            def request():
+                return _backend.complete(model, messages, **params)
+
+        else:
+
+            def request():
+                chat_completion = get_client().chat.completions.create(
+                    model=model, messages=messages, **params
+                )
+                return chat_completion.choices[0].message.content, chat_completion.usage
+
+        text, usage = get_governor().call(model, messages, params, request, hedge=True)
+        record_usage(usage_log, model, usage, started)
+    return text
+
+
+async def acreate_completion(
+    model: str, messages, usage_log: Optional[List[UsageRecord]] = None, **params
+) -> str:
+    """Async counterpart of `create_completion`."""
+    started = time.monotonic()
+    with span("llm", model=model, **request_size(messages)):
+        if _backend is not None:
+
+            async def request():
+                return await asyncio.to_thread(
+                    _backend.complete, model, messages, **params
+                )
+
+        else:
+
+            async def request():
+                chat_completion = await get_async_client().chat.completions.create(
+                    model=model, messages=messages, **params
+                )
+                return chat_completion.choices[0].message.content, chat_completion.usage
+
+        text, usage = await get_governor().acall(
+            model, messages, params, request, hedge=True
+        )
+        record_usage(usage_log, model, usage, started)
+    return text
+
+
+def chatgpt_completion(
+    conversation: Conversation,
+    model: str = "gpt-3.5-turbo",
+    usage_log: Optional[List[UsageRecord]] = None,
+    seed: Optional[int] = None,
+):
+    params = sampling_params(seed=seed)
+    key, cached = cache_lookup(conversation, model, **params)
+    if cached is not None:
+        return cached
+
     messages_for_api = conversation.to_openai_format()
-    client = openai.OpenAI(api_key=openai.api_key)
 
     # Call the OpenAI API
-    chat_completion = client.chat.completions.create(
-        model=model, messages=messages_for_api
-    )
+    response = create_completion(model, messages_for_api, usage_log, **params)
+    cache_store(key, response)
+    return response
+
 
-    return chat_completion.choices[0].message.content
+def chatgpt_completion_stream(
+    conversation: Conversation,
+    model: str = "gpt-3.5-turbo",
+    usage_log: Optional[List[UsageRecord]] = None,
+    seed: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Yields the response text as it is generated. Closing the generator early
+    closes the HTTP stream, which cancels the rest of the generation.
+    Only fully consumed responses are cached; the usage of a response cut
+    early is estimated.
+    """
+    params = sampling_params(seed=seed)
+    key, cached = cache_lookup(conversation, model, **params)
+    if cached is not None:
+        yield cached
+        return
+
+    messages_for_api = conversation.to_openai_format()
+    if _backend is not None:
+        response = create_completion(model, messages_for_api, usage_log, **params)
+        yield from backend_chunks(response)
+        cache_store(key, response)
+        return
+    client = get_client()
+
+    started = time.monotonic()
+    deltas = []
+    usage = None
+    governor = get_governor()
+    with span("llm", model=model, stream=True, **request_size(messages_for_api)):
+        # only opening the stream is retried, a broken stream fails the call
+        stream = governor.call(
+            model,
+            messages_for_api,
+            params,
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=messages_for_api,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params,
+            ),
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    deltas.append(chunk.choices[0].delta.content)
+                    yield deltas[-1]
+                if chunk.usage is not None:
+                    usage = chunk.usage
+        finally:
+            stream.close()
+            # cut early (see BaseAgent.complete) or broken: no usage chunk came
+            estimated = usage is None
+            if estimated:
+                usage = estimated_usage(messages_for_api, deltas)
+            record_usage(usage_log, model, usage, started, estimated=estimated)
+            governor.settle(model, governor.estimate(messages_for_api, params), usage)
+    cache_store(key, "".join(deltas))
 
 
 async def chatgpt_completion_async(
     conversation: Conversation,
     model: str = "gpt-3.5-turbo",
-    max_tokens: int = 1024,
-    top_p: float = 0.9,
-    temperature: float = 0.1,
+    max_tokens: Optional[int] = 1024,
+    top_p: Optional[float] = 0.9,
+    temperature: Optional[float] = 0.1,
+    usage_log: Optional[List[UsageRecord]] = None,
+    seed: Optional[int] = None,
 ):
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+    params = sampling_params(
+        max_tokens=max_tokens, top_p=top_p, temperature=temperature, seed=seed
+    )
+    key, cached = cache_lookup(conversation, model, **params)
+    if cached is not None:
+        return cached
+
     messages_for_api = conversation.to_openai_format()
-    async_client = AsyncOpenAI(api_key=openai.api_key)
 
     # Call the OpenAI API
-    chat_completion = await async_client.chat.completions.create(
-        model=model,
-        messages=messages_for_api,
-        max_tokens=max_tokens,
-        top_p=top_p,
-        temperature=temperature,
-    )
+    response = await acreate_completion(model, messages_for_api, usage_log, **params)
+    cache_store(key, response)
+    return response
 
-    return chat_completion.choices[0].message.content
+
+async def chatgpt_completion_stream_async(
+    conversation: Conversation,
+    model: str = "gpt-3.5-turbo",
+    usage_log: Optional[List[UsageRecord]] = None,
+    seed: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Async counterpart of `chatgpt_completion_stream`."""
+    params = sampling_params(seed=seed)
+    key, cached = cache_lookup(conversation, model, **params)
+    if cached is not None:
+        yield cached
+        return
+
+    messages_for_api = conversation.to_openai_format()
+    if _backend is not None:
+        response = await acreate_completion(
+            model, messages_for_api, usage_log, **params
+        )
+        for delta in backend_chunks(response):
+            yield delta
+        cache_store(key, response)
+        return
+    async_client = get_async_client()
+
+    started = time.monotonic()
+    deltas = []
+    usage = None
+    governor = get_governor()
+    with span("llm", model=model, stream=True, **request_size(messages_for_api)):
+        stream = await governor.acall(
+            model,
+            messages_for_api,
+            params,
+            lambda: async_client.chat.completions.create(
+                model=model,
+                messages=messages_for_api,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params,
+            ),
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    deltas.append(chunk.choices[0].delta.content)
+                    yield deltas[-1]
+                if chunk.usage is not None:
+                    usage = chunk.usage
+        finally:
+            await stream.close()
+            # cut early (see BaseAgent.complete) or broken: no usage chunk came
+            estimated = usage is None
+            if estimated:
+                usage = estimated_usage(messages_for_api, deltas)
+            record_usage(usage_log, model, usage, started, estimated=estimated)
+            governor.settle(model, governor.estimate(messages_for_api, params), usage)
+    cache_store(key, "".join(deltas))
 
 
 def gpt4v_completion(
@@ -48,21 +483,27 @@ def gpt4v_completion(
     max_tokens: int = 1024,
     top_p: float = 0.9,
     temperature: float = 0.1,
+    usage_log: Optional[List[UsageRecord]] = None,
 ):
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+    key, cached = cache_lookup(
+        conversation, model, max_tokens=max_tokens, top_p=top_p, temperature=temperature
+    )
+    if cached is not None:
+        return cached
+
     messages_for_api = conversation.to_openai_format()
-    client = openai.OpenAI(api_key=openai.api_key)
 
     # Call the OpenAI API
-    chat_completion = client.chat.completions.create(
-        model=model,
-        messages=messages_for_api,
+    response = create_completion(
+        model,
+        messages_for_api,
+        usage_log,
         max_tokens=max_tokens,
         top_p=top_p,
         temperature=temperature,
     )
-
-    return chat_completion.choices[0].message.content
+    cache_store(key, response)
+    return response
 
 
 async def gpt4v_completion_async(
@@ -72,19 +513,25 @@ async def gpt4v_completion_async(
     top_p: float = 0.9,
     temperature: float = 0.1,
     VERBOSE: bool = False,
+    usage_log: Optional[List[UsageRecord]] = None,
 ):
     # Asynchronous call for gpt4v
-    openai.api_key = os.getenv("OPENAI_API_KEY")
+    key, cached = cache_lookup(
+        conversation, model, max_tokens=max_tokens, top_p=top_p, temperature=temperature
+    )
+    if cached is not None:
+        return cached
+
     messages_for_api = conversation.to_openai_format()
-    async_client = AsyncOpenAI(api_key=openai.api_key)
 
     if VERBOSE:
         print(f"User : ")
         print(conversation.messages[-1])
 
-    chat_completion = await async_client.chat.completions.create(
-        model=model,
-        messages=messages_for_api,
+    response = await acreate_completion(
+        model,
+        messages_for_api,
+        usage_log,
         max_tokens=max_tokens,
         top_p=top_p,
         temperature=temperature,
@@ -92,9 +539,10 @@ async def gpt4v_completion_async(
 
     if VERBOSE:
         print(f"Response : ")
-        print(chat_completion.choices[0].message.content)
+        print(response)
 
-    return chat_completion.choices[0].message.content
+    cache_store(key, response)
+    return response
 
 
 if __name__ == "__main__":
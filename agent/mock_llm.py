@@ -0,0 +1,68 @@
+import json
+import time
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from agent.context_policy import count_tokens
+from agent.llm_utils import get_client
+from agent.rate_limit import prompt_tokens
+
+# what a response says once a script has run out
+SCRIPT_END = "# Terminate\nThe script has no more responses."
+
+
+@dataclass
+class MockUsage:
+    """The `usage` of a backend response, shaped like the API's."""
+
+    prompt_tokens: int
+    completion_tokens: int
+    prompt_tokens_details: Optional[Dict] = None
+
+
+class ScriptedBackend:
+    """
+    Answers with the given responses in order, like a recorded trajectory.
+    `latency` seconds are waited per call to stand in for the model.
+    """
+
+    def __init__(self, responses: List[str], latency: float = 0.0):
+        self.responses = list(responses)
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, latency: float = 0.0) -> "ScriptedBackend":
+        """Replays a trajectory written by `RecordingBackend`."""
+        with open(path, "r") as file:
+            responses = [json.loads(line)["response"] for line in file if line.strip()]
+        return cls(responses, latency)
+
+    def complete(
+        self, model: str, messages: List[Dict], **params
+    ) -> Tuple[str, MockUsage]:
+        with self._lock:
+            index, self.calls = self.calls, self.calls + 1
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.responses[index] if index < len(self.responses) else SCRIPT_END
+        return text, MockUsage(prompt_tokens(messages), count_tokens(text))
+
+
+class RecordingBackend:
+    """Calls the OpenAI API and appends every response to a JSONL trajectory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def complete(self, model: str, messages: List[Dict], **params):
+        chat_completion = get_client().chat.completions.create(
+            model=model, messages=messages, **params
+        )
+        text = chat_completion.choices[0].message.content
+        with self._lock, open(self.path, "a") as file:
+            file.write(json.dumps({"model": model, "response": text}) + "\n")
+        return text, chat_completion.usage
@@ -0,0 +1,156 @@
+import re
+from difflib import SequenceMatcher
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+SEARCH_REPLACE_PATTERN = re.compile(
+    r"<<<<<<< SEARCH\n(?P<search>[\s\S]*?)\n?=======\n(?P<replace>[\s\S]*?)\n?>>>>>>> REPLACE"
+)
+
+
+class PatchConflict(Exception):
+    """A hunk could not be located in the file; the message says why."""
+
+
+@dataclass
+class Hunk:
+    search: str
+    replace: str
+
+
+def parse_patch(patch: str) -> List[Hunk]:
+    """Reads search/replace blocks or, failing that, the hunks of a unified diff."""
+    hunks = [
+        Hunk(match.group("search"), match.group("replace"))
+        for match in SEARCH_REPLACE_PATTERN.finditer(patch)
+    ]
+    if hunks:
+        return hunks
+
+    old: Optional[List[str]] = None
+    new: List[str] = []
+    for line in patch.split("\n"):
+        if line.startswith("@@"):
+            if old is not None:
+                hunks.append(Hunk("\n".join(old), "\n".join(new)))
+            old, new = [], []
+        elif old is None or line.startswith(("---", "+++", "\\")):
+            continue
+        elif line.startswith("-"):
+            old.append(line[1:])
+        elif line.startswith("+"):
+            new.append(line[1:])
+        else:
+            # context line; a blank line inside a hunk is an empty context line
+            old.append(line[1:])
+            new.append(line[1:])
+    if old is not None:
+        # trailing blank lines come from the fence, not from the diff
+        while old and new and old[-1] == new[-1] == "":
+            old.pop()
+            new.pop()
+        hunks.append(Hunk("\n".join(old), "\n".join(new)))
+
+    if not hunks:
+        raise PatchConflict(
+            "No patch found. Use SEARCH/REPLACE blocks or a unified diff with @@ hunks."
+        )
+    return hunks
+
+
+def _find_lines(lines: List[str], search: List[str], key) -> List[int]:
+    target = [key(line) for line in search]
+    return [
+        start
+        for start in range(len(lines) - len(search) + 1)
+        if [key(line) for line in lines[start : start + len(search)]] == target
+    ]
+
+
+def apply_hunk(
+    content: str, hunk: Hunk, threshold: float = 0.85, margin: float = 0.05
+) -> str:
+    """
+    Replaces the part of `content` matching `hunk.search`. Tried in order: an exact
+    match, a match ignoring whitespace differences, and the most similar block of
+    lines (at least `threshold` similar, and more than `margin` more similar than
+    any other place). An ambiguous or missing match is a conflict.
+    """
+    if not hunk.search.strip():
+        if content.strip():
+            raise PatchConflict(
+                "A hunk has no lines to search for, but the file is not empty."
+            )
+        return hunk.replace
+
+    occurrences = content.count(hunk.search)
+    if occurrences == 1:
+        return content.replace(hunk.search, hunk.replace, 1)
+    if occurrences > 1:
+        raise PatchConflict(
+            f"The search text matches {occurrences} places, add surrounding lines to make it unique:\n{hunk.search}"
+        )
+
+    lines = content.split("\n")
+    search = hunk.search.split("\n")
+    replace = hunk.replace.split("\n")
+
+    starts = _find_lines(lines, search, lambda line: " ".join(line.split()))
+    if len(starts) > 1:
+        raise PatchConflict(
+            f"The search text matches {len(starts)} places, add surrounding lines to make it unique:\n{hunk.search}"
+        )
+    if len(starts) == 1:
+        start = starts[0]
+        return "\n".join(lines[:start] + replace + lines[start + len(search) :])
+
+    ratios = [
+        (
+            SequenceMatcher(
+                None,
+                "\n".join(lines[start : start + len(search)]),
+                hunk.search,
+                autojunk=False,
+            ).ratio(),
+            start,
+        )
+        for start in range(max(len(lines) - len(search) + 1, 1))
+    ]
+    best_ratio, best_start = max(ratios, key=lambda pair: pair[0], default=(0.0, None))
+    if best_start is None or best_ratio < threshold:
+        closest = ""
+        if best_start is not None:
+            snippet = "\n".join(lines[best_start : best_start + len(search)])
+            closest = f"\nClosest lines ({best_start + 1}-{best_start + len(search)}, {best_ratio:.0%} similar):\n{snippet}"
+        raise PatchConflict(f"Could not find these lines:\n{hunk.search}{closest}")
+    # windows overlapping the best one are the same place shifted, not rivals
+    rivals = [
+        (ratio, start)
+        for ratio, start in ratios
+        if abs(start - best_start) >= len(search) and best_ratio - ratio < margin
+    ]
+    if rivals:
+        places = ", ".join(
+            f"lines {start + 1}-{start + len(search)} ({ratio:.0%})"
+            for ratio, start in sorted(
+                rivals + [(best_ratio, best_start)], key=lambda pair: pair[1]
+            )
+        )
+        raise PatchConflict(
+            f"The search text is about as similar to several places ({places}), copy the lines you mean exactly:\n{hunk.search}"
+        )
+
+    return "\n".join(lines[:best_start] + replace + lines[best_start + len(search) :])
+
+
+def apply_patch(content: str, patch: str) -> Tuple[str, int]:
+    """Applies every hunk of `patch` (all or nothing). Returns the new content and the hunk count."""
+    hunks = parse_patch(patch)
+    for index, hunk in enumerate(hunks):
+        try:
+            content = apply_hunk(content, hunk)
+        except PatchConflict as conflict:
+            raise PatchConflict(
+                f"Hunk {index + 1} of {len(hunks)}: {conflict}"
+            ) from None
+    return content, len(hunks)
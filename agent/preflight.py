@@ -0,0 +1,306 @@
+"""
+Checks of a written file that need no RUN: Python is compiled and its imports
+and `render_template` targets are looked up, HTML tags are matched and
+JavaScript is parsed by `node --check` (where node is installed). Each
+problem is one line of the WRITE/PATCH observation, so the model fixes it
+before it spends a RUN on it.
+"""
+
+import os
+import re
+import ast
+import sys
+import shutil
+import subprocess
+from html.parser import HTMLParser
+from importlib.machinery import PathFinder
+from typing import List, Optional
+
+# elements without an end tag
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}  # fmt: skip
+# elements whose end tag may be left out
+OPTIONAL_END_TAGS = {
+    "html", "head", "body", "p", "li", "dt", "dd", "option", "optgroup",
+    "tr", "td", "th", "thead", "tbody", "tfoot", "colgroup", "caption", "rt", "rp",
+}  # fmt: skip
+# exceptions an `except` catches an ImportError with
+IMPORT_GUARDS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+JINJA_STATEMENT_PATTERN = re.compile(r"{%-?\s*(if|for|elif|else|endif|endfor)\b")
+# <script type=...> that hold JavaScript (others hold e.g. JSON or templates)
+JAVASCRIPT_TYPES = {"text/javascript", "application/javascript", "module"}
+ES_MODULE_PATTERN = re.compile(r"^\s*(import|export)\b", re.MULTILINE)
+MAX_PROBLEMS = 5
+
+
+def sandbox_path() -> List[str]:
+    """
+    Where a launched app finds its imports besides its own directory: the
+    interpreter's sys.path without the agent's directory (apps are launched
+    by the same interpreter, see agent/sandbox_launcher.py).
+    """
+    own = os.path.abspath(sys.path[0] or os.getcwd())
+    return [
+        path
+        for path in sys.path[1:]
+        if path and os.path.abspath(path) not in (own, os.getcwd())
+    ]
+
+
+def module_exists(name: str, app_directory: str) -> bool:
+    """Whether the top-level module `name` can be imported by an app in `app_directory`."""
+    if name in sys.builtin_module_names or name in getattr(
+        sys, "stdlib_module_names", ()
+    ):
+        return True
+    # modules of the workspace may be written later, as files or packages
+    if os.path.exists(os.path.join(app_directory, name + ".py")) or os.path.isdir(
+        os.path.join(app_directory, name)
+    ):
+        return True
+    return PathFinder.find_spec(name, sandbox_path()) is not None
+
+
+class _ImportCollector(ast.NodeVisitor):
+    """Absolute imports that are not inside a `try` catching ImportError."""
+
+    def __init__(self):
+        self.imports: List[ast.stmt] = []
+        self._guarded = 0
+
+    def visit_Try(self, node):
+        guarded = any(_catches_import_error(handler) for handler in node.handlers)
+        self._guarded += guarded
+        for statement in node.body:
+            self.visit(statement)
+        self._guarded -= guarded
+        for statement in node.handlers + node.orelse + node.finalbody:
+            self.visit(statement)
+
+    visit_TryStar = visit_Try
+
+    def visit_Import(self, node):
+        if not self._guarded:
+            self.imports.append(node)
+
+    def visit_ImportFrom(self, node):
+        if not self._guarded and node.level == 0 and node.module:
+            self.imports.append(node)
+
+
+def _catches_import_error(handler: ast.ExceptHandler) -> bool:
+    if handler.type is None:
+        return True
+    types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(
+        isinstance(type_, ast.Name) and type_.id in IMPORT_GUARDS for type_ in types
+    )
+
+
+def _constant_string(node: ast.AST) -> Optional[str]:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def check_python(workspace: str, file_name: str, source: str) -> List[str]:
+    try:
+        compile(source, file_name, "exec", dont_inherit=True)
+    except SyntaxError as error:
+        line = (error.text or "").strip()
+        return [
+            f"{file_name}:{error.lineno}: SyntaxError: {error.msg}"
+            + (f" ({line})" if line else "")
+        ]
+    tree = ast.parse(source, file_name)
+    app_directory = os.path.dirname(os.path.join(workspace, file_name))
+    problems = []
+
+    collector = _ImportCollector()
+    collector.visit(tree)
+    missing = set()
+    for node in collector.imports:
+        names = (
+            [alias.name for alias in node.names]
+            if isinstance(node, ast.Import)
+            else [node.module]
+        )
+        for name in names:
+            top = name.split(".")[0]
+            if top not in missing and not module_exists(top, app_directory):
+                missing.add(top)
+                problems.append(
+                    f"{file_name}:{node.lineno}: No module named '{top}' is installed or in the workspace"
+                )
+
+    # Flask(..., template_folder="...") moves the templates
+    template_folder = "templates"
+    calls = [node for node in ast.walk(tree) if isinstance(node, ast.Call)]
+    for node in calls:
+        for keyword in node.keywords:
+            if keyword.arg == "template_folder" and _constant_string(keyword.value):
+                template_folder = _constant_string(keyword.value)
+    for node in calls:
+        function = node.func
+        name = getattr(function, "id", None) or getattr(function, "attr", None)
+        if name != "render_template" or not node.args:
+            continue
+        template = _constant_string(node.args[0])
+        if template is None:
+            continue
+        path = os.path.join(app_directory, template_folder, template)
+        if not os.path.isfile(path):
+            relative = os.path.relpath(path, workspace)
+            problems.append(
+                f"{file_name}:{node.lineno}: render_template('{template}') but {relative} does not exist (yet)"
+            )
+    return problems
+
+
+class _TagMatcher(HTMLParser):
+    """
+    Matches start and end tags. The branches of a Jinja `if`/`for` are matched
+    separately, so `{% if %}<div a>{% else %}<div b>{% endif %}` is balanced.
+    """
+
+    def __init__(self, file_name: str):
+        super().__init__()
+        self.file_name = file_name
+        self.open: List[tuple] = []  # (tag, line)
+        self.branches: List[List[tuple]] = []
+        self.problems: List[str] = []
+        self.scripts: List[tuple] = []  # (line, is a module, source) of inline scripts
+        self._script: Optional[tuple] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "script":
+            attributes = dict(attrs)
+            kind = (attributes.get("type") or "text/javascript").lower()
+            if not attributes.get("src") and kind in JAVASCRIPT_TYPES:
+                self._script = (self.getpos()[0], kind == "module")
+        if tag not in VOID_TAGS:
+            self.open.append((tag, self.getpos()[0]))
+
+    def handle_startendtag(self, tag, attrs):
+        pass  # <br/>, <div/>
+
+    def handle_endtag(self, tag):
+        line = self.getpos()[0]
+        if tag == "script":
+            self._script = None
+        if tag in VOID_TAGS:
+            return
+        if tag not in [name for name, _ in self.open]:
+            self.problems.append(
+                f"{self.file_name}:{line}: </{tag}> has no matching <{tag}>"
+            )
+            return
+        while self.open:
+            name, opened = self.open.pop()
+            if name == tag:
+                break
+            if name not in OPTIONAL_END_TAGS:
+                self.problems.append(
+                    f"{self.file_name}:{opened}: <{name}> is not closed before </{tag}> on line {line}"
+                )
+
+    def handle_data(self, data):
+        if self._script is not None:
+            line, module = self._script
+            self.scripts.append((line, module, data))
+            self._script = None
+            return
+        for match in JINJA_STATEMENT_PATTERN.finditer(data):
+            keyword = match.group(1)
+            if keyword in ("if", "for"):
+                self.branches.append(list(self.open))
+            elif keyword in ("elif", "else") and self.branches:
+                self.open = list(self.branches[-1])
+            elif keyword in ("endif", "endfor") and self.branches:
+                self.branches.pop()
+
+    def finish(self) -> List[str]:
+        self.close()
+        for name, opened in self.open:
+            if name not in OPTIONAL_END_TAGS:
+                self.problems.append(
+                    f"{self.file_name}:{opened}: <{name}> is never closed"
+                )
+        return self.problems
+
+
+def check_html(workspace: str, file_name: str, source: str) -> List[str]:
+    matcher = _TagMatcher(file_name)
+    matcher.feed(source)
+    problems = matcher.finish()
+    for line, module, script in matcher.scripts:
+        # scripts with template expressions are only valid once rendered
+        if "{{" in script or "{%" in script:
+            continue
+        problems += check_javascript(file_name, script, first_line=line, module=module)
+    return problems
+
+
+def check_javascript(
+    file_name: str, source: str, first_line: int = 1, module: Optional[bool] = None
+) -> List[str]:
+    """Parses the script with `node --check`; no problems where node is missing."""
+    node = shutil.which("node")
+    if node is None or not source.strip():
+        return []
+    if module is None:
+        module = ES_MODULE_PATTERN.search(source) is not None
+    command = [node, "--check"]
+    if module:
+        command.append("--input-type=module")
+    try:
+        result = subprocess.run(
+            command, input=source, capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    if result.returncode == 0:
+        return []
+    # [stdin]:LINE, the source line, a caret, then the error
+    lines = result.stderr.splitlines()
+    line = first_line
+    match = re.match(r"\[stdin\]:(\d+)", lines[0]) if lines else None
+    if match:
+        line = first_line + int(match.group(1)) - 1
+    message = next(
+        (text.strip() for text in lines if re.match(r"\w*Error\b", text.strip())),
+        "invalid JavaScript",
+    )
+    return [f"{file_name}:{line}: {message}"]
+
+
+def preflight(workspace: str, file_name: str) -> List[str]:
+    """The problems found in a file of the workspace, at most MAX_PROBLEMS."""
+    path = os.path.join(workspace, file_name)
+    try:
+        with open(path, "r") as file:
+            source = file.read()
+    except (OSError, UnicodeDecodeError):
+        return []
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".py":
+        problems = check_python(workspace, file_name, source)
+    elif extension in (".html", ".htm", ".jinja", ".j2"):
+        problems = check_html(workspace, file_name, source)
+    elif extension in (".js", ".mjs"):
+        problems = check_javascript(
+            file_name, source, module=extension == ".mjs" or None
+        )
+    else:
+        problems = []
+    return problems[:MAX_PROBLEMS]
+
+
+def describe(problems: List[str]) -> str:
+    if not problems:
+        return ""
+    return "[Pre-flight check found problems, fix them before RUN]\n" + "\n".join(
+        problems
+    )
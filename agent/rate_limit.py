@@ -0,0 +1,337 @@
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import openai
+
+from agent.context_policy import count_tokens
+from agent.tracing import annotate
+
+Result = TypeVar("Result")
+
+# status codes worth another attempt besides 5xx
+RETRYABLE_STATUS = (408, 409, 429)
+# completion tokens reserved for a call that sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+
+
+def prompt_tokens(messages: List[Dict]) -> int:
+    """Estimates the prompt size of API-format messages (765 tokens per image)."""
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += 4 + count_tokens(content)
+            continue
+        tokens += 4
+        for part in content:
+            if part["type"] == "text":
+                tokens += count_tokens(part["text"])
+            else:
+                tokens += 765
+    return tokens
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    """The account limits of one model; None is unlimited."""
+
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+    @classmethod
+    def from_args(cls, args) -> "RateLimits":
+        return cls(
+            requests_per_minute=getattr(args, "rpm", None),
+            tokens_per_minute=getattr(args, "tpm", None),
+        )
+
+    def share(self, parts: int) -> "RateLimits":
+        """The limits of one of `parts` processes splitting the account."""
+        return RateLimits(
+            requests_per_minute=self.requests_per_minute
+            and self.requests_per_minute / parts,
+            tokens_per_minute=self.tokens_per_minute and self.tokens_per_minute / parts,
+        )
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Retries of a failed API call: exponential backoff with full jitter, or the
+    server's Retry-After when it sends one. `hedge_after` seconds into a
+    non-streamed call, a second identical request is sent and whichever answers
+    first wins; None disables hedging.
+    """
+
+    max_retries: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    hedge_after: Optional[float] = None
+
+    @classmethod
+    def from_args(cls, args) -> "RetryPolicy":
+        return cls(
+            max_retries=getattr(args, "max_retries", 5),
+            hedge_after=getattr(args, "hedge_after", None),
+        )
+
+
+class TokenBucket:
+    """
+    Refills `capacity` units per minute. Reservations may run the level below
+    zero; the caller then waits until the refill pays the debt back, so
+    concurrent callers are served in the order they reserved.
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.capacity / 60.0
+        )
+        self.updated = now
+
+    def reserve(self, amount: float, block: bool = True) -> Optional[float]:
+        """Takes `amount` and returns the seconds to wait before using it; without
+        `block`, takes nothing and returns None unless it is available now."""
+        amount = min(amount, self.capacity)  # a huge request must still pass
+        with self._lock:
+            self._refill()
+            if not block and self.level < amount:
+                return None
+            self.level -= amount
+            return max(0.0, -self.level * 60.0 / self.capacity)
+
+    def give_back(self, amount: float):
+        """Corrects a reservation by `amount` (negative to charge more)."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """The delay the server asked for, in seconds."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:  # an HTTP date, rare enough to fall back to backoff
+        return None
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        if getattr(error, "code", None) == "insufficient_quota":
+            return False
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+class Governor:
+    """
+    Shared by every completion call of the process: waits for the per-model
+    request and token budgets, retries transient failures and hedges slow
+    calls (see `RetryPolicy`).
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, RateLimits]] = None,
+        default_limits: RateLimits = RateLimits(),
+        policy: RetryPolicy = RetryPolicy(),
+    ):
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits
+        self.policy = policy
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], ...]] = {}
+        self._lock = threading.Lock()
+
+    def buckets(self, model: str) -> Tuple[Optional[TokenBucket], ...]:
+        """The (requests, tokens) buckets of the model."""
+        with self._lock:
+            if model not in self._buckets:
+                limits = self.limits.get(model, self.default_limits)
+                self._buckets[model] = tuple(
+                    TokenBucket(capacity) if capacity else None
+                    for capacity in (
+                        limits.requests_per_minute,
+                        limits.tokens_per_minute,
+                    )
+                )
+            return self._buckets[model]
+
+    def reserve(self, model: str, tokens: int, block: bool = True) -> Optional[float]:
+        """Seconds to wait before a request of `tokens`; see `TokenBucket.reserve`."""
+        requests, token_bucket = self.buckets(model)
+        if not block:
+            if token_bucket is not None and token_bucket.reserve(tokens, False) is None:
+                return None
+            if requests is not None and requests.reserve(1, False) is None:
+                if token_bucket is not None:
+                    token_bucket.give_back(tokens)
+                return None
+            return 0.0
+        delay = 0.0
+        if requests is not None:
+            delay = max(delay, requests.reserve(1))
+        if token_bucket is not None:
+            delay = max(delay, token_bucket.reserve(tokens))
+        return delay
+
+    def settle(self, model: str, estimated: int, usage):
+        """Gives back what a call reserved beyond the tokens it used."""
+        token_bucket = self.buckets(model)[1]
+        if token_bucket is None or usage is None:
+            return
+        token_bucket.give_back(
+            estimated - usage.prompt_tokens - usage.completion_tokens
+        )
+
+    def refund(self, model: str, tokens: int):
+        """Gives back the reservation of a call that failed, so retries do not pile up."""
+        token_bucket = self.buckets(model)[1]
+        if token_bucket is not None:
+            token_bucket.give_back(tokens)
+
+    def estimate(self, messages: List[Dict], params: Dict) -> int:
+        return prompt_tokens(messages) + (
+            params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+        )
+
+    def backoff(self, error: Exception, attempt: int) -> float:
+        delay = retry_after(error)
+        if delay is not None:
+            return delay + random.uniform(0, self.policy.base_delay)
+        ceiling = min(self.policy.max_delay, self.policy.base_delay * 2**attempt)
+        return random.uniform(0, ceiling)
+
+    def call(
+        self,
+        model: str,
+        messages: List[Dict],
+        params: Dict,
+        request: Callable[[], Result],
+        hedge: bool = False,
+    ) -> Result:
+        """
+        Calls `request` (which returns (text, usage) or a stream) within the
+        model's budget, retrying transient API errors.
+        """
+        tokens = self.estimate(messages, params)
+        for attempt in range(self.policy.max_retries + 1):
+            time.sleep(self.reserve(model, tokens))
+            try:
+                if hedge and self.policy.hedge_after is not None:
+                    result = self._hedged(model, tokens, request)
+                else:
+                    result = request()
+            except Exception as error:
+                self.refund(model, tokens)
+                if not is_retryable(error) or attempt == self.policy.max_retries:
+                    raise
+                annotate(retries=attempt + 1)
+                time.sleep(self.backoff(error, attempt))
+                continue
+            if isinstance(result, tuple):
+                self.settle(model, tokens, result[1])
+            return result
+
+    async def acall(
+        self,
+        model: str,
+        messages: List[Dict],
+        params: Dict,
+        request: Callable[[], Awaitable[Result]],
+        hedge: bool = False,
+    ) -> Result:
+        """Async counterpart of `call`."""
+        tokens = self.estimate(messages, params)
+        for attempt in range(self.policy.max_retries + 1):
+            await asyncio.sleep(self.reserve(model, tokens))
+            try:
+                if hedge and self.policy.hedge_after is not None:
+                    result = await self._ahedged(model, tokens, request)
+                else:
+                    result = await request()
+            except Exception as error:
+                self.refund(model, tokens)
+                if not is_retryable(error) or attempt == self.policy.max_retries:
+                    raise
+                annotate(retries=attempt + 1)
+                await asyncio.sleep(self.backoff(error, attempt))
+                continue
+            if isinstance(result, tuple):
+                self.settle(model, tokens, result[1])
+            return result
+
+    def _hedged(self, model: str, tokens: int, request: Callable[[], Result]) -> Result:
+        # a thread cannot be cancelled: the slower request runs to its end
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            futures = [pool.submit(contextvars.copy_context().run, request)]
+            done, _ = wait(futures, timeout=self.policy.hedge_after)
+            # only hedge when the budget has room for a second request right now
+            if not done and self.reserve(model, tokens, block=False) is not None:
+                annotate(hedged=True)
+                futures.append(pool.submit(contextvars.copy_context().run, request))
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                answered = [future for future in done if future.exception() is None]
+                if answered or not pending:
+                    return (answered or list(done))[0].result()
+        finally:
+            pool.shutdown(wait=False)
+
+    async def _ahedged(
+        self, model: str, tokens: int, request: Callable[[], Awaitable[Result]]
+    ) -> Result:
+        tasks = [asyncio.ensure_future(request())]
+        done, _ = await asyncio.wait(tasks, timeout=self.policy.hedge_after)
+        if not done and self.reserve(model, tokens, block=False) is not None:
+            annotate(hedged=True)
+            tasks.append(asyncio.ensure_future(request()))
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                answered = [task for task in done if task.exception() is None]
+                if answered or not pending:
+                    return (answered or list(done))[0].result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+_governor = Governor()
+
+
+def set_governor(governor: Governor):
+    """Replaces the governor every completion call goes through."""
+    global _governor
+    _governor = governor
+
+
+def get_governor() -> Governor:
+    return _governor
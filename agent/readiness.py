@@ -0,0 +1,112 @@
+import re
+import time
+import socket
+import urllib.request
+import urllib.error
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+# werkzeug prints this once the socket is bound
+FLASK_READY_PATTERN = r"Running on (?:https?://)?[\w.\-\[\]:]*?:(?P<port>\d+)"
+
+
+@dataclass
+class ReadinessConfig:
+    """
+    When a launched app counts as up.
+
+    The app is ready when `log_pattern` shows up in its output (its `port` group,
+    if any, tells where it listens) or, when `port` is fixed, once that port
+    accepts connections. If `health_path` is set, it must also answer HTTP 200.
+    """
+
+    timeout: float = 15.0
+    poll_interval: float = 0.02
+    port: Optional[int] = None
+    health_path: Optional[str] = None
+    log_pattern: Optional[str] = FLASK_READY_PATTERN
+    # how long a listening port waits for the log line before it counts on its own
+    settle_time: float = 0.5
+
+    @classmethod
+    def from_args(cls, args) -> "ReadinessConfig":
+        defaults = cls()
+        return cls(
+            timeout=getattr(args, "run_timeout", defaults.timeout),
+            health_path=getattr(args, "health_path", defaults.health_path),
+        )
+
+
+@dataclass
+class ReadinessResult:
+    status: str  # "ready", "exited" or "timeout"
+    elapsed: float
+    port: Optional[int] = None
+    # False when the running app was kept, as only files it re-reads changed
+    restarted: bool = True
+
+    def describe(self) -> str:
+        if not self.restarted:
+            return f"[The app kept running on port {self.port}, no Python file changed since it started]"
+        if self.status == "ready":
+            where = f" on port {self.port}" if self.port else ""
+            return f"[The app was up{where} after {self.elapsed:.1f}s]"
+        if self.status == "exited":
+            return f"[The app exited after {self.elapsed:.1f}s]"
+        return f"[The app was not up after {self.elapsed:.1f}s]"
+
+
+def port_is_listening(port: int, host: str = "127.0.0.1") -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def health_check(port: int, path: str, host: str = "127.0.0.1") -> bool:
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}{path}", timeout=1) as res:
+            return res.status == 200
+    except (urllib.error.URLError, OSError, ValueError):
+        return False
+
+
+def wait_until_ready(
+    read_output: Callable[[], str],
+    is_alive: Callable[[], bool],
+    config: Optional[ReadinessConfig] = None,
+) -> ReadinessResult:
+    """Polls a launched app until it is up, has exited, or the deadline passed."""
+    config = config or ReadinessConfig()
+    pattern = re.compile(config.log_pattern) if config.log_pattern else None
+    start = time.monotonic()
+    listening_since = None
+
+    while True:
+        elapsed = time.monotonic() - start
+        output = read_output()
+        if not is_alive():
+            return ReadinessResult("exited", elapsed)
+
+        port = config.port
+        up = False
+        match = pattern.search(output) if pattern else None
+        if match is not None:
+            up = True
+            # the app may ignore the port it was given, trust what it logged
+            if match.groupdict().get("port"):
+                port = int(match.group("port"))
+        elif port is not None and port_is_listening(port):
+            if listening_since is None:
+                listening_since = elapsed
+            up = pattern is None or elapsed - listening_since >= config.settle_time
+
+        if up and config.health_path and port is not None:
+            up = health_check(port, config.health_path)
+        if up:
+            return ReadinessResult("ready", elapsed, port)
+
+        if elapsed >= config.timeout:
+            return ReadinessResult("timeout", elapsed, port)
+        time.sleep(config.poll_interval)
@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+try:
+    _CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = 100
+
+
+@dataclass
+class ResourceUsage:
+    """What a launched app (with its child processes) has used so far."""
+
+    peak_rss_mb: float
+    cpu_seconds: float
+
+    def describe(self) -> str:
+        return f"[peak RSS {self.peak_rss_mb:.1f}MB, CPU {self.cpu_seconds:.2f}s]"
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    try:
+        for thread in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{thread}/children") as file:
+                children.extend(int(child) for child in file.read().split())
+    except (OSError, ValueError):
+        pass
+    return children
+
+
+def _process_tree(pid: int) -> Iterator[int]:
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        yield current
+        pending.extend(_children(current))
+
+
+def process_usage(pid: int) -> Optional[ResourceUsage]:
+    """
+    Usage of a live process tree from /proc: the peak RSS of every process
+    (VmHWM) and their CPU time, the reaped children's included. None where
+    /proc is not available.
+    """
+    peak_kb, ticks, found = 0, 0, False
+    for current in _process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status") as file:
+                for line in file:
+                    if line.startswith("VmHWM:"):
+                        peak_kb += int(line.split()[1])
+            with open(f"/proc/{current}/stat") as file:
+                # the command name may contain spaces, the fields after it do not
+                fields = file.read().rsplit(")", 1)[1].split()
+            # utime, stime, cutime, cstime
+            ticks += sum(int(value) for value in fields[11:15])
+            found = True
+        except (OSError, IndexError, ValueError):
+            continue
+    if not found:
+        return None
+    return ResourceUsage(peak_kb / 1024, ticks / _CLOCK_TICKS)
+
+
+def rusage_usage(rusage) -> ResourceUsage:
+    """Usage from the rusage of a reaped process (ru_maxrss is in KB on Linux)."""
+    return ResourceUsage(rusage.ru_maxrss / 1024, rusage.ru_utime + rusage.ru_stime)
+
+
+def cgroup2_root() -> Optional[str]:
+    """Where the cgroup v2 hierarchy is mounted, if it is."""
+    try:
+        with open("/proc/self/mounts") as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == "cgroup2":
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def own_cgroup() -> Optional[str]:
+    """The directory of this process' cgroup v2."""
+    root = cgroup2_root()
+    if root is None:
+        return None
+    try:
+        with open("/proc/self/cgroup") as file:
+            for line in file:
+                if line.startswith("0::"):
+                    return os.path.join(root, line[3:].strip().lstrip("/"))
+    except OSError:
+        pass
+    return None
+
+
+class AppCgroup:
+    """
+    A cgroup v2 of one launched app, below the cgroup named by AGENT_CGROUP or
+    this process' own one. It is only used where that cgroup delegates the
+    memory and pids controllers to writable children; otherwise `create`
+    returns None and the rlimits stay the only limits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def create(
+        cls, memory_mb: Optional[int] = None, processes: Optional[int] = None
+    ) -> Optional["AppCgroup"]:
+        base = os.environ.get("AGENT_CGROUP") or own_cgroup()
+        if base is None:
+            return None
+        try:
+            with open(os.path.join(base, "cgroup.subtree_control")) as file:
+                controllers = file.read().split()
+        except OSError:
+            return None
+        if "memory" not in controllers or "pids" not in controllers:
+            return None
+        path = os.path.join(base, f"agent-app-{uuid.uuid4().hex[:12]}")
+        try:
+            os.mkdir(path)
+        except OSError:
+            return None
+        cgroup = cls(path)
+        try:
+            if memory_mb:
+                cgroup._write("memory.max", str(memory_mb * 1024 * 1024))
+                cgroup._write("memory.swap.max", "0")
+            if processes:
+                cgroup._write("pids.max", str(processes))
+        except OSError:
+            cgroup.remove()
+            return None
+        return cgroup
+
+    def _write(self, name: str, value: str):
+        try:
+            with open(os.path.join(self.path, name), "w") as file:
+                file.write(value)
+        except FileNotFoundError:  # e.g. no swap accounting
+            if name != "memory.swap.max":
+                raise
+
+    def usage(self) -> Optional[ResourceUsage]:
+        try:
+            peak_path = os.path.join(self.path, "memory.peak")
+            if not os.path.exists(peak_path):  # before Linux 5.19
+                peak_path = os.path.join(self.path, "memory.current")
+            with open(peak_path) as file:
+                peak = int(file.read())
+            with open(os.path.join(self.path, "cpu.stat")) as file:
+                stats = dict(line.split() for line in file if line.strip())
+            return ResourceUsage(
+                peak / (1024 * 1024), int(stats["usage_usec"]) / 1_000_000
+            )
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def remove(self):
+        # the directory can only go once its last process has been reaped
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.02)
@@ -0,0 +1,238 @@
+"""
+Pre-started interpreters for generated apps. Each process is spawned ahead of
+time with Flask already imported and then waits on stdin for the app to run,
+so a RUN only pays for the app's own startup:
+
+    {"file": "/abs/workspace/app.py", "cwd": "/abs/workspace", "env": {...},
+     "limits": {"cpu_seconds": 60, "memory_mb": 1024, ...}, "cgroup": null}
+
+Run as a script, this module is the interpreter side; `WarmInterpreter` and
+`InterpreterPool` are the side of the supervisor.
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import threading
+import subprocess
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # not on Windows; limits are then not applied
+    resource = None
+
+LAUNCHER_PATH = os.path.abspath(__file__)
+# imported before the app is known; each one missing is simply skipped
+PRELOADED_MODULES = ("flask", "jinja2", "werkzeug.serving")
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """
+    What one launched app may use; None is unlimited. CPU time, address space,
+    open files and processes are rlimits of the app process; memory and
+    processes are also enforced for the whole app by a cgroup v2 where one can
+    be created (see agent/resource_usage.py). The wall time is enforced by the
+    supervisor, which stops the app once it is up for that long.
+
+    RLIMIT_NPROC counts every process of the user, not only the app's.
+    """
+
+    cpu_seconds: Optional[int] = None
+    memory_mb: Optional[int] = None
+    wall_seconds: Optional[float] = None
+    open_files: Optional[int] = None
+    processes: Optional[int] = None
+
+    @classmethod
+    def from_args(cls, args) -> "ResourceLimits":
+        return cls(
+            cpu_seconds=getattr(args, "app_cpu_seconds", None),
+            memory_mb=getattr(args, "app_memory_mb", None),
+            wall_seconds=getattr(args, "app_wall_seconds", None),
+            open_files=getattr(args, "app_open_files", None),
+            processes=getattr(args, "app_processes", None),
+        )
+
+
+class WarmInterpreter:
+    """
+    One spawned launcher interpreter. It runs exactly one app: after an app
+    the interpreter holds its modules and state, so it is never handed out
+    again (the pool starts a fresh one instead).
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.process = subprocess.Popen(
+            [sys.executable, LAUNCHER_PATH],
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            start_new_session=True,
+        )
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(
+        self,
+        file_path: str,
+        cwd: str,
+        env: Dict[str, str],
+        limits: ResourceLimits = ResourceLimits(),
+        cgroup: Optional[str] = None,
+    ) -> subprocess.Popen:
+        """Hands the app over; the process then belongs to the caller."""
+        command = {
+            "file": os.path.abspath(file_path),
+            "cwd": cwd,
+            "env": env,
+            "limits": asdict(limits),
+            "cgroup": cgroup,
+        }
+        self.process.stdin.write(json.dumps(command) + "\n")
+        self.process.stdin.close()
+        return self.process
+
+    def close(self):
+        if self.is_alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class InterpreterPool:
+    """
+    Keeps `size` launcher interpreters started, so concurrent agents each find
+    one ready. Every taken interpreter is replaced in the background; spares
+    older than `max_age` seconds are recycled, so they pick up a changed
+    environment (e.g. newly installed packages).
+    """
+
+    def __init__(self, size: int = 2, max_age: float = 600.0):
+        self.size = size
+        self.max_age = max_age
+        self._spares: List[WarmInterpreter] = []
+        self._starting = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> WarmInterpreter:
+        """A ready interpreter, or a newly started one if none is ready."""
+        stale = []
+        spare = None
+        with self._lock:
+            while self._spares and spare is None:
+                candidate = self._spares.pop(0)
+                if (
+                    candidate.is_alive()
+                    and time.monotonic() - candidate.started < self.max_age
+                ):
+                    spare = candidate
+                else:
+                    stale.append(candidate)
+        for interpreter in stale:
+            interpreter.close()
+        self.fill()
+        return spare or WarmInterpreter()
+
+    def fill(self):
+        """Starts interpreters in the background until `size` are ready or starting."""
+        with self._lock:
+            missing = self.size - len(self._spares) - self._starting
+            self._starting += max(missing, 0)
+        for _ in range(missing):
+            threading.Thread(target=self._start_one, daemon=True).start()
+
+    def _start_one(self):
+        interpreter = WarmInterpreter()
+        with self._lock:
+            self._starting -= 1
+            if len(self._spares) < self.size:
+                self._spares.append(interpreter)
+                interpreter = None
+        if interpreter is not None:  # the pool shrank meanwhile
+            interpreter.close()
+
+    def resize(self, size: int):
+        """Sets the pool size and starts filling the pool up to it."""
+        with self._lock:
+            self.size = size
+            surplus, self._spares = self._spares[size:], self._spares[:size]
+        for interpreter in surplus:
+            interpreter.close()
+        self.fill()
+
+    def close(self):
+        with self._lock:
+            spares, self._spares = self._spares, []
+        for interpreter in spares:
+            interpreter.close()
+
+
+def apply_limits(limits: Dict, cgroup: Optional[str] = None):
+    """
+    Moves the current process into `cgroup` (a directory of the cgroup v2
+    tree) and sets the rlimits of `ResourceLimits` (as a dict) on it.
+    """
+    if cgroup is not None:
+        with open(os.path.join(cgroup, "cgroup.procs"), "w") as file:
+            file.write(str(os.getpid()))
+    if resource is None:
+        return
+    if limits.get("cpu_seconds"):
+        seconds = int(limits["cpu_seconds"])
+        # SIGXCPU at the soft limit, SIGKILL a second later
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+    if limits.get("memory_mb"):
+        size = int(limits["memory_mb"]) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    if limits.get("open_files"):
+        count = int(limits["open_files"])
+        resource.setrlimit(resource.RLIMIT_NOFILE, (count, count))
+    if limits.get("processes"):
+        count = int(limits["processes"])
+        resource.setrlimit(resource.RLIMIT_NPROC, (count, count))
+
+
+def _preload():
+    for name in PRELOADED_MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    try:
+        from flask import Flask
+    except ImportError:
+        return
+    # templates are re-read when they change, so an edit needs no restart
+    Flask.default_config = {**Flask.default_config, "TEMPLATES_AUTO_RELOAD": True}
+
+
+def main():
+    _preload()
+    line = sys.stdin.readline()
+    if not line:  # closed unused
+        return
+    command = json.loads(line)
+
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.environ.clear()
+    os.environ.update(command["env"])
+    os.chdir(command["cwd"])
+    apply_limits(command.get("limits") or {}, command.get("cgroup"))
+    # the app sees the same sys.path and argv as under `python3 app.py`
+    sys.path[0] = os.path.dirname(command["file"])
+    sys.argv = [command["file"]]
+    runpy.run_path(command["file"], run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
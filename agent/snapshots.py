@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class Snapshot:
+    """The files of a workspace at one point: file name -> blob digest."""
+
+    id: int
+    label: str
+    files: Dict[str, str] = field(default_factory=dict)
+    created: float = 0.0
+    good: bool = False  # the app came up with these files
+
+
+class BlobStore:
+    """
+    File contents stored once under their sha256, shared by every workspace
+    below the same root (identical files of different runs take one blob).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written under a temporary name so a reader never sees half a blob
+            descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(content)
+            os.replace(temporary, path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as file:
+            return file.read()
+
+
+class SnapshotStore:
+    """
+    History of the files an agent wrote into its workspace. Every write is
+    recorded as a blob; `commit` saves the current file set as a numbered
+    snapshot in the workspace's manifest (one JSON line per snapshot), so a
+    file or the whole workspace can be restored without the model.
+    """
+
+    def __init__(self, workspace: str, root: Optional[str] = None):
+        self.workspace = workspace
+        root = root or os.path.join(os.path.dirname(workspace), ".snapshots")
+        self.blobs = BlobStore(os.path.join(root, "objects"))
+        self.manifest = os.path.join(
+            root, "manifests", f"{os.path.basename(workspace)}.jsonl"
+        )
+        os.makedirs(os.path.dirname(self.manifest), exist_ok=True)
+        self.snapshots: List[Snapshot] = []
+        self.files: Dict[str, str] = {}  # the current state
+        # every digest each file had, oldest first
+        self.versions: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, file_name: str, content: str) -> str:
+        """Stores a written file and returns its digest."""
+        digest = self.blobs.put(content.encode("utf-8"))
+        file_name = os.path.normpath(file_name)
+        with self._lock:
+            self.files[file_name] = digest
+            versions = self.versions.setdefault(file_name, [])
+            if not versions or versions[-1] != digest:
+                versions.append(digest)
+        return digest
+
+    def commit(self, label: str) -> Snapshot:
+        """Saves the current files as a snapshot, unless nothing changed since the last one."""
+        with self._lock:
+            if self.snapshots and self.snapshots[-1].files == self.files:
+                return self.snapshots[-1]
+            snapshot = Snapshot(
+                id=len(self.snapshots) + 1,
+                label=label,
+                files=dict(self.files),
+                created=time.time(),
+            )
+            self.snapshots.append(snapshot)
+            self._append(snapshot)
+            return snapshot
+
+    def mark_good(self, label: str) -> Snapshot:
+        """Commits the current files as a state the app came up with."""
+        snapshot = self.commit(label)
+        with self._lock:
+            if not snapshot.good:
+                snapshot.good = True
+                self._append(snapshot)  # the later line of an id wins
+        return snapshot
+
+    def _append(self, snapshot: Snapshot):
+        with open(self.manifest, "a") as file:
+            file.write(json.dumps(asdict(snapshot)) + "\n")
+
+    def get(self, snapshot_id: int) -> Optional[Snapshot]:
+        if 1 <= snapshot_id <= len(self.snapshots):
+            return self.snapshots[snapshot_id - 1]
+        return None
+
+    def best(self) -> Optional[Snapshot]:
+        """The latest snapshot the app came up with, else the latest one."""
+        for snapshot in reversed(self.snapshots):
+            if snapshot.good:
+                return snapshot
+        return self.snapshots[-1] if self.snapshots else None
+
+    def read(self, digest: str) -> str:
+        return self.blobs.get(digest).decode("utf-8")
+
+    def _write(self, file_name: str, digest: str):
+        file_path = os.path.join(self.workspace, file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            file.write(self.blobs.get(digest))
+        with self._lock:
+            self.files[file_name] = digest
+            if self.versions[file_name][-1] != digest:
+                self.versions[file_name].append(digest)
+
+    def revert_file(self, file_name: str) -> Optional[str]:
+        """
+        Puts back the version the file had before its last change and returns a
+        description, or None if there is no earlier version. The undone version
+        leaves the history, so each REVERT steps one version further back.
+        """
+        file_name = os.path.normpath(file_name)
+        with self._lock:
+            versions = self.versions.get(file_name, [])
+            if versions and versions[-1] == self.files.get(file_name):
+                if len(versions) == 1:
+                    return None
+                versions.pop()
+            if not versions:
+                return None
+            earlier = versions[-1]
+        self._write(file_name, earlier)
+        return f"{file_name} is back to its previous version."
+
+    def restore(self, snapshot: Snapshot) -> List[str]:
+        """Puts the workspace back to the snapshot; returns the changed files."""
+        with self._lock:
+            current = dict(self.files)
+        changed = []
+        for file_name, digest in snapshot.files.items():
+            if current.get(file_name) != digest:
+                self._write(file_name, digest)
+                changed.append(file_name)
+        for file_name in current:
+            if file_name not in snapshot.files:
+                file_path = os.path.join(self.workspace, file_name)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                with self._lock:
+                    self.files.pop(file_name, None)
+                changed.append(file_name)
+        return changed
+
+    def export(
+        self, destination: str, snapshot: Optional[Snapshot] = None
+    ) -> Optional[Snapshot]:
+        """Writes the files of the snapshot (default: the best one) into `destination`."""
+        snapshot = snapshot or self.best()
+        if snapshot is None:
+            return None
+        for file_name, digest in snapshot.files.items():
+            file_path = os.path.join(destination, file_name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "wb") as file:
+                file.write(self.blobs.get(digest))
+        return snapshot
+
+
+def revert(snapshots: SnapshotStore, target: str) -> Optional[str]:
+    """
+    Handles REVERT(target): a snapshot number, "good" (the best snapshot) or a
+    file name. Returns the observation, or None if there is nothing to revert.
+    """
+    if target.lower() == "good":
+        snapshot = snapshots.best()
+    elif target.isdigit():
+        snapshot = snapshots.get(int(target))
+    else:
+        return snapshots.revert_file(target)
+    if snapshot is None:
+        return None
+    changed = snapshots.restore(snapshot)
+    if not changed:
+        return f"The workspace already matches snapshot {snapshot.id}."
+    return f"The workspace is back to snapshot {snapshot.id} ({snapshot.label}), restored: {', '.join(sorted(changed))}."
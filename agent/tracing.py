@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# stage of each action kind in the timing breakdown
+ACTION_STAGES = {
+    "WRITE": "file_io",
+    "PATCH": "file_io",
+    "READ": "file_io",
+    "REVERT": "file_io",
+    "RUN": "app_startup",
+    "LOG": "app_log",
+    "SEE": "screenshot",
+}
+# attributes summed up per stage in the summary
+COUNTED_ATTRIBUTES = [
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "request_bytes",
+    "image_bytes",
+]
+
+
+def new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+@dataclass
+class Span:
+    """
+    A timed stage of a run, e.g. a hop, one LLM call or one screenshot. Spans
+    nest: a span opened inside another one is its child in the same trace.
+    """
+
+    name: str
+    start: float  # wall clock (time.time()) when the stage began
+    duration: float = 0.0  # seconds
+    attributes: Dict = field(default_factory=dict)
+    trace_id: str = field(default_factory=lambda: new_id(16))
+    span_id: str = field(default_factory=lambda: new_id(8))
+    parent_id: Optional[str] = None
+
+
+class Tracer:
+    """Collects the spans recorded while it is the current tracer (see `use_tracer`)."""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """Stage name -> (number of spans, seconds spent)."""
+        totals: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            for span in self.spans:
+                count, seconds = totals.get(span.name, (0, 0.0))
+                totals[span.name] = (count + 1, seconds + span.duration)
+        return totals
+
+    def summary(self) -> str:
+        """A table of the time, tokens and bytes per stage."""
+        with self._lock:
+            spans = list(self.spans)
+        stages: Dict[str, Dict] = {}
+        for span in spans:
+            stage = stages.setdefault(
+                span.name, {"count": 0, "seconds": 0.0, "max": 0.0}
+            )
+            stage["count"] += 1
+            stage["seconds"] += span.duration
+            stage["max"] = max(stage["max"], span.duration)
+            for name in COUNTED_ATTRIBUTES:
+                stage[name] = stage.get(name, 0) + span.attributes.get(name, 0)
+
+        header = ["stage", "count", "total", "mean", "max", "prompt", "completion"]
+        header += ["cached", "sent", "images"]
+        rows = [header]
+        for name, stage in sorted(stages.items(), key=lambda item: -item[1]["seconds"]):
+            rows.append(
+                [
+                    name,
+                    str(stage["count"]),
+                    f"{stage['seconds']:.2f}s",
+                    f"{stage['seconds'] / stage['count'] * 1000:.0f}ms",
+                    f"{stage['max'] * 1000:.0f}ms",
+                ]
+                + [str(stage[name]) for name in COUNTED_ATTRIBUTES[:3]]
+                + [format_bytes(stage[name]) for name in COUNTED_ATTRIBUTES[3:]]
+            )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        return "\n".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+            for row in rows
+        )
+
+    def export_jsonl(self, path: str):
+        """Writes one JSON object per span."""
+        with self._lock, open(path, "w") as file:
+            for span in self.spans:
+                file.write(json.dumps(asdict(span)) + "\n")
+
+    def export_otlp(self, path: str, service_name: str = "develop-agent"):
+        """Writes the spans as an OTLP/JSON trace export (what a collector accepts)."""
+        with self._lock:
+            spans = [otlp_span(span) for span in self.spans]
+        document = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": otlp_attributes({"service.name": service_name})
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": "agent.tracing"}, "spans": spans}
+                    ],
+                }
+            ]
+        }
+        with open(path, "w") as file:
+            json.dump(document, file)
+
+
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def otlp_attributes(attributes: Dict) -> List[Dict]:
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        converted.append({"key": key, "value": typed})
+    return converted
+
+
+def otlp_span(span: Span) -> Dict:
+    start = int(span.start * 1e9)
+    converted = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(start),
+        "endTimeUnixNano": str(start + int(span.duration * 1e9)),
+        "attributes": otlp_attributes(span.attributes),
+    }
+    if span.parent_id:
+        converted["parentSpanId"] = span.parent_id
+    return converted
+
+
+# context variables follow asyncio tasks and `asyncio.to_thread`; plain thread
+# pools need `contextvars.copy_context().run` to keep the tracer
+_current_tracer: contextvars.ContextVar[Optional[Tracer]] = contextvars.ContextVar(
+    "current_tracer", default=None
+)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _current_tracer.get()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def annotate(**attributes):
+    """Adds attributes (e.g. token counts) to the innermost open span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+@contextmanager
+def use_tracer(tracer: Tracer) -> Iterator[Tracer]:
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Times the block as a stage of the current tracer; a no-op without one."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, time.time(), attributes=attributes)
+    if parent is not None:
+        current.trace_id, current.parent_id = parent.trace_id, parent.span_id
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - started
+        try:
+            _current_span.reset(token)
+        except ValueError:  # a generator finalized outside the context it ran in
+            pass
+        tracer.add(current)
@@ -0,0 +1,458 @@
+"""
+Runs the agent over a file of instructions, e.g.
+
+    python3 batch.py tasks.jsonl --manifest results.jsonl --pool process --workers 4
+
+Every line of the tasks file is a JSON object with an "instruction" and,
+optionally, an "id", "agent_type", "model" and "max_hop". One JSON line per
+finished task is appended to the manifest as soon as it is done; running the
+same command again skips the tasks already recorded as "ok".
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import hashlib
+import contextvars
+import inspect
+import argparse
+import threading
+import multiprocessing
+from queue import Empty
+from dataclasses import asdict, dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from agent.app_runner import get_supervisor
+from agent.llm_cache import LLMCache
+from agent.llm_utils import set_cache
+from agent.rate_limit import Governor, RateLimits, RetryPolicy, set_governor
+from agent.tracing import Tracer, current_span, current_tracer, span, use_tracer
+from run import AGENT_MAP, add_agent_arguments, concurrency_limit
+
+
+@dataclass
+class Task:
+    id: str
+    instruction: str
+    agent_type: str
+    model: Optional[str] = None
+    max_hop: Optional[int] = None
+
+
+@dataclass
+class TaskResult:
+    id: str
+    agent_type: str
+    model: str
+    instruction: str
+    status: str  # "ok", "error" or "timeout" (of the last attempt)
+    attempts: int
+    latency: float  # seconds, all attempts included
+    hops: Optional[int] = None
+    api_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    # of the app as last observed (RUN/LOG)
+    app_peak_rss_mb: Optional[float] = None
+    app_cpu_seconds: Optional[float] = None
+    workspace: Optional[str] = None
+    response: Optional[str] = None
+    error: Optional[str] = None
+
+
+def load_tasks(path: str, default_agent_type: str) -> List[Task]:
+    tasks = []
+    with open(path, "r") as file:
+        for index, line in enumerate(file):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            agent_type = entry.get("agent_type", default_agent_type)
+            task_id = (
+                entry.get("id")
+                or hashlib.md5(
+                    f"{index}:{agent_type}:{entry['instruction']}".encode()
+                ).hexdigest()[:12]
+            )
+            tasks.append(
+                Task(
+                    id=str(task_id),
+                    instruction=entry["instruction"],
+                    agent_type=agent_type,
+                    model=entry.get("model"),
+                    max_hop=entry.get("max_hop"),
+                )
+            )
+    return tasks
+
+
+def load_done(manifest: str) -> Set[str]:
+    """Ids of the tasks the manifest already records as done."""
+    done = set()
+    if not os.path.exists(manifest):
+        return done
+    with open(manifest, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:  # a line cut off by an interruption
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def make_agent(task: Task, args):
+    task_args = argparse.Namespace(**vars(args))
+    task_args.agent_type = task.agent_type
+    task_args.model = task.model or args.model
+    return AGENT_MAP[task.agent_type](task_args)
+
+
+def run_kwargs(agent, task: Task, args) -> Dict:
+    parameters = inspect.signature(agent.run).parameters
+    kwargs = {}
+    if "VERBOSE" in parameters:
+        kwargs["VERBOSE"] = args.verbose
+    if task.max_hop is not None:
+        kwargs["max_hop"] = task.max_hop
+    return kwargs
+
+
+def agent_fields(agent, responses) -> Dict:
+    """What a (finished or abandoned) agent run used."""
+    usage = getattr(agent, "usage", [])
+    app_usage = getattr(agent, "app_usage", None)
+    return {
+        "hops": getattr(agent, "hops", None),
+        "api_calls": len(usage),
+        "prompt_tokens": sum(record.prompt_tokens for record in usage),
+        "completion_tokens": sum(record.completion_tokens for record in usage),
+        "cached_tokens": sum(record.cached_tokens for record in usage),
+        "app_peak_rss_mb": app_usage and round(app_usage.peak_rss_mb, 1),
+        "app_cpu_seconds": app_usage and round(app_usage.cpu_seconds, 3),
+        "workspace": getattr(agent, "workspace", None),
+        "response": responses[-1] if responses else None,
+    }
+
+
+def stop_app(agent):
+    workspace = getattr(agent, "workspace", None)
+    if workspace is not None:
+        get_supervisor().stop(workspace)
+
+
+# Each attempt returns (status, agent fields, error).
+
+
+def attempt_in_thread(task: Task, args) -> Tuple[str, Dict, Optional[str]]:
+    """
+    Runs the agent in a thread of its own. A thread cannot be killed: after a
+    timeout the agent is cancelled, its app stopped and its result ignored,
+    but it keeps running until its current hop returns. Use the process pool
+    for hard timeouts.
+    """
+    agent = make_agent(task, args)
+    outcome = {}
+
+    def target():
+        try:
+            outcome["responses"] = agent.run(
+                task.instruction, **run_kwargs(agent, task, args)
+            )
+        except Exception as error:
+            outcome["error"] = repr(error)
+        finally:
+            # the hop that outlived the timeout may have launched the app again
+            if agent.cancelled.is_set():
+                stop_app(agent)
+
+    # the agent thread records its spans under the caller's span
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(target,), daemon=True)
+    thread.start()
+    thread.join(args.timeout)
+    if thread.is_alive():
+        agent.cancelled.set()
+        status, error = "timeout", f"no result after {args.timeout}s"
+    elif "error" in outcome:
+        status, error = "error", outcome["error"]
+    else:
+        status, error = "ok", None
+    stop_app(agent)
+    return status, agent_fields(agent, outcome.get("responses")), error
+
+
+def make_governor(args, workers: int = 1) -> Governor:
+    """The rate limits and retries of the batch, split among `workers` processes."""
+    return Governor(
+        default_limits=RateLimits.from_args(args).share(workers),
+        policy=RetryPolicy.from_args(args),
+    )
+
+
+def _process_entry(task: Task, args, results, parent: Optional[Tuple[str, str]]):
+    # a terminated worker still runs atexit, which stops the apps it launched
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    if args.cache:
+        set_cache(LLMCache(args.cache, ttl=args.cache_ttl))
+    set_governor(make_governor(args, args.workers))
+    get_supervisor().pool.resize(1)  # a worker runs one task at a time
+    agent = make_agent(task, args)
+    tracer = Tracer()
+    # the spans go back with the result, under the (trace id, span id) of the caller
+    with use_tracer(tracer), span("worker", pid=os.getpid()) as root:
+        if parent is not None:
+            root.trace_id, root.parent_id = parent
+        try:
+            responses = agent.run(task.instruction, **run_kwargs(agent, task, args))
+            attempt = ("ok", agent_fields(agent, responses), None)
+        except Exception as error:
+            attempt = ("error", agent_fields(agent, None), repr(error))
+        finally:
+            stop_app(agent)
+    results.put((attempt, tracer.spans))
+
+
+def _received(item) -> Tuple[str, Dict, Optional[str]]:
+    """The attempt a worker sent; its spans join the current tracer."""
+    attempt, spans = item
+    tracer = current_tracer()
+    if tracer is not None:
+        for worker_span in spans:
+            tracer.add(worker_span)
+    return attempt
+
+
+def attempt_in_process(task: Task, args) -> Tuple[str, Dict, Optional[str]]:
+    """Runs the agent in a fresh process, which is terminated on timeout."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    caller = current_span()
+    parent = (caller.trace_id, caller.span_id) if caller is not None else None
+    process = context.Process(target=_process_entry, args=(task, args, results, parent))
+    process.start()
+    deadline = time.monotonic() + args.timeout
+    try:
+        while True:
+            try:
+                return _received(results.get(timeout=1.0))
+            except Empty:
+                if not process.is_alive():
+                    try:  # the result may still be in the pipe
+                        return _received(results.get(timeout=1.0))
+                    except Empty:
+                        return (
+                            "error",
+                            {},
+                            f"worker exited with code {process.exitcode}",
+                        )
+                if time.monotonic() >= deadline:
+                    return "timeout", {}, f"no result after {args.timeout}s"
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join(10)
+        if process.is_alive():
+            process.kill()
+
+
+async def attempt_async(task: Task, args) -> Tuple[str, Dict, Optional[str]]:
+    agent = make_agent(task, args)
+    responses, error = None, None
+    try:
+        responses = await asyncio.wait_for(
+            agent.arun(task.instruction, **run_kwargs(agent, task, args)),
+            args.timeout,
+        )
+        status = "ok"
+    except asyncio.TimeoutError:
+        status, error = "timeout", f"no result after {args.timeout}s"
+    except Exception as exception:
+        status, error = "error", repr(exception)
+    # a timed out run stops waiting for its agent, not the agent's thread: wait
+    # for it, so the app is not launched again after it was stopped
+    agent.cancelled.set()
+    if agent.in_flight is not None:
+        await asyncio.gather(agent.in_flight, return_exceptions=True)
+    await asyncio.to_thread(stop_app, agent)
+    return status, agent_fields(agent, responses), error
+
+
+def merge_attempt(
+    result: Optional[TaskResult], task: Task, args, attempt
+) -> TaskResult:
+    """Folds one attempt into the task's result; token counts add up over attempts."""
+    status, fields, error = attempt
+    previous = asdict(result) if result is not None else {}
+    for counter in ("api_calls", "prompt_tokens", "completion_tokens", "cached_tokens"):
+        fields[counter] = fields.get(counter, 0) + previous.get(counter, 0)
+    return TaskResult(
+        id=task.id,
+        agent_type=task.agent_type,
+        model=task.model or args.model,
+        instruction=task.instruction,
+        status=status,
+        attempts=previous.get("attempts", 0) + 1,
+        latency=previous.get("latency", 0.0),
+        error=error,
+        **fields,
+    )
+
+
+def backoff(attempt: int) -> float:
+    return min(2.0**attempt, 30.0)
+
+
+class Manifest:
+    """Appends one JSON line per finished task; safe to call from any thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, result: TaskResult):
+        with self._lock, open(self.path, "a") as file:
+            file.write(json.dumps(asdict(result)) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def report(result: TaskResult):
+    print(
+        f"!TASK: {result.id} {result.status} after {result.attempts} attempt(s),"
+        f" {result.hops} hops, {result.prompt_tokens}+{result.completion_tokens} tokens,"
+        f" {result.latency:.1f}s"
+    )
+
+
+def run_pooled(tasks: List[Task], args, manifest: Manifest):
+    attempt_fn = attempt_in_process if args.pool == "process" else attempt_in_thread
+
+    def run_task(task: Task) -> TaskResult:
+        result = None
+        for attempt in range(args.retries + 1):
+            started = time.monotonic()
+            with span("run", agent=task.agent_type, task=task.id, attempt=attempt + 1):
+                result = merge_attempt(result, task, args, attempt_fn(task, args))
+            result.latency += time.monotonic() - started
+            if result.status == "ok":
+                break
+            if attempt < args.retries:
+                time.sleep(backoff(attempt))
+        manifest.write(result)
+        report(result)
+        return result
+
+    # each task keeps the caller's context (e.g. its tracer)
+    contexts = [contextvars.copy_context() for _ in tasks]
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        return list(
+            pool.map(lambda context, task: context.run(run_task, task), contexts, tasks)
+        )
+
+
+async def run_async(tasks: List[Task], args, manifest: Manifest):
+    semaphore = concurrency_limit(args.workers)
+
+    async def run_task(task: Task) -> TaskResult:
+        async with semaphore:
+            result = None
+            for attempt in range(args.retries + 1):
+                started = time.monotonic()
+                with span(
+                    "run", agent=task.agent_type, task=task.id, attempt=attempt + 1
+                ):
+                    result = merge_attempt(
+                        result, task, args, await attempt_async(task, args)
+                    )
+                result.latency += time.monotonic() - started
+                if result.status == "ok":
+                    break
+                if attempt < args.retries:
+                    await asyncio.sleep(backoff(attempt))
+        await asyncio.to_thread(manifest.write, result)
+        report(result)
+        return result
+
+    return await asyncio.gather(*(run_task(task) for task in tasks))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the agent over many tasks.")
+    parser.add_argument("tasks", type=str, help="JSONL file of tasks.")
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default="./results.jsonl",
+        help="JSONL file the results are appended to; tasks recorded as ok are skipped.",
+    )
+    parser.add_argument(
+        "--pool",
+        type=str,
+        default="thread",
+        choices=["thread", "process", "async"],
+        help="How tasks run concurrently.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Tasks running at the same time."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=1800,
+        help="Seconds one attempt of a task may take.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="Further attempts for a task that failed or timed out.",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print every hop of every agent."
+    )
+    parser.add_argument(
+        "--agent_type",
+        type=str,
+        default="reflect",
+        choices=list(AGENT_MAP),
+        help="Agent of the tasks that do not name one.",
+    )
+    add_agent_arguments(parser)
+    args = parser.parse_args()
+
+    tasks = load_tasks(args.tasks, args.agent_type)
+    done = load_done(args.manifest)
+    pending = [task for task in tasks if task.id not in done]
+    print(
+        f"!BATCH: {len(pending)} tasks to run, {len(tasks) - len(pending)} already done"
+    )
+
+    if args.cache:
+        # process workers open their own connection
+        set_cache(LLMCache(args.cache, ttl=args.cache_ttl))
+    # thread and async workers share this one; process workers build their own
+    set_governor(make_governor(args))
+    get_supervisor().pool.resize(args.launcher_pool)
+
+    manifest = Manifest(args.manifest)
+    tracer = Tracer()
+    with use_tracer(tracer):
+        if args.pool == "async":
+            results = asyncio.run(run_async(pending, args, manifest))
+        else:
+            results = run_pooled(pending, args, manifest)
+
+    ok = sum(result.status == "ok" for result in results)
+    print(f"!BATCH: {ok}/{len(results)} tasks ok, manifest in {args.manifest}")
+    print(f"!TRACE:\n{tracer.summary()}")
+    if args.trace:
+        tracer.export_jsonl(args.trace)
+    if args.otlp:
+        tracer.export_otlp(args.otlp)
@@ -0,0 +1,284 @@
+"""
+Offline benchmark of the agents: every task replays a scripted (or recorded)
+trajectory instead of calling the OpenAI API, so the numbers only move when
+the agent code does.
+
+    python3 -m benchmark --output bench.json
+    python3 -m benchmark --baseline bench.json   # exits 1 on a regression
+
+--record DIR runs the tasks against the live API and writes each trajectory to
+DIR/<task>.jsonl; --replay DIR replays them.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import urllib.request
+import urllib.error
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageDraw
+
+from agent import ReActAgent, ReflectAgent, SimpleCodeAgent
+from agent.app_runner import get_supervisor
+from agent.llm_utils import set_backend
+from agent.mock_llm import RecordingBackend, ScriptedBackend
+from agent.tracing import Tracer, use_tracer
+from benchmark.tasks import TASKS, BenchmarkTask
+
+STAGES = [
+    "llm",
+    "parse",
+    "file_io",
+    "preflight",
+    "app_startup",
+    "app_log",
+    "screenshot",
+    "image_encode",
+]
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.lines: List[str] = []
+
+    def handle_data(self, data: str):
+        if data.strip():
+            self.lines.append(data.strip())
+
+
+class OfflineReflectAgent(ReflectAgent):
+    """
+    ReflectAgent without a browser: a SEE fetches the page and draws its text,
+    so the app, the image pipeline and the encoding are still exercised.
+    """
+
+    def capture_screenshot(self, url):
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                html = response.read().decode("utf-8", errors="replace")
+        except (urllib.error.URLError, OSError) as error:
+            html = f"This site can't be reached: {error}"
+        extractor = _TextExtractor()
+        extractor.feed(html)
+
+        width, height = self.browser_options.width, self.browser_options.height
+        image = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(image)
+        for row, line in enumerate(extractor.lines[: height // 20]):
+            draw.text((20, 20 + row * 20), line[:200], fill="black")
+        return image
+
+
+AGENTS = {
+    "simple": SimpleCodeAgent,
+    "react": ReActAgent,
+    "reflect": OfflineReflectAgent,
+}
+
+
+def check_app(agent, checks) -> Optional[bool]:
+    """Whether every checked page of the agent's app contains its text."""
+    port = getattr(agent, "port", None)
+    if port is None:
+        return None
+    for path, expected in checks:
+        try:
+            url = f"http://127.0.0.1:{port}{path}"
+            with urllib.request.urlopen(url, timeout=5) as response:
+                body = response.read().decode("utf-8", errors="replace")
+        except (urllib.error.URLError, OSError):
+            return False
+        if expected not in body:
+            return False
+    return True
+
+
+def make_backend(task: BenchmarkTask, args):
+    if args.record:
+        path = os.path.join(args.record, f"{task.name}.jsonl")
+        os.makedirs(args.record, exist_ok=True)
+        open(path, "w").close()
+        return RecordingBackend(path)
+    if args.replay:
+        path = os.path.join(args.replay, f"{task.name}.jsonl")
+        return ScriptedBackend.from_file(path, latency=args.llm_latency)
+    return ScriptedBackend(task.responses, latency=args.llm_latency)
+
+
+def run_task(task: BenchmarkTask, agent_type: str, args) -> Dict:
+    set_backend(make_backend(task, args))
+    agent = AGENTS[agent_type](argparse.Namespace(model=args.model, stream=args.stream))
+    kwargs = {"max_hop": task.max_hop}
+    if agent_type != "simple":
+        kwargs["VERBOSE"] = args.verbose
+
+    tracer = Tracer()
+    try:
+        started = time.perf_counter()
+        with use_tracer(tracer):
+            agent.run(task.instruction, **kwargs)
+        wall = time.perf_counter() - started
+        success = check_app(agent, task.checks)
+    finally:
+        set_backend(None)
+        if getattr(agent, "workspace", None):
+            get_supervisor().stop(agent.workspace)
+
+    totals = tracer.totals()
+    return {
+        "task": task.name,
+        "agent": agent_type,
+        "success": success,
+        "hops": agent.hops,
+        "hops_to_success": agent.hops if success else None,
+        "prompt_tokens": sum(record.prompt_tokens for record in agent.usage),
+        "completion_tokens": sum(record.completion_tokens for record in agent.usage),
+        "wall": wall,
+        "stages": {name: seconds for name, (count, seconds) in totals.items()},
+    }
+
+
+def run_repeated(task: BenchmarkTask, agent_type: str, args) -> Dict:
+    """Runs a task `args.repeat` times; timings are the medians."""
+    runs = [run_task(task, agent_type, args) for _ in range(args.repeat)]
+    result = dict(runs[-1])
+    result["wall"] = statistics.median(run["wall"] for run in runs)
+    names = {name for run in runs for name in run["stages"]}
+    result["stages"] = {
+        name: statistics.median(run["stages"].get(name, 0.0) for run in runs)
+        for name in names
+    }
+    return result
+
+
+def print_table(results: List[Dict]):
+    header = ["task", "agent", "ok", "hops", "tokens", "wall"] + STAGES
+    rows = [header]
+    for result in results:
+        rows.append(
+            [
+                result["task"],
+                result["agent"],
+                {True: "yes", False: "no", None: "-"}[result["success"]],
+                str(result["hops"]),
+                f"{result['prompt_tokens']}+{result['completion_tokens']}",
+                f"{result['wall']:.2f}s",
+            ]
+            + [f"{result['stages'].get(name, 0.0) * 1000:.0f}ms" for name in STAGES]
+        )
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def regressions(
+    results: List[Dict], baseline: List[Dict], tolerance: float
+) -> List[str]:
+    """What got worse than the baseline run (timings get `tolerance` and 0.2s of slack)."""
+    previous = {(result["task"], result["agent"]): result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get((result["task"], result["agent"]))
+        if before is None:
+            continue
+        name = f"{result['task']}/{result['agent']}"
+        if before["success"] and not result["success"]:
+            found.append(f"{name}: no longer succeeds")
+        if (result["hops"] or 0) > (before["hops"] or 0):
+            found.append(f"{name}: {before['hops']} -> {result['hops']} hops")
+        tokens = result["prompt_tokens"] + result["completion_tokens"]
+        tokens_before = before["prompt_tokens"] + before["completion_tokens"]
+        if tokens > tokens_before * (1 + tolerance):
+            found.append(f"{name}: {tokens_before} -> {tokens} tokens")
+        if result["wall"] > before["wall"] * (1 + tolerance) + 0.2:
+            found.append(f"{name}: {before['wall']:.2f}s -> {result['wall']:.2f}s")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline agent benchmark.")
+    parser.add_argument(
+        "--agent_types",
+        nargs="+",
+        default=["react", "reflect"],
+        choices=list(AGENTS),
+        help="Agents to benchmark.",
+    )
+    parser.add_argument(
+        "--tasks",
+        nargs="+",
+        default=[task.name for task in TASKS],
+        choices=[task.name for task in TASKS],
+        help="Tasks to run.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Runs per task; timings are medians."
+    )
+    parser.add_argument(
+        "--llm_latency",
+        type=float,
+        default=0.0,
+        help="Seconds the scripted model waits per call.",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="gpt-4-turbo",
+        help="Model name passed to the backend (used by --record).",
+    )
+    parser.add_argument("--stream", action="store_true", help="Stream the responses.")
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="Run against the live API and record the trajectories into this directory.",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        default=None,
+        help="Replay the trajectories recorded into this directory.",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Write the results to this JSON file."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Compare with the results of an earlier --output; exit 1 on a regression.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative growth of time or tokens still accepted against --baseline.",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print every hop.")
+    args = parser.parse_args()
+
+    tasks = [task for task in TASKS if task.name in args.tasks]
+    results = [
+        run_repeated(task, agent_type, args)
+        for task in tasks
+        for agent_type in args.agent_types
+    ]
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)["results"]
+        found = regressions(results, baseline, args.tolerance)
+        for regression in found:
+            print(f"!REGRESSION: {regression}")
+        sys.exit(1 if found else 0)
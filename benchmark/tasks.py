@@ -0,0 +1,300 @@
+"""
+The fixed benchmark tasks. Each one comes with a scripted trajectory (the
+responses a model would give, hop by hop) and the checks the served app must
+pass afterwards.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+
+@dataclass
+class BenchmarkTask:
+    name: str
+    instruction: str
+    responses: List[str]
+    # (path, text the page must contain) once the agent is done
+    checks: List[Tuple[str, str]] = field(default_factory=list)
+    max_hop: int = 10
+
+
+def fenced(language: str, code: str) -> str:
+    return f"```{language}\n{code.rstrip()}\n```\n"
+
+
+HELLO_APP = """import os
+from flask import Flask
+
+app = Flask(__name__)
+
+
+@app.route("/")
+def index():
+    return "<h1>Hello World</h1>"
+
+
+if __name__ == "__main__":
+    app.run(port=int(os.environ["PORT"]))
+"""
+
+TODO_APP = """import os
+from flask import Flask, redirect, render_template, request, url_for
+
+app = Flask(__name__)
+todos = []
+
+
+@app.route("/")
+def index():
+    return render_template("index.html", todos=todos)
+
+
+@app.route("/add", methods=["POST"])
+def add():
+    item = request.form.get("item", "").strip()
+    if item:
+        todos.append(item)
+    return redirect(url_for("index"))
+
+
+@app.route("/delete/<int:index>", methods=["POST"])
+def delete(index):
+    if 0 <= index < len(todos):
+        todos.pop(index)
+    return redirect(url_for("index"))
+
+
+if __name__ == "__main__":
+    app.run(port=int(os.environ["PORT"]))
+"""
+
+TODO_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Todo</title>
+    <link rel="stylesheet" href="{{ url_for('static', filename='style.css') }}">
+</head>
+<body>
+    <div class="card">
+        <h1>Todo</h1>
+        <form action="/add" method="post">
+            <input name="item" placeholder="What needs to be done?">
+            <button type="submit">Add</button>
+        </form>
+        <ul>
+            {% for todo in todos %}
+            <li>
+                {{ todo }}
+                <form action="/delete/{{ loop.index0 }}" method="post">
+                    <button type="submit">Delete</button>
+                </form>
+            </li>
+            {% endfor %}
+        </ul>
+    </div>
+</body>
+</html>
+"""
+
+TODO_STYLE = """body {
+    background: #e0e5ec;
+    font-family: sans-serif;
+    display: flex;
+    justify-content: center;
+    padding-top: 60px;
+}
+
+.card {
+    border-radius: 20px;
+    padding: 30px;
+    background: #e0e5ec;
+    box-shadow: 9px 9px 16px #a3b1c6, -9px -9px 16px #ffffff;
+}
+
+input, button {
+    border: none;
+    border-radius: 10px;
+    padding: 10px;
+    background: #e0e5ec;
+    box-shadow: inset 4px 4px 8px #a3b1c6, inset -4px -4px 8px #ffffff;
+}
+"""
+
+TETRIS_APP = """import os
+from flask import Flask, render_template
+
+app = Flask(__name__)
+
+
+@app.route("/")
+def index():
+    return render_template("index.html")
+
+
+if __name__ == "__main__":
+    app.run(port=int(os.environ["PORT"]))
+"""
+
+TETRIS_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Tetris</title>
+    <style>
+        body { background: #111; color: #eee; text-align: center; font-family: sans-serif; }
+        canvas { border: 2px solid #eee; background: #000; }
+    </style>
+</head>
+<body>
+    <h1>Tetris</h1>
+    <p>Score: <span id="score">0</span></p>
+    <canvas id="board" width="240" height="480"></canvas>
+    <script src="{{ url_for('static', filename='tetris.js') }}"></script>
+</body>
+</html>
+"""
+
+TETRIS_SCRIPT = """const COLS = 10, ROWS = 20, SIZE = 24;
+const canvas = document.getElementById("board");
+const context = canvas.getContext("2d");
+const SHAPES = [
+    [[1, 1, 1, 1]],
+    [[1, 1], [1, 1]],
+    [[0, 1, 0], [1, 1, 1]],
+    [[1, 0, 0], [1, 1, 1]],
+    [[0, 0, 1], [1, 1, 1]],
+    [[1, 1, 0], [0, 1, 1]],
+    [[0, 1, 1], [1, 1, 0]],
+];
+const COLORS = ["cyan", "yellow", "purple", "blue", "orange", "green", "red"];
+let board = Array.from({ length: ROWS }, () => Array(COLS).fill(0));
+let piece = null;
+let score = 0;
+let dropInterval = 500;
+
+function newPiece() {
+    const type = Math.floor(Math.random() * SHAPES.length);
+    return { shape: SHAPES[type], color: type + 1, x: 3, y: 0 };
+}
+
+function collides(shape, x, y) {
+    return shape.some((row, dy) => row.some((cell, dx) =>
+        cell && (x + dx < 0 || x + dx >= COLS || y + dy >= ROWS || board[y + dy][x + dx])));
+}
+
+function rotate(shape) {
+    return shape[0].map((_, i) => shape.map(row => row[i]).reverse());
+}
+
+function merge() {
+    piece.shape.forEach((row, dy) => row.forEach((cell, dx) => {
+        if (cell) board[piece.y + dy][piece.x + dx] = piece.color;
+    }));
+    const full = board.filter(row => row.every(cell => cell));
+    board = board.filter(row => !row.every(cell => cell));
+    while (board.length < ROWS) board.unshift(Array(COLS).fill(0));
+    score += full.length * 100;
+    document.getElementById("score").textContent = score;
+}
+
+function drop() {
+    if (!collides(piece.shape, piece.x, piece.y + 1)) {
+        piece.y += 1;
+        return;
+    }
+    merge();
+    piece = newPiece();
+    if (collides(piece.shape, piece.x, piece.y)) {
+        alert("Game over! Score: " + score);
+        board = Array.from({ length: ROWS }, () => Array(COLS).fill(0));
+        score = 0;
+    }
+}
+
+function draw() {
+    context.fillStyle = "black";
+    context.fillRect(0, 0, canvas.width, canvas.height);
+    const cells = board.map(row => row.slice());
+    piece.shape.forEach((row, dy) => row.forEach((cell, dx) => {
+        if (cell) cells[piece.y + dy][piece.x + dx] = piece.color;
+    }));
+    cells.forEach((row, y) => row.forEach((cell, x) => {
+        if (!cell) return;
+        context.fillStyle = COLORS[cell - 1];
+        context.fillRect(x * SIZE, y * SIZE, SIZE - 1, SIZE - 1);
+    }));
+}
+
+document.addEventListener("keydown", event => {
+    if (event.key === "ArrowLeft" && !collides(piece.shape, piece.x - 1, piece.y)) piece.x -= 1;
+    if (event.key === "ArrowRight" && !collides(piece.shape, piece.x + 1, piece.y)) piece.x += 1;
+    if (event.key === "ArrowDown") drop();
+    if (event.key === "ArrowUp") {
+        const rotated = rotate(piece.shape);
+        if (!collides(rotated, piece.x, piece.y)) piece.shape = rotated;
+    }
+    draw();
+});
+
+piece = newPiece();
+setInterval(() => { drop(); draw(); }, dropInterval);
+draw();
+"""
+
+TASKS = [
+    BenchmarkTask(
+        name="hello_world",
+        instruction="Please develop a webpage that displays hello world.",
+        responses=[
+            "# Action(WRITE(app.py))\n"
+            + fenced("python", HELLO_APP)
+            + "# Action(RUN(app.py))\n# See(/)\n",
+            "# Terminate\nThe hello world page is up.",
+        ],
+        checks=[("/", "Hello World")],
+    ),
+    BenchmarkTask(
+        name="todo_app",
+        instruction="Please develop a neumorphic style todo webpage where todos can be added and deleted.",
+        responses=[
+            "# Think\nA Flask app keeps the todos in memory and renders them with a template.\n"
+            "# Action(WRITE(app.py))\n"
+            + fenced("python", TODO_APP)
+            + "# Action(WRITE(templates/index.html))\n"
+            + fenced("html", TODO_TEMPLATE)
+            + "# Action(WRITE(static/style.css))\n"
+            + fenced("css", TODO_STYLE),
+            "# Action(RUN(app.py))\n# See(/)\n",
+            "# Action(PATCH(templates/index.html))\n"
+            + fenced(
+                "diff",
+                "<<<<<<< SEARCH\n        <h1>Todo</h1>\n=======\n"
+                "        <h1>My Todos</h1>\n>>>>>>> REPLACE",
+            )
+            + "# Action(RUN(app.py))\n# See(/)\n",
+            "# Action(LOG(app.py))\n",
+            "# Terminate\nThe todo app is up.",
+        ],
+        checks=[("/", "My Todos"), ("/static/style.css", "box-shadow")],
+    ),
+    BenchmarkTask(
+        name="tetris",
+        instruction="Please develop a tetris game webpage.",
+        responses=[
+            "# Action(WRITE(app.py))\n"
+            + fenced("python", TETRIS_APP)
+            + "# Action(WRITE(templates/index.html))\n"
+            + fenced("html", TETRIS_TEMPLATE),
+            "# Action(WRITE(static/tetris.js))\n" + fenced("javascript", TETRIS_SCRIPT),
+            "# Action(RUN(app.py))\n# See(/)\n",
+            "# Action(READ(static/tetris.js))\n",
+            "# Action(PATCH(static/tetris.js))\n"
+            + fenced(
+                "diff",
+                "@@ -17,1 +17,1 @@\n-let dropInterval = 500;\n+let dropInterval = 400;",
+            )
+            + "# Action(RUN(app.py))\n# See(/)\n",
+            "# Terminate\nThe tetris game is up.",
+        ],
+        checks=[("/", "<canvas"), ("/static/tetris.js", "dropInterval = 400")],
+    ),
+]
@@ -12,15 +12,32 @@ if you choose action you should also mention the type of action you are going to
 Type Should be exactly one of the following:
 - WRITE(file_name) file_name for example: app.py
     - if you choose WRITE you should also append full code block to the next line
+- PATCH(file_name) file_name for example: app.py
+    - change part of an existing file, append a code block of SEARCH/REPLACE blocks (or a unified diff) to the next line
 - READ(file_name) file_name for example: app.py
 - RUN(file_name) file_name for example: app.py
     - Execute the file and return the output of the file (this must be a python file)
+- LOG(file_name) file_name for example: app.py
+    - Return the full output of the running file so far (RUN only shows what is new)
+- REVERT(file_name or snapshot) for example: app.py or 2 or good
+    - Undo your last change to the file (again to go one more version back), or put every file back to a snapshot (each time the app comes up with RUN its files are saved as a numbered snapshot, "good" is the latest one). Prefer it over rewriting a file you broke.
 
 so for example, if you want to write the code to the app.py file you should write head of the conversation like this:
 # Action(WRITE(app.py))
 
 Unfortunatelly, you can not use any other type of action.
-If you want to edit the file you should use WRITE(file_name) action.
+You can take several actions in one response, they are taken in order (e.g. WRITE app.py, WRITE templates/index.html, then RUN app.py and See(/)). Write every file you already know in the same response instead of one file per response.
+If you want to change a few lines of a file use PATCH(file_name) action, to rewrite the whole file use WRITE(file_name) action.
+For example, to change the title in templates/index.html:
+# Action(PATCH(templates/index.html))
+```diff
+<<<<<<< SEARCH
+    <title>Old title</title>
+=======
+    <title>New title</title>
+>>>>>>> REPLACE
+```
+The SEARCH part must copy the current lines of the file exactly, you can add several SEARCH/REPLACE blocks.
 !! This also mean that you cannot breviate the code block.
 
 # See(Hosted URL)
@@ -28,6 +45,7 @@ After you launched the server, you can see the result by '# See' keyword.
 Make sure to check the result after you run the server.
 For example, if you want to see the result of the server http://127.0.0.1:8080 you can take action as:
 # See(http://127.0.0.1:8080)
+A path like '# See(/)' shows that page of the running app, so you can put it right after RUN in the same response.
 
 # Think
 You can also think before you take any action.
@@ -44,7 +62,7 @@ if you say terminal you should not generate any text or code block. It will be c
 
 
 !Tips
-- Port 5000, 8000 is in use by another program.
+- Serve the app on the port given in the PORT environment variable (e.g. `app.run(port=int(os.environ["PORT"]))`).
 - When you take Write Action you cannot breviate the code block. this will cause an error when you run the server.
 
 Make sure you follow these steps to complete the task:
@@ -3,7 +3,17 @@ from agent.llm_utils import (
     chatgpt_completion,
     chatgpt_completion_async,
     gpt4v_completion,
+    set_cache,
 )
+from agent.llm_cache import LLMCache
+from agent.rate_limit import Governor, RateLimits, RetryPolicy, set_governor
+from agent.exploration import ExplorationConfig, Explorer
+from agent.tracing import Tracer, span, use_tracer
+from agent.app_runner import get_supervisor
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from agent import SimpleCodeAgent, ReActAgent, ReflectAgent
 
@@ -13,21 +23,266 @@ AGENT_MAP = {"simple": SimpleCodeAgent, "react": ReActAgent, "reflect": ReflectA
 def run(args):
     agent = AGENT_MAP[args.agent_type](args)
 
-    responses = agent.run(args.instruction)
+    with span("run", agent=args.agent_type):
+        responses = agent.run(args.instruction)
+    export_snapshot(agent, args)
 
     print(f"!DONE: {responses}")
 
 
-if __name__ == "__main__":
-    import argparse
+def export_snapshot(agent, args):
+    """Writes the best-known-good files of the agent to `args.export`."""
+    snapshots = getattr(agent, "snapshots", None)
+    if not args.export or snapshots is None:
+        return
+    snapshot = snapshots.export(args.export)
+    if snapshot is not None:
+        print(f"!EXPORT: snapshot {snapshot.id} ({snapshot.label}) in {args.export}")
 
-    parser = argparse.ArgumentParser(description="Run the agent.")
+
+async def explore(args):
+    """Runs `args.best_of` trajectories of the instruction and keeps the best one."""
+    explorer = Explorer(
+        lambda: AGENT_MAP[args.agent_type](args), ExplorationConfig.from_args(args)
+    )
+    with span("run", agent=args.agent_type, best_of=args.best_of):
+        best = await explorer.run(args.instruction)
+    print(f"!DONE: {[best.response]}")
+    print(f"!BEST: {best.describe()}")
+    export_snapshot(best.agent, args)
+
+
+def concurrency_limit(workers: int) -> asyncio.Semaphore:
+    """
+    A semaphore letting `workers` agents run at once under the running event
+    loop, which gets as many worker threads.
+    """
+    # each agent blocks at most one worker thread at a time (file I/O, app, browser)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=workers)
+    )
+    return asyncio.Semaphore(workers)
+
+
+async def run_batch(args):
+    """Runs every instruction of `args.instructions_file` under one event loop."""
+    with open(args.instructions_file, "r") as file:
+        instructions = [line.strip() for line in file if line.strip()]
+
+    semaphore = concurrency_limit(args.concurrency)
+
+    async def run_one(instruction: str):
+        async with semaphore:
+            agent = AGENT_MAP[args.agent_type](args)
+            with span("run", agent=args.agent_type):
+                return await agent.arun(instruction)
+
+    results = await asyncio.gather(
+        *(run_one(instruction) for instruction in instructions),
+        return_exceptions=True,
+    )
+    for instruction, responses in zip(instructions, results):
+        print(f"!DONE: [{instruction}] {responses}")
+
+
+def add_agent_arguments(parser):
+    """The options of the agents and of the services they share (run.py and batch.py)."""
     parser.add_argument(
         "--model",
         type=str,
         default="gpt-4-turbo",
         help="The model to use for the conversation.",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream responses and dispatch actions as soon as they are complete.",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        nargs="?",
+        const="./.llm_cache.sqlite",
+        default=None,
+        help="Cache model responses in this SQLite file (default: ./.llm_cache.sqlite).",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=float,
+        default=None,
+        help="Seconds after which a cached response expires.",
+    )
+    parser.add_argument(
+        "--image_max_width",
+        type=int,
+        default=1280,
+        help="Screenshots are downscaled to fit this width.",
+    )
+    parser.add_argument(
+        "--image_max_height",
+        type=int,
+        default=720,
+        help="Screenshots are downscaled to fit this height.",
+    )
+    parser.add_argument(
+        "--image_max_tiles",
+        type=int,
+        default=None,
+        help="Downscale screenshots further until they fit this many 512px tiles.",
+    )
+    parser.add_argument(
+        "--image_format",
+        type=str,
+        default="JPEG",
+        choices=["JPEG", "WEBP"],
+        help="Encoding of screenshots sent to the model.",
+    )
+    parser.add_argument(
+        "--image_quality",
+        type=int,
+        default=80,
+        help="Encoding quality of screenshots sent to the model.",
+    )
+    parser.add_argument(
+        "--keep_images",
+        type=int,
+        default=3,
+        help="Keep only the last N screenshots in the conversation.",
+    )
+    parser.add_argument(
+        "--browser_pool_size",
+        type=int,
+        default=2,
+        help="The number of headless browsers kept warm for screenshots.",
+    )
+    parser.add_argument(
+        "--full_page",
+        action="store_true",
+        help="Capture the whole scrollable page instead of the viewport.",
+    )
+    parser.add_argument(
+        "--run_timeout",
+        type=float,
+        default=15.0,
+        help="Seconds a RUN action waits for the app to come up.",
+    )
+    parser.add_argument(
+        "--health_path",
+        type=str,
+        default=None,
+        help="If set, a RUN counts as up only once this path answers HTTP 200.",
+    )
+    parser.add_argument(
+        "--log_budget",
+        type=int,
+        default=4000,
+        help="Maximum bytes of app output put into one observation.",
+    )
+    parser.add_argument(
+        "--context_budget",
+        type=int,
+        default=24000,
+        help="Summarize older turns once the prompt exceeds this many tokens (0 disables).",
+    )
+    parser.add_argument(
+        "--keep_turns",
+        type=int,
+        default=8,
+        help="The number of most recent messages always sent verbatim.",
+    )
+    parser.add_argument(
+        "--keep_stale_files",
+        action="store_true",
+        help="Keep file contents a later version supersedes instead of replacing them by a reference.",
+    )
+    parser.add_argument(
+        "--stable_prefix",
+        action="store_true",
+        help="Send an append-only history so the provider's prompt cache can hit.",
+    )
+    parser.add_argument(
+        "--no_preflight",
+        action="store_true",
+        help="Do not check written files (syntax, imports, templates) before they are run.",
+    )
+    parser.add_argument(
+        "--launcher_pool",
+        type=int,
+        default=2,
+        help="Interpreters kept started (with Flask imported) for launching apps; 0 starts one only when an app is launched.",
+    )
+    parser.add_argument(
+        "--app_cpu_seconds",
+        type=int,
+        default=None,
+        help="CPU seconds a launched app may use before it is killed.",
+    )
+    parser.add_argument(
+        "--app_memory_mb",
+        type=int,
+        default=None,
+        help="Address space (MB) a launched app may allocate.",
+    )
+    parser.add_argument(
+        "--app_wall_seconds",
+        type=float,
+        default=None,
+        help="Seconds a launched app may run before it is stopped.",
+    )
+    parser.add_argument(
+        "--app_open_files",
+        type=int,
+        default=None,
+        help="File descriptors a launched app may have open.",
+    )
+    parser.add_argument(
+        "--app_processes",
+        type=int,
+        default=None,
+        help="Processes a launched app may run (a cgroup's pids.max where available, else the user's RLIMIT_NPROC).",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help="Requests per minute allowed per model (default: unlimited).",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="Tokens per minute allowed per model (default: unlimited).",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=5,
+        help="Retries of a model call after a rate limit, timeout or server error.",
+    )
+    parser.add_argument(
+        "--hedge_after",
+        type=float,
+        default=None,
+        help="Send a second request when a model call takes longer than this many seconds.",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write every span (hop, model call, action) to this JSONL file.",
+    )
+    parser.add_argument(
+        "--otlp",
+        type=str,
+        default=None,
+        help="Write the spans to this file as an OpenTelemetry (OTLP/JSON) trace.",
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the agent.")
     parser.add_argument(
         "--instruction",
         type=str,
@@ -40,6 +295,87 @@ if __name__ == "__main__":
         default="simple",
         help="The type of agent to run (simple, react etc.).",
     )
+    parser.add_argument(
+        "--instructions_file",
+        type=str,
+        default=None,
+        help="Batch mode: a file with one instruction per line, run concurrently.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Batch mode: the maximum number of agents running at once.",
+    )
+    parser.add_argument(
+        "--keep_app_running",
+        action="store_true",
+        help="Keep the launched apps serving after the agent finished (until Ctrl-C).",
+    )
+    parser.add_argument(
+        "--best_of",
+        type=int,
+        default=1,
+        help="Run this many trajectories at once and keep the first one the vision check approves.",
+    )
+    parser.add_argument(
+        "--prune_after",
+        type=int,
+        default=8,
+        help="With --best_of, cancel trajectories scoring below the leader after this many hops.",
+    )
+    parser.add_argument(
+        "--judge_model",
+        type=str,
+        default=None,
+        help="Vision model ranking --best_of trajectories (default: --model).",
+    )
+    parser.add_argument(
+        "--export",
+        type=str,
+        default=None,
+        help="Write the files of the last snapshot the app came up with to this directory.",
+    )
+    add_agent_arguments(parser)
     args = parser.parse_args()
+    # trajectories are stepped hop by hop, the simple agent answers in one call
+    if args.best_of > 1 and args.agent_type not in ("react", "reflect"):
+        parser.error(f"--best_of needs a react or reflect agent, not {args.agent_type}")
+
+    if args.cache:
+        cache = LLMCache(args.cache, ttl=args.cache_ttl)
+        set_cache(cache)
+    set_governor(
+        Governor(
+            default_limits=RateLimits.from_args(args),
+            policy=RetryPolicy.from_args(args),
+        )
+    )
+
+    get_supervisor().pool.resize(args.launcher_pool)
+
+    tracer = Tracer()
+    with use_tracer(tracer):
+        if args.instructions_file:
+            asyncio.run(run_batch(args))
+        elif args.best_of > 1:
+            asyncio.run(explore(args))
+        else:
+            run(args)
+
+    print(f"!TRACE:\n{tracer.summary()}")
+    if args.trace:
+        tracer.export_jsonl(args.trace)
+    if args.otlp:
+        tracer.export_otlp(args.otlp)
+
+    if args.cache:
+        print(f"!CACHE: {cache.stats()}")
 
-    run(args)
+    if args.keep_app_running:
+        # launched apps are stopped when this process exits
+        print("Apps are still running, press Ctrl-C to stop them.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,168 @@
+from agent.action_parser import StreamingActionParser, batch_actions, parse_actions
+
+
+def kinds(response: str):
+    return [(action.kind, action.target) for action in parse_actions(response)]
+
+
+def stream(response: str, chunk: int = 3) -> StreamingActionParser:
+    parser = StreamingActionParser()
+    for start in range(0, len(response), chunk):
+        if parser.feed(response[start : start + chunk]):
+            break
+    return parser
+
+
+WRITE_THEN_RUN = """# Think
+The app needs a route.
+# Action(WRITE(app.py))
+```python
+print("hello")
+```
+# Action(RUN(app.py))
+"""
+
+
+def test_write_body_and_offsets():
+    write = parse_actions(WRITE_THEN_RUN)[1]
+    assert (write.kind, write.target) == ("WRITE", "app.py")
+    assert write.body == 'print("hello")'
+    assert WRITE_THEN_RUN[write.start : write.header_end] == "# Action(WRITE(app.py))"
+    assert WRITE_THEN_RUN[write.end - 3 : write.end] == "```"
+
+
+def test_think_does_not_hide_the_actions_after_it():
+    actions = parse_actions(WRITE_THEN_RUN)
+    assert [action.kind for action in actions] == ["THINK", "WRITE", "RUN"]
+    assert actions[0].body == "The app needs a route."
+
+
+def test_headers_inside_code_blocks_are_code():
+    response = """# Action(WRITE(README.md))
+```markdown
+# Action(RUN(app.py))
+# See(/)
+```
+# Action(RUN(app.py))
+"""
+    assert kinds(response) == [("WRITE", "README.md"), ("RUN", "app.py")]
+    assert parse_actions(response)[0].body == "# Action(RUN(app.py))\n# See(/)"
+
+
+def test_nested_fence_with_a_language_does_not_close_the_block():
+    response = """# Action(WRITE(notes.md))
+```
+text
+```python
+code
+```
+# Action(RUN(app.py))
+"""
+    write = parse_actions(response)[0]
+    assert write.body == "text\n```python\ncode"
+    assert kinds(response)[-1] == ("RUN", "app.py")
+
+
+def test_write_without_a_code_block():
+    assert (
+        parse_actions("# Action(WRITE(app.py))\n# Action(RUN(app.py))")[0].body is None
+    )
+
+
+def test_run_followed_by_see_and_terminate():
+    response = "# Action(RUN(app.py))\n# See(/)\n# See(http://127.0.0.1:5000/about)\n# Terminate\n"
+    assert kinds(response) == [
+        ("RUN", "app.py"),
+        ("SEE", "/"),
+        ("SEE", "http://127.0.0.1:5000/about"),
+        ("TERMINATE", None),
+    ]
+
+
+def test_batches_of_distinct_files_run_together():
+    response = """# Action(WRITE(a.py))
+```
+a
+```
+# Action(WRITE(b.py))
+```
+b
+```
+# Action(PATCH(./a.py))
+```
+x
+```
+# Action(RUN(a.py))
+"""
+    batches = batch_actions(list(parse_actions(response)))
+    assert [[action.target for action in batch] for batch in batches] == [
+        ["a.py", "b.py"],
+        ["./a.py"],
+        ["a.py"],
+    ]
+
+
+def test_stream_stops_after_a_stopping_action():
+    parser = stream(WRITE_THEN_RUN + "Some trailing text the model should not write.\n")
+    assert parser.complete
+    assert parser.action_type == "RUN"
+    assert parser.response.rstrip() == WRITE_THEN_RUN.rstrip()
+
+
+def test_stream_keeps_see_after_run():
+    response = "# Action(RUN(app.py))\n# See(/)\n# See(/about)\nThen I will check it.\n"
+    parser = stream(response)
+    assert parser.action_type == "SEE"
+    assert kinds(parser.response) == [
+        ("RUN", "app.py"),
+        ("SEE", "/"),
+        ("SEE", "/about"),
+    ]
+
+
+def test_stream_ignores_stopping_headers_inside_code_blocks():
+    response = """# Action(WRITE(README.md))
+```
+# Action(RUN(app.py))
+```
+# Action(WRITE(app.py))
+```
+print(1)
+```
+"""
+    parser = stream(response)
+    assert not parser.complete
+    assert parser.response == response
+
+
+def test_stream_ready_actions_stop_at_other_actions():
+    response = """# Think
+plan
+# Action(WRITE(a.py))
+```
+a
+```
+# Action(PATCH(a.py))
+```
+x
+```
+# Action(REVERT(a.py))
+# Action(WRITE(b.py))
+```
+b
+```
+# Action(RUN(a.py))
+"""
+    parser = StreamingActionParser()
+    ready = []
+    for start in range(0, len(response), 4):
+        stopped = parser.feed(response[start : start + 4])
+        ready += parser.ready_actions()
+        if stopped:
+            break
+    assert [(action.kind, action.target) for action in ready] == [
+        ("WRITE", "a.py"),
+        ("PATCH", "a.py"),
+    ]
+    # equal to the actions of the whole response, so they are not taken twice
+    assert ready == list(parse_actions(parser.response)[1:3])
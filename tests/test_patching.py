@@ -0,0 +1,136 @@
+import pytest
+
+from agent.patching import PatchConflict, apply_patch, parse_patch
+
+APP = """from flask import Flask
+
+app = Flask(__name__)
+
+
+@app.route("/")
+def index():
+    return "hello"
+
+
+if __name__ == "__main__":
+    app.run()"""
+
+
+def search_replace(search: str, replace: str) -> str:
+    return f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE"
+
+
+def test_exact_match():
+    patched, hunks = apply_patch(
+        APP, search_replace('    return "hello"', '    return "hello world"')
+    )
+    assert hunks == 1
+    assert '    return "hello world"' in patched
+    assert patched.replace('"hello world"', '"hello"') == APP
+
+
+def test_several_hunks_apply_in_order():
+    patch = "\n".join(
+        [
+            search_replace("def index():", "def home():"),
+            search_replace('    return "hello"', '    return "home"'),
+        ]
+    )
+    patched, hunks = apply_patch(APP, patch)
+    assert hunks == 2
+    assert 'def home():\n    return "home"' in patched
+
+
+def test_whitespace_differences_are_ignored():
+    patched, _ = apply_patch(
+        APP,
+        search_replace('def index():\n  return  "hello"', "def index():\n    return 1"),
+    )
+    assert "def index():\n    return 1\n" in patched
+
+
+def test_fuzzy_match_of_a_slightly_wrong_search():
+    # "helo" is a typo, no exact or whitespace-insensitive match exists
+    patched, _ = apply_patch(
+        APP,
+        search_replace(
+            '@app.route("/")\ndef index():\n    return "helo"',
+            '@app.route("/")\ndef index():\n    return "fixed"',
+        ),
+    )
+    assert 'return "fixed"' in patched
+    assert 'return "hello"' not in patched
+
+
+def test_repeated_search_text_is_a_conflict():
+    content = "a = 1\nb = 2\na = 1"
+    with pytest.raises(PatchConflict, match="matches 2 places"):
+        apply_patch(content, search_replace("a = 1", "a = 3"))
+
+
+def test_near_tie_of_fuzzy_matches_is_a_conflict():
+    content = "\n".join(
+        [
+            "def first():",
+            "    total = compute(1)",
+            "    return total",
+            "",
+            "def second():",
+            "    total = compute(2)",
+            "    return total",
+        ]
+    )
+    # as close to either function
+    search = "def xxxxx():\n    total = compute(3)\n    return total"
+    with pytest.raises(PatchConflict, match="about as similar to several places"):
+        apply_patch(content, search_replace(search, "pass"))
+
+
+def test_missing_lines_are_a_conflict_and_show_the_closest():
+    with pytest.raises(PatchConflict, match="Could not find these lines") as error:
+        apply_patch(APP, search_replace("import os\nimport sys", "import re"))
+    assert "Hunk 1 of 1" in str(error.value)
+
+
+def test_a_failing_hunk_rejects_the_whole_patch():
+    patch = "\n".join(
+        [
+            search_replace("def index():", "def home():"),
+            search_replace("this line is not there at all", "x"),
+        ]
+    )
+    with pytest.raises(PatchConflict, match="Hunk 2 of 2"):
+        apply_patch(APP, patch)
+
+
+def test_unified_diff():
+    diff = """--- a/app.py
++++ b/app.py
+@@ -6,3 +6,3 @@
+ @app.route("/")
+ def index():
+-    return "hello"
++    return "hello from a diff"
+"""
+    patched, hunks = apply_patch(APP, diff)
+    assert hunks == 1
+    assert '    return "hello from a diff"' in patched
+
+
+def test_unified_diff_blank_context_lines_and_trailing_fence_lines():
+    hunks = parse_patch("@@ -1,3 +1,3 @@\n a\n\n-b\n+c\n\n")
+    assert len(hunks) == 1
+    assert hunks[0].search == "a\n\nb"
+    assert hunks[0].replace == "a\n\nc"
+
+
+def test_no_patch_is_a_conflict():
+    with pytest.raises(PatchConflict, match="No patch found"):
+        apply_patch(APP, "just some text")
+
+
+def test_empty_search_writes_an_empty_file_only():
+    patched, _ = apply_patch("", search_replace("", "print(1)"))
+    assert patched == "print(1)"
+    with pytest.raises(PatchConflict, match="no lines to search for"):
+        apply_patch(APP, search_replace("", "print(1)"))
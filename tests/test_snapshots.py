@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from agent.snapshots import SnapshotStore, revert
+
+
+@pytest.fixture
+def store(tmp_path):
+    workspace = tmp_path / "workspace" / "run"
+    workspace.mkdir(parents=True)
+    return SnapshotStore(str(workspace))
+
+
+def write(store: SnapshotStore, file_name: str, content: str):
+    """What the agent does on WRITE/PATCH."""
+    path = os.path.join(store.workspace, file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+    store.record(file_name, content)
+
+
+def read(store: SnapshotStore, file_name: str) -> str:
+    with open(os.path.join(store.workspace, file_name)) as file:
+        return file.read()
+
+
+def test_revert_steps_one_version_back_each_time(store):
+    for content in ("A", "B", "C"):
+        write(store, "app.py", content)
+    assert revert(store, "app.py") is not None
+    assert read(store, "app.py") == "B"
+    assert revert(store, "app.py") is not None
+    assert read(store, "app.py") == "A"
+    assert revert(store, "app.py") is None
+    assert read(store, "app.py") == "A"
+
+
+def test_revert_after_a_new_write_undoes_that_write(store):
+    for content in ("A", "B"):
+        write(store, "app.py", content)
+    revert(store, "app.py")
+    write(store, "app.py", "C")
+    revert(store, "app.py")
+    assert read(store, "app.py") == "A"
+
+
+def test_revert_of_an_unknown_or_single_version_file(store):
+    assert revert(store, "missing.py") is None
+    write(store, "app.py", "A")
+    assert revert(store, "app.py") is None
+
+
+def test_file_names_are_normalized(store):
+    write(store, "templates/index.html", "one")
+    write(store, "./templates/index.html", "two")
+    revert(store, "templates/./index.html")
+    assert read(store, "templates/index.html") == "one"
+
+
+def test_commit_skips_unchanged_files(store):
+    write(store, "app.py", "A")
+    first = store.commit("hop 1")
+    assert store.commit("hop 2") is first
+    write(store, "app.py", "B")
+    assert store.commit("hop 3").id == 2
+
+
+def test_restore_a_snapshot(store):
+    write(store, "app.py", "A")
+    write(store, "templates/index.html", "page")
+    first = store.commit("hop 1")
+    write(store, "app.py", "B")
+    write(store, "static/style.css", "body {}")
+    store.commit("hop 2")
+
+    message = revert(store, str(first.id))
+    assert "app.py" in message and "static/style.css" in message
+    assert read(store, "app.py") == "A"
+    assert read(store, "templates/index.html") == "page"
+    assert not os.path.exists(os.path.join(store.workspace, "static/style.css"))
+    assert revert(store, "1") == "The workspace already matches snapshot 1."
+
+
+def test_revert_good_restores_the_last_snapshot_the_app_came_up_with(store):
+    write(store, "app.py", "working")
+    good = store.mark_good("hop 1, app.py up")
+    write(store, "app.py", "broken")
+    store.commit("hop 2")
+    assert store.best() is good
+    revert(store, "good")
+    assert read(store, "app.py") == "working"
+
+
+def test_revert_to_an_unknown_snapshot(store):
+    assert revert(store, "good") is None
+    assert revert(store, "3") is None
+
+
+def test_identical_files_share_one_blob(tmp_path):
+    first = SnapshotStore(str(tmp_path / "workspace" / "a"))
+    second = SnapshotStore(str(tmp_path / "workspace" / "b"))
+    assert first.record("app.py", "same") == second.record("app.py", "same")
+    assert first.blobs.root == second.blobs.root